@@ -13,18 +13,26 @@ import os
 
 from django.core.asgi import get_asgi_application
 from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 
-from rebot.routing import websocket_urlpatterns
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'admin.settings')
 
+django_asgi_app = get_asgi_application()
+
+from rebot.routing import websocket_urlpatterns as rebot_websocket_urlpatterns
+from recommendations.routing import websocket_urlpatterns as tasks_websocket_urlpatterns
+from recommendations.workers import TASK_GENERATION_CHANNEL, TaskGenerationWorker
+
 application = ProtocolTypeRouter({
-    'http':get_asgi_application(),
+    'http':django_asgi_app,
     'websocket': AllowedHostsOriginValidator(
         AuthMiddlewareStack(
-            URLRouter(websocket_urlpatterns)
+            URLRouter(rebot_websocket_urlpatterns + tasks_websocket_urlpatterns)
         )
     ),
+    # Background workers: python manage.py runworker task-generation
+    'channel': ChannelNameRouter({
+        TASK_GENERATION_CHANNEL: TaskGenerationWorker.as_asgi(),
+    }),
 })
\ No newline at end of file
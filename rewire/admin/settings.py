@@ -81,15 +81,173 @@ TEMPLATES = [
 WSGI_APPLICATION = 'admin.wsgi.application'
 ASGI_APPLICATION = "admin.asgi.application"
 
+# Groups and channels are sharded over these Redis nodes (comma-separated URLs) on a
+# consistent-hash ring; after changing the list run rebalance_channel_layer
+CHANNEL_REDIS_URLS = os.getenv("CHANNEL_REDIS_URLS", "redis://redis:6379").split(",")
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "core.channel_layers.ShardedRedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis", 6379)],
+            "hosts": CHANNEL_REDIS_URLS,
+            # Connections per node per event loop
+            "pool_size": 50,
+            # Per-channel inbox size; consumers drain it into their own bounded
+            # outbound queue, so a slow client never fills it up
+            "capacity": 1500,
+            "expiry": 30,
         },
     },
 }
 
+# Outbound WebSocket frames are queued per connection and only handed to Daphne
+# while its socket buffer for the client is below Twisted's high-water mark; when
+# a client falls this many frames behind, the oldest frame is dropped
+# ("drop_oldest"), after first merging frames of the same kind such as stats
+# snapshots ("coalesce")
+WEBSOCKET_QUEUE_SIZE = 100
+WEBSOCKET_QUEUE_POLICY = "coalesce"
+
+# Clients that negotiate the rewire.msgpack.z subprotocol get frames of at
+# least this many bytes zlib-compressed (JSON stays the default protocol)
+WEBSOCKET_COMPRESS_MIN_SIZE = 1024
+# Compressed frames from clients are rejected once they inflate past this many bytes
+WEBSOCKET_MAX_INBOUND_SIZE = 64 * 1024
+
+# Rebot room broadcasts are batched into one frame per room per tick (seconds)
+REBOT_BATCH_TICK = 0.05
+
+# Rebot replies: provider (dotted path), model and per-room context bounds
+REBOT_REPLY_PROVIDER = "rebot.providers.OpenAIReplyProvider"
+REBOT_MODEL = "gpt-4"
+REBOT_CONTEXT_TOKENS = 2000
+REBOT_MAX_ROOMS = 1000
+
+# Rebot replies cost an LLM call: users get a bucket of REBOT_USER_BURST messages
+# refilled at REBOT_USER_PER_MINUTE, and a reply or summary gives up after
+# REBOT_REPLY_TIMEOUT seconds
+REBOT_USER_BURST = 5
+REBOT_USER_PER_MINUTE = 10
+REBOT_REPLY_TIMEOUT = 60
+# Longest message (characters) a user can send to Rebot
+REBOT_MAX_MESSAGE_LENGTH = 2000
+
+# Rebot history: write-behind flush thresholds and page size
+REBOT_HISTORY_FLUSH_SIZE = 50
+REBOT_HISTORY_FLUSH_MS = 500
+REBOT_HISTORY_PAGE_SIZE = 50
+
+# Keyset pagination of the task list endpoint
+TASK_LIST_PAGE_SIZE = 20
+TASK_LIST_MAX_PAGE_SIZE = 100
+
+# Stats deltas pushed to TaskConsumer are coalesced per user over this many seconds
+TASK_EVENT_COALESCE_WINDOW = 0.5
+
+# Task list changes kept per user for delta-sync resumption; clients further behind get a snapshot
+TASK_CHANGE_LOG_SIZE = 200
+
+# Background generation jobs (manage.py runworker task-generation). A job still PENDING after
+# TASK_GENERATION_JOB_QUEUE_TIMEOUT seconds was dropped by the channel layer (keep it above the
+# layer's expiry), one still RUNNING after TASK_GENERATION_JOB_TIMEOUT lost its worker; both are failed
+TASK_GENERATION_JOB_QUEUE_TIMEOUT = 60
+TASK_GENERATION_JOB_TIMEOUT = 5 * 60
+
+# Task generation backend (dotted path): OpenAITaskProvider, or TemplateTaskProvider to
+# run fully offline. OPENAI_API_BASE points the OpenAI provider at another
+# API-compatible server, such as the one started by manage.py stub_llm_server
+TASK_GENERATION_PROVIDER = os.getenv("TASK_GENERATION_PROVIDER", "recommendations.providers.OpenAITaskProvider")
+TASK_GENERATION_MODEL = "gpt-4"
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")
+
+# Largest count a generation request may ask for. Requests over the chunk size are split
+# into chunks generated concurrently, at most TASK_GENERATION_CONCURRENCY at a time per process
+TASK_GENERATION_MAX_COUNT = 30
+TASK_GENERATION_CHUNK_SIZE = 9
+TASK_GENERATION_CONCURRENCY = 4
+
+# Completion budget (max_tokens) of a chunk: tokens per task times its task count plus the
+# overhead of the JSON array, capped at TASK_GENERATION_MAX_TOKENS
+TASK_GENERATION_TOKENS_PER_TASK = 150
+TASK_GENERATION_TOKENS_OVERHEAD = 200
+TASK_GENERATION_MAX_TOKENS = 4000
+
+# Models task generation is routed between, in order of preference (see recommendations/model_router.py).
+# A request goes to the first route expected to answer within the latency SLO (seconds) at the
+# hedge quantile; if it hasn't answered by then, it is hedged on the fastest other route
+TASK_GENERATION_ROUTES = [
+    {"name": "primary", "model": TASK_GENERATION_MODEL},
+    {"name": "fast", "model": "gpt-3.5-turbo"},
+]
+TASK_GENERATION_LATENCY_SLO = 15
+TASK_GENERATION_HEDGE_QUANTILE = 0.95
+TASK_GENERATION_ROUTE_MIN_SAMPLES = 20
+TASK_GENERATION_MIN_HEDGE_DELAY = 1.0
+
+# Nightly pre-generation (manage.py pregenerate_tasks) of task sets for users active in the
+# last PREGENERATION_ACTIVE_DAYS days; profile saves also regenerate the user's sets on the worker
+PREGENERATION_COUNT = 9
+PREGENERATION_CONCURRENCY = 4
+PREGENERATION_ACTIVE_DAYS = 7
+PREGENERATE_ON_PROFILE_SAVE = True
+# Profile saves made while a regeneration is queued join it; runs are charged to the
+# GENERATION_* buckets. A queued marker the worker never cleared expires after this many seconds
+PREGENERATION_QUEUED_TTL = 10 * 60
+
+# Reuse of tasks rated TASK_REUSE_MIN_RATING or higher by users with similar profiles: at most
+# TASK_REUSE_MAX_SHARE of a request's slots, from the TASK_REUSE_NEIGHBORS most similar profiles
+# with at least TASK_REUSE_MIN_SIMILARITY cosine similarity (see recommendations/retrieval.py)
+TASK_REUSE_MIN_RATING = 4
+TASK_REUSE_MAX_SHARE = 0.5
+TASK_REUSE_NEIGHBORS = 20
+TASK_REUSE_MIN_SIMILARITY = 0.3
+TASK_RETRIEVAL_DIMENSIONS = 1024
+TASK_RETRIEVAL_REBUILD_INTERVAL = 60 * 60
+
+# Generated tasks whose title+description MinHash similarity to one of the user's last
+# NEAR_DUPLICATE_HISTORY tasks (or an earlier task of the set) reaches NEAR_DUPLICATE_THRESHOLD,
+# or whose title similarity reaches NEAR_DUPLICATE_TITLE_THRESHOLD, are regenerated. Signatures
+# are cached per process for the NEAR_DUPLICATE_CACHE_USERS most recent users
+NEAR_DUPLICATE_THRESHOLD = 0.5
+NEAR_DUPLICATE_TITLE_THRESHOLD = 0.7
+NEAR_DUPLICATE_HISTORY = 50
+NEAR_DUPLICATE_CACHE_USERS = 2000
+
+# Task generation rate limits (token buckets: burst size and refill per minute), per
+# user and across all users; identical concurrent requests share one generation
+GENERATION_USER_BURST = 3
+GENERATION_USER_PER_MINUTE = 2
+GENERATION_GLOBAL_BURST = 50
+GENERATION_GLOBAL_PER_MINUTE = 120
+SINGLE_FLIGHT_LOCK_TIMEOUT = 90
+SINGLE_FLIGHT_WAIT_TIMEOUT = 60
+SINGLE_FLIGHT_RESULT_TTL = 10
+
+# Task generation LLM client: per-attempt timeout and overall deadline (seconds),
+# jittered retries, circuit breaker and HTTP connection pool size
+LLM_REQUEST_TIMEOUT = 20
+LLM_DEADLINE = 45
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BACKOFF = 0.5
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_RESET = 30
+LLM_POOL_SIZE = 20
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Generated task sets, keyed on a profile fingerprint (see recommendations/cache.py)
+    "task_sets": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://redis:6379/1",
+    },
+}
+
+TASK_CACHE_ALIAS = "task_sets"
+TASK_CACHE_TIMEOUT = 60 * 60 * 6
+TASK_CACHE_MAX_ENTRIES = 10000
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
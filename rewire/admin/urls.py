@@ -15,8 +15,9 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from .views import signup_step_one, signup_step_two, login_user, delete_user, update_user, forget_password, reset_password
+from core.views import get_websocket_metrics
 from rest_framework_simplejwt.views import (TokenObtainPairView, TokenRefreshView)
 
 urlpatterns = [
@@ -30,5 +31,8 @@ urlpatterns = [
     path('update-user', update_user),
     path('forget-password', forget_password),
     path('reset-password', reset_password),
+    path('tasks/', include('recommendations.urls')),
+    path('rebot/', include('rebot.urls')),
+    path('ws-metrics', get_websocket_metrics),
 ]
 
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+
+
+class QueueMetrics:
+    """Process-wide counters for outbound WebSocket queues"""
+
+    def __init__(self):
+        self.connections = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def snapshot(self):
+        return {
+            "connections": self.connections,
+            "queue_depth": self.depth,
+            "max_queue_depth": self.max_depth,
+            "frames_queued": self.queued,
+            "frames_sent": self.sent,
+            "frames_dropped": self.dropped,
+            "frames_coalesced": self.coalesced,
+        }
+
+
+metrics = QueueMetrics()
+
+
+class TransportFlowControl:
+    """
+    Tells the writer when the server can take more frames for a connection
+
+    Under Daphne the ASGI send returns as soon as a frame is handed to
+    Twisted, which buffers it without limit. Registered as a streaming
+    producer on the connection's protocol, this is paused by Twisted while
+    the socket's write buffer is over its high-water mark and resumed once
+    it has drained, so a slow client's backlog stays in the OutboundQueue.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.writable = asyncio.Event()
+        self.writable.set()
+        protocol.registerProducer(self, True)
+
+    def pauseProducing(self):
+        self.writable.clear()
+
+    def resumeProducing(self):
+        self.writable.set()
+
+    def stopProducing(self):
+        self.writable.set()
+
+    async def wait(self):
+        await self.writable.wait()
+
+    def close(self):
+        try:
+            self.protocol.unregisterProducer()
+        except Exception as e:
+            logger.error(f"Error unregistering WebSocket producer: {str(e)}")
+
+
+class OutboundQueue:
+    """
+    Bounded per-connection queue of outbound frames, drained by a writer task
+
+    When the queue is full the oldest frame is dropped. With the coalesce
+    policy a frame that carries a key first replaces any queued frame with
+    the same key (e.g. an older stats snapshot), so only frames that cannot
+    be merged are ever dropped. With flow control the writer only pops the
+    next frame once the transport is writable, so the queue fills up behind
+    a slow client instead of the server's buffer.
+    """
+
+    def __init__(self, write, max_size, policy, flow_control=None):
+        self.write = write
+        self.max_size = max_size
+        self.policy = policy
+        self.flow_control = flow_control
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.task = asyncio.ensure_future(self._drain())
+        metrics.connections += 1
+
+    def put(self, frame, key=None):
+        metrics.queued += 1
+        if self.policy == COALESCE and key is not None:
+            for index, (queued_key, _) in enumerate(self.frames):
+                if queued_key == key:
+                    del self.frames[index]
+                    metrics.depth -= 1
+                    metrics.coalesced += 1
+                    break
+
+        if len(self.frames) >= self.max_size:
+            self.frames.popleft()
+            self.dropped += 1
+            metrics.depth -= 1
+            metrics.dropped += 1
+
+        self.frames.append((key, frame))
+        metrics.depth += 1
+        metrics.max_depth = max(metrics.max_depth, len(self.frames))
+        self.ready.set()
+
+    async def _drain(self):
+        while True:
+            await self.ready.wait()
+            while self.frames:
+                if self.flow_control is not None:
+                    await self.flow_control.wait()
+                _, frame = self.frames.popleft()
+                metrics.depth -= 1
+                try:
+                    await self.write(frame)
+                    metrics.sent += 1
+                except Exception as e:
+                    logger.error(f"Error writing WebSocket frame: {str(e)}")
+            self.ready.clear()
+
+    def close(self):
+        self.task.cancel()
+        if self.flow_control is not None:
+            self.flow_control.close()
+        metrics.depth -= len(self.frames)
+        metrics.connections -= 1
+        self.frames.clear()
+
+
+class BackpressureMixin:
+    """
+    Decouples a WebSocket consumer's handlers from its client's socket
+
+    Frames passed to send() go into a bounded OutboundQueue instead of being
+    written inline, so a stalled client never stops the consumer from draining
+    its channel-layer inbox (and never fills it up for group senders). The
+    queue is drained at the pace the server's transport accepts frames.
+    Queue size and policy come from WEBSOCKET_QUEUE_SIZE and
+    WEBSOCKET_QUEUE_POLICY, or the consumer's outbound_queue_size and
+    outbound_queue_policy attributes.
+    """
+    outbound_queue_size = None
+    outbound_queue_policy = None
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        if not hasattr(self, 'outbound_queue'):
+            self.outbound_queue = OutboundQueue(
+                self._write_frame,
+                self.outbound_queue_size or getattr(settings, 'WEBSOCKET_QUEUE_SIZE', 100),
+                self.outbound_queue_policy or getattr(settings, 'WEBSOCKET_QUEUE_POLICY', COALESCE),
+                self.get_flow_control(),
+            )
+        self.outbound_queue.put({"text_data": text_data, "bytes_data": bytes_data, "close": close}, key=coalesce_key)
+
+    def get_flow_control(self):
+        """
+        Flow control for the protocol behind the ASGI send callable
+
+        Daphne's send is partial(server.handle_reply, protocol); servers that
+        expose no protocol (and the test communicator) get None, and frames
+        are written as fast as send() returns.
+        """
+        protocol = next((arg for arg in getattr(self.base_send, 'args', ()) if hasattr(arg, 'registerProducer')), None)
+        if protocol is None:
+            return None
+        try:
+            return TransportFlowControl(protocol)
+        except RuntimeError as e:
+            # Twisted allows one producer per transport
+            logger.error(f"Error registering WebSocket producer: {str(e)}")
+            return None
+
+    async def _write_frame(self, frame):
+        await super().send(**frame)
+
+    async def websocket_disconnect(self, message):
+        if hasattr(self, 'outbound_queue'):
+            self.outbound_queue.close()
+        await super().websocket_disconnect(message)
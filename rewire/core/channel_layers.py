@@ -0,0 +1,128 @@
+import bisect
+import hashlib
+
+from channels_redis.core import RedisChannelLayer
+from channels_redis.utils import create_pool, decode_hosts
+from redis import asyncio as aioredis
+
+
+def _ring_point(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+
+def host_id(host):
+    """Stable name of a Redis node, used to place it on the hash ring"""
+    if 'address' in host:
+        return host['address']
+    if 'master_name' in host:
+        return f"sentinel:{host['master_name']}"
+    return f"redis://{host.get('host', 'localhost')}:{host.get('port', 6379)}/{host.get('db', 0)}"
+
+
+class HashRing:
+    """
+    Consistent-hash ring with virtual nodes
+
+    Every node is placed on the ring at `replicas` points derived from its
+    id, so adding or removing one node only moves the keys between it and
+    its neighbours (about 1/N of them) instead of reshuffling everything.
+    """
+
+    def __init__(self, node_ids, replicas=160):
+        ring = sorted(
+            (_ring_point(f"{node_id}#{replica}"), index)
+            for index, node_id in enumerate(node_ids)
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in ring]
+        self.nodes = [index for _, index in ring]
+
+    def get_node(self, key):
+        """Index of the node owning the key"""
+        position = bisect.bisect(self.points, _ring_point(key)) % len(self.points)
+        return self.nodes[position]
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer that shards groups and channels over a consistent-hash ring
+
+    channels_redis maps keys to hosts by taking a hash modulo the number of
+    hosts, so adding a node moves almost every group. This layer uses a
+    HashRing instead. Each node gets its own connection pool (as in
+    channels_redis), capped at `pool_size` connections per event loop
+    unless the host sets max_connections itself.
+
+    Group memberships on a node that lost ownership after hosts change are
+    moved with `manage.py rebalance_channel_layer`.
+    """
+
+    def __init__(self, hosts=None, replicas=160, pool_size=50, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self.pool_size = pool_size
+        self.ring = HashRing([host_id(host) for host in self.hosts], replicas=replicas)
+
+    def consistent_hash(self, value):
+        if self.ring_size == 1:
+            return 0
+        return self.ring.get_node(value)
+
+    def create_pool(self, index):
+        host = dict(self.hosts[index])
+        if 'master_name' not in host:
+            host.setdefault('max_connections', self.pool_size)
+        return create_pool(host)
+
+    def group_name(self, key):
+        """Group name stored under a Redis group key, or None for other keys"""
+        prefix = f"{self.prefix}:group:".encode('utf-8')
+        if key.startswith(prefix):
+            return key[len(prefix):].decode('utf-8')
+        return None
+
+    async def rebalance(self, previous_hosts, dry_run=False):
+        """
+        Move group memberships to the nodes that own them under the current hosts
+
+        Scans every node of the previous host list (nodes still in use and
+        nodes being removed) for group keys owned by another node now, merges
+        each one into its new owner and deletes it from the old node.
+
+        Returns:
+            Dictionary of node id to the number of groups moved off it
+        """
+        current = {host_id(host): index for index, host in enumerate(self.hosts)}
+        moved = {}
+        for host in decode_hosts(previous_hosts):
+            source_id = host_id(host)
+            if source_id in current:
+                source = self.connection(current[source_id])
+            else:
+                source = aioredis.Redis(connection_pool=create_pool(host))
+
+            moved[source_id] = 0
+            async for key in source.scan_iter(match=f"{self.prefix}:group:*", count=500):
+                group = self.group_name(key)
+                if group is None:
+                    continue
+                target_index = self.consistent_hash(group)
+                if host_id(self.hosts[target_index]) == source_id:
+                    continue
+
+                moved[source_id] += 1
+                if dry_run:
+                    continue
+
+                members = await source.zrange(key, 0, -1, withscores=True)
+                target = self.connection(target_index)
+                if members:
+                    # Keep the newer join time if the group already has members on the target
+                    await target.zadd(key, dict(members), gt=True)
+                    await target.expire(key, self.group_expiry)
+                await source.delete(key)
+
+            if source_id not in current:
+                await source.aclose()
+        return moved
@@ -0,0 +1,40 @@
+import asyncio
+
+from channels.layers import channel_layers
+from django.core.management.base import BaseCommand, CommandError
+
+from core.channel_layers import ShardedRedisChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Move channel layer group memberships to the Redis nodes that own them after "
+        "CHANNEL_REDIS_URLS changed. Deploy the new host list everywhere first, then run "
+        "this with the previous list."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--previous-host', action='append', required=True, dest='previous_hosts',
+            help="Redis URL of a node in the previous host list (repeat for every node)"
+        )
+        parser.add_argument('--layer', default='default', help="Channel layer alias")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the groups that would move")
+
+    def handle(self, *args, **options):
+        layer = channel_layers[options['layer']]
+        if not isinstance(layer, ShardedRedisChannelLayer):
+            raise CommandError(f"Channel layer '{options['layer']}' is not a ShardedRedisChannelLayer")
+
+        moved = asyncio.run(self.rebalance(layer, options['previous_hosts'], options['dry_run']))
+
+        verb = "would move" if options['dry_run'] else "moved"
+        for node, count in moved.items():
+            self.stdout.write(f"{node}: {verb} {count} groups")
+        self.stdout.write(self.style.SUCCESS(f"{sum(moved.values())} groups {verb} in total"))
+
+    async def rebalance(self, layer, previous_hosts, dry_run):
+        try:
+            return await layer.rebalance(previous_hosts, dry_run=dry_run)
+        finally:
+            await layer.close_pools()
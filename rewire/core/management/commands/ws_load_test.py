@@ -0,0 +1,244 @@
+import asyncio
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.urls import path
+
+from core.backpressure import TransportFlowControl, metrics
+from rebot.consumers import RebotConsumer
+from recommendations.consumers import TaskConsumer
+
+
+class SlowClientProtocol:
+    """
+    Stands in for the server protocol of a client that reads a frame every
+    `delay` seconds
+
+    Written frames sit in a buffer the client empties at its own pace. Like
+    Twisted with its write buffer, the registered producer is paused while
+    more than `buffer_size` frames are unread and resumed once the buffer
+    has drained.
+    """
+    max_buffered = 0
+
+    def __init__(self, delay, buffer_size):
+        self.delay = delay
+        self.buffer_size = buffer_size
+        self.buffered = 0
+        self.producer = None
+        self.reader = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+        if self.reader is not None:
+            self.reader.cancel()
+
+    def write(self):
+        self.buffered += 1
+        SlowClientProtocol.max_buffered = max(SlowClientProtocol.max_buffered, self.buffered)
+        if self.buffered > self.buffer_size and self.producer is not None:
+            self.producer.pauseProducing()
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        while self.buffered:
+            await asyncio.sleep(self.delay)
+            self.buffered -= 1
+        if self.producer is not None:
+            self.producer.resumeProducing()
+
+
+def load_test_consumer(consumer_class, delay, buffer_size, queued):
+    """
+    Subclass a consumer whose client reads a frame every `delay` seconds
+
+    The server-side buffer is simulated by a SlowClientProtocol; frames are
+    still delivered to the communicator straight away. With queued=False the
+    outbound queue is bypassed and frames are written inline, which is how
+    the consumers behaved before backpressure handling: the backlog then
+    builds up in the server's buffer instead.
+    """
+    class LoadTestConsumer(consumer_class):
+        async def websocket_connect(self, message):
+            self.protocol = SlowClientProtocol(delay, buffer_size) if delay else None
+            await super().websocket_connect(message)
+
+        def get_flow_control(self):
+            return TransportFlowControl(self.protocol) if self.protocol is not None else None
+
+        async def _write_frame(self, frame):
+            if self.protocol is not None:
+                self.protocol.write()
+            await super()._write_frame(frame)
+
+        async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+            if queued:
+                await super().send(text_data, bytes_data, close, coalesce_key)
+            else:
+                await self._write_frame({"text_data": text_data, "bytes_data": bytes_data, "close": close})
+
+    return LoadTestConsumer
+
+
+class LoadTestChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory layer that counts messages rejected by full channels
+
+    InMemoryChannelLayer sweeps every channel for expired messages on each
+    send and receive, which turns thousands of connections into quadratic
+    work; the sweep runs at most once a second here instead.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.full = 0
+        self.max_depth = 0
+        self._cleaned = 0
+
+    async def send(self, channel, message):
+        try:
+            await super().send(channel, message)
+        except ChannelFull:
+            self.full += 1
+            raise
+        self.max_depth = max(self.max_depth, self.channels[channel].qsize())
+
+    def _clean_expired(self):
+        if time.monotonic() - self._cleaned >= 1:
+            self._cleaned = time.monotonic()
+            super()._clean_expired()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test WebSocket fan-out in one process: thousands of TaskConsumer or RebotConsumer "
+        "connections, a share of them slow, receiving group events at a fixed rate"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', choices=['rebot', 'tasks'], default='rebot')
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--group-size', type=int, default=10, help="Connections per room (rebot) or per user (tasks)")
+        parser.add_argument('--slow-ratio', type=float, default=0.1, help="Share of connections with a slow client")
+        parser.add_argument('--slow-delay', type=float, default=0.5, help="Time a slow client takes per frame (s)")
+        parser.add_argument(
+            '--client-buffer', type=int, default=16,
+            help="Frames the server buffers for a client before pausing its writer"
+        )
+        parser.add_argument('--events', type=int, default=200, help="Events sent to every group")
+        parser.add_argument('--rate', type=float, default=100, help="Events per second sent to every group")
+        parser.add_argument('--capacity', type=int, default=100, help="Per-channel capacity of the in-memory layer")
+        parser.add_argument('--no-queue', action='store_true', help="Write frames inline, without outbound queues")
+        parser.add_argument(
+            '--layer', choices=['memory', 'configured'], default='memory',
+            help="Use an in-memory channel layer, or the one configured in CHANNEL_LAYERS (e.g. Redis)"
+        )
+
+    def handle(self, *args, **options):
+        if options['layer'] == 'memory':
+            channel_layers.set('default', LoadTestChannelLayer(capacity=options['capacity']))
+
+        result = asyncio.run(self.run(options))
+        for key, value in result.items():
+            self.stdout.write(f"{key:>28}: {value}")
+
+    async def run(self, options):
+        queued = not options['no_queue']
+        queue_size = getattr(settings, 'WEBSOCKET_QUEUE_SIZE', 100)
+        if options['consumer'] == 'rebot':
+            consumer_class, route = RebotConsumer, "ws/rebot/<str:room_name>/"
+            event_type, event_key = "rebot.message", "message"
+        else:
+            consumer_class, route = TaskConsumer, "ws/tasks/"
+            event_type, event_key = "task_update", "data"
+
+        application = URLRouter([
+            path(
+                f"slow/{route}",
+                load_test_consumer(consumer_class, options['slow_delay'], options['client_buffer'], queued).as_asgi(),
+            ),
+            path(route, load_test_consumer(consumer_class, 0, options['client_buffer'], queued).as_asgi()),
+        ])
+
+        # Open every connection; every n-th one gets a slow client
+        groups = max(1, options['connections'] // options['group_size'])
+        slow_every = round(1 / options['slow_ratio']) if options['slow_ratio'] else 0
+        fast, slow = [], []
+        started = time.perf_counter()
+        for i in range(options['connections']):
+            group = i % groups
+            is_slow = slow_every and i % slow_every == 0
+            url = f"/ws/rebot/load{group}/" if options['consumer'] == 'rebot' else "/ws/tasks/"
+            communicator = WebsocketCommunicator(application, f"/slow{url}" if is_slow else url)
+            # Unsaved users: the consumer only reads their stats, nothing is written
+            communicator.scope["user"] = get_user_model()(id=10_000_000 + group, user_name=f"load{group}")
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError(f"Connection {i} was rejected")
+            # Drain the history page / stats snapshot sent on connect
+            await communicator.receive_from(timeout=30)
+            (slow if is_slow else fast).append(communicator)
+        connect_time = time.perf_counter() - started
+
+        if options['consumer'] == 'rebot':
+            group_names = [f"rebot_load{group}" for group in range(groups)]
+        else:
+            group_names = [f"tasks_user_{10_000_000 + group}_tasks" for group in range(groups)]
+
+        layer = channel_layers['default']
+
+        # Publish to every group at the given rate
+        started = time.perf_counter()
+        for i in range(options['events']):
+            for name in group_names:
+                await layer.group_send(name, {"type": event_type, event_key: {"seq": i}})
+            await asyncio.sleep(max(0.0, started + (i + 1) / options['rate'] - time.perf_counter()))
+        publish_time = time.perf_counter() - started
+
+        # Fast clients must get every event; slow ones lose what their queue or inbox drops
+        lost_fast = 0
+        for communicator in fast:
+            received = 0
+            try:
+                while received < options['events']:
+                    await communicator.receive_from(timeout=5)
+                    received += 1
+            except asyncio.TimeoutError:
+                pass
+            lost_fast += options['events'] - received
+        fast_time = time.perf_counter() - started
+
+        snapshot = metrics.snapshot()
+
+        for communicator in fast + slow:
+            await communicator.disconnect()
+
+        return {
+            'consumer': options['consumer'],
+            'outbound queue': f"{queue_size} frames/connection" if queued else "off",
+            'connections (slow)': f"{options['connections']} ({len(slow)})",
+            'connect time (s)': round(connect_time, 3),
+            'events per group': options['events'],
+            'publish time (s)': round(publish_time, 3),
+            'fast delivery time (s)': round(fast_time, 3),
+            'events lost by fast clients': lost_fast,
+            'events lost per slow client': round(
+                (snapshot['frames_dropped'] + getattr(layer, 'full', 0)) / max(1, len(slow)), 1
+            ),
+            'max channel inbox depth': getattr(layer, 'max_depth', "n/a"),
+            'ChannelFull drops': getattr(layer, 'full', "n/a"),
+            'max frames buffered by server': SlowClientProtocol.max_buffered,
+            'max outbound queue depth': snapshot['max_queue_depth'],
+            'frames dropped by queues': snapshot['frames_dropped'],
+            'frames coalesced by queues': snapshot['frames_coalesced'],
+        }
@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.wire import CompressedMsgpackCodec, JSONCodec, MsgpackCodec
+from recommendations.stats import format_stats
+
+TASK_TEXT = [
+    ("Daily Reflection Journal", "Spend 5 minutes writing about your feelings and progress today.", "EASY", 5),
+    ("30-Minute Exercise", "Complete 30 minutes of moderate exercise like walking, jogging, or cycling.", "MEDIUM", 10),
+    ("Difficult Conversation", "Have an honest conversation with someone impacted by your addiction.", "HARD", 15),
+]
+
+
+def user_task(i):
+    """A UserTaskSerializer-shaped payload"""
+    title, description, difficulty, marks = TASK_TEXT[i % len(TASK_TEXT)]
+    return {
+        "id": 1000 + i,
+        "task": {"id": 500 + i, "title": title, "description": description, "difficulty": difficulty, "marks": marks},
+        "assigned_at": "2025-03-01T08:30:00.000000Z",
+        "completed": i % 2 == 0,
+        "completed_at": "2025-03-01T18:05:12.000000Z" if i % 2 == 0 else None,
+        "user_rating": 4 if i % 2 == 0 else None,
+        "user_feedback": "",
+        "marks_earned": marks if i % 2 == 0 else 0,
+    }
+
+
+def payloads():
+    """Representative frames sent by TaskConsumer and RebotConsumer"""
+    stats = format_stats({
+        'total_tasks': 90, 'completed_tasks': 61, 'easy_completed': 30,
+        'medium_completed': 21, 'hard_completed': 10, 'total_marks': 510,
+    })
+    message = "I skipped the bar after work today and went for a run instead."
+    return {
+        'user_stats': {'type': 'user_stats', 'data': stats},
+        'stats_delta': {'type': 'stats_delta', 'data': {'delta': {'completed_tasks': 1, 'total_marks': 10}, 'events': 1}},
+        'task_update (1 task)': {'type': 'task_update', 'data': {'task': user_task(0)}},
+        'task_update (9 tasks)': {'type': 'task_update', 'data': {'tasks': [user_task(i) for i in range(9)], 'error': None}},
+        'task list (50 tasks)': {'type': 'task_update', 'data': {'tasks': [user_task(i) for i in range(50)], 'error': None}},
+        'rebot message': {'message': message},
+        'rebot batch (20)': {'messages': [f"{message} ({i})" for i in range(20)]},
+        'rebot reply delta': {'reply': {'id': 'a3f1c2d4e5b60718293a4b5c6d7e8f90', 'delta': 'one step '}},
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare bytes on the wire and encode CPU per message of the JSON and msgpack WebSocket codecs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        codecs = {
+            'json': JSONCodec(),
+            'msgpack': MsgpackCodec(),
+            'msgpack.z': CompressedMsgpackCodec(),
+        }
+        iterations = options['iterations']
+
+        self.stdout.write(f"{'payload':<24}" + "".join(f"{name + ' B':>14}{name + ' us':>14}" for name in codecs))
+        for label, payload in payloads().items():
+            row = f"{label:<24}"
+            for codec in codecs.values():
+                frame = codec.encode(payload)
+                size = len(frame.get("bytes_data") or frame["text_data"].encode('utf-8'))
+
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    codec.encode(payload)
+                micros = (time.perf_counter() - started) / iterations * 1e6
+
+                # Every codec must round-trip its own frames
+                assert codec.decode(**frame) == payload, f"{label} does not round-trip"
+                row += f"{size:>14}{micros:>14.2f}"
+            self.stdout.write(row)
@@ -1,3 +1,272 @@
-from django.test import TestCase
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+import unittest
+import zlib
+from collections import Counter
+from functools import partial
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+import redis
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from .backpressure import (
+    COALESCE, DROP_OLDEST, BackpressureMixin, OutboundQueue, QueueMetrics, TransportFlowControl,
+)
+from .channel_layers import HashRing, ShardedRedisChannelLayer
+from .wire import ZLIB, CompressedMsgpackCodec, FrameDecodeError
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+class HashRingTests(SimpleTestCase):
+    keys = [f"tasks_user_{i}_tasks" for i in range(10000)]
+
+    def test_keys_spread_evenly(self):
+        ring = HashRing([f"redis://node{i}:6379" for i in range(4)])
+        counts = Counter(ring.get_node(key) for key in self.keys)
+
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertLess(max(counts.values()) / min(counts.values()), 1.5)
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        before = HashRing([f"redis://node{i}:6379" for i in range(3)])
+        after = HashRing([f"redis://node{i}:6379" for i in range(4)])
+        moved = [key for key in self.keys if before.get_node(key) != after.get_node(key)]
+
+        # Ideally a quarter; modulo hashing would move about three quarters
+        self.assertLess(len(moved) / len(self.keys), 0.35)
+        self.assertTrue(all(after.get_node(key) == 3 for key in moved))
+
+
+class FakeProtocol:
+    """Server protocol that records its registered producer"""
+    producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('core.backpressure.metrics', QueueMetrics())
+        self.metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.protocol = FakeProtocol()
+        self.written = []
+
+    async def write(self, frame):
+        self.written.append(frame)
+
+    def stalled_queue(self, max_size, policy):
+        queue = OutboundQueue(self.write, max_size, policy, TransportFlowControl(self.protocol))
+        # The server's buffer is full: nothing is popped until it drains
+        self.protocol.producer.pauseProducing()
+        return queue
+
+    async def test_oldest_frames_are_dropped_when_full(self):
+        queue = self.stalled_queue(3, DROP_OLDEST)
+        for i in range(5):
+            queue.put(i)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(self.written, [])
+        self.assertEqual([frame for _, frame in queue.frames], [2, 3, 4])
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(
+            (self.metrics.queued, self.metrics.dropped, self.metrics.depth, self.metrics.max_depth), (5, 2, 3, 3)
+        )
+        queue.close()
+
+    async def test_keyed_frames_replace_queued_frames_with_the_same_key(self):
+        queue = self.stalled_queue(3, COALESCE)
+        queue.put("stats 1", key='user_stats')
+        queue.put("update")
+        queue.put("stats 2", key='user_stats')
+        queue.put("stats 3", key='user_stats')
+
+        self.assertEqual(list(queue.frames), [(None, "update"), ('user_stats', "stats 3")])
+        self.assertEqual((self.metrics.coalesced, self.metrics.dropped, self.metrics.depth), (2, 0, 2))
+        queue.close()
+
+    async def test_writer_waits_for_the_transport(self):
+        queue = self.stalled_queue(10, COALESCE)
+        queue.put("first")
+        queue.put("second")
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.written, [])
+
+        self.protocol.producer.resumeProducing()
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(self.written, ["first", "second"])
+        self.assertEqual((self.metrics.sent, self.metrics.depth), (2, 0))
+        queue.close()
+        self.assertIsNone(self.protocol.producer)
+        self.assertEqual(self.metrics.connections, 0)
+
+    def test_flow_control_comes_from_daphnes_send(self):
+        async def handle_reply(protocol, message):
+            pass
+
+        consumer = BackpressureMixin()
+        consumer.base_send = partial(handle_reply, self.protocol)
+        flow_control = consumer.get_flow_control()
+
+        self.assertIs(self.protocol.producer, flow_control)
+        consumer.base_send = handle_reply
+        self.assertIsNone(consumer.get_flow_control())
+
+
+class CompressedMsgpackCodecTests(SimpleTestCase):
+    def test_round_trip(self):
+        codec = CompressedMsgpackCodec(min_size=16)
+        content = {"action": "history", "before": "x" * 100}
+
+        frame = codec.encode(content)["bytes_data"]
+
+        self.assertEqual(frame[:1], ZLIB)
+        self.assertEqual(codec.decode(bytes_data=frame), content)
+
+    def test_oversized_frame_is_rejected(self):
+        codec = CompressedMsgpackCodec(max_inbound_size=1024)
+        # A few KB on the wire that would inflate to 10 MB
+        frame = ZLIB + zlib.compress(msgpack.packb({"message": "x" * 10 * 1024 * 1024}))
+
+        self.assertLess(len(frame), 20 * 1024)
+        with self.assertRaises(FrameDecodeError):
+            codec.decode(bytes_data=frame)
+
+    def test_truncated_frame_is_rejected(self):
+        codec = CompressedMsgpackCodec()
+        frame = ZLIB + zlib.compress(msgpack.packb({"message": "x" * 2000}))
+
+        with self.assertRaises(FrameDecodeError):
+            codec.decode(bytes_data=frame[:-10])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@unittest.skipUnless(REDIS_SERVER, "redis-server is not installed")
+class ShardedChannelLayerIntegrationTests(SimpleTestCase):
+    """Runs ShardedRedisChannelLayer against several local redis-server processes"""
+    node_count = 4
+    prefix = 'shardtest'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.processes = []
+        cls.urls = []
+        for _ in range(cls.node_count):
+            port = free_port()
+            cls.processes.append(subprocess.Popen(
+                [REDIS_SERVER, '--port', str(port), '--save', '', '--appendonly', 'no'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ))
+            cls.urls.append(f"redis://127.0.0.1:{port}")
+
+        cls.clients = [redis.Redis.from_url(url) for url in cls.urls]
+        deadline = time.monotonic() + 10
+        for client in cls.clients:
+            while True:
+                try:
+                    client.ping()
+                    break
+                except redis.ConnectionError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        for client in cls.clients:
+            client.close()
+        for process in cls.processes:
+            process.terminate()
+            process.wait()
+        super().tearDownClass()
+
+    def setUp(self):
+        for client in self.clients:
+            client.flushall()
+
+    def make_layer(self, node_count):
+        return ShardedRedisChannelLayer(hosts=self.urls[:node_count], prefix=self.prefix)
+
+    def group_nodes(self, group):
+        """Indexes of the nodes holding the group's key"""
+        key = f"{self.prefix}:group:{group}"
+        return [index for index, client in enumerate(self.clients) if client.exists(key)]
+
+    def test_groups_are_sharded_and_delivered(self):
+        layer = self.make_layer(3)
+        groups = [f"tasks_user_{i}_tasks" for i in range(60)]
+
+        async def run():
+            for i, group in enumerate(groups):
+                await layer.group_add(group, f"test.member{i}")
+            for group in groups:
+                await layer.group_send(group, {"type": "task.update", "group": group})
+            received = [
+                (await asyncio.wait_for(layer.receive(f"test.member{i}"), 5))["group"]
+                for i in range(len(groups))
+            ]
+            await layer.close_pools()
+            return received
+
+        self.assertEqual(asyncio.run(run()), groups)
+        for group in groups:
+            self.assertEqual(self.group_nodes(group), [layer.consistent_hash(group)])
+        self.assertEqual({layer.consistent_hash(group) for group in groups}, {0, 1, 2})
+
+    def test_rebalance_after_adding_a_node(self):
+        groups = [f"rebot_room{i}" for i in range(300)]
+        before = self.make_layer(3)
+
+        async def join():
+            for i, group in enumerate(groups):
+                await before.group_add(group, f"test.member{i}")
+            await before.close_pools()
+
+        asyncio.run(join())
+
+        layers = {"default": {
+            "BACKEND": "core.channel_layers.ShardedRedisChannelLayer",
+            "CONFIG": {"hosts": self.urls, "prefix": self.prefix},
+        }}
+        with override_settings(CHANNEL_LAYERS=layers):
+            arguments = []
+            for url in self.urls[:3]:
+                arguments += ['--previous-host', url]
+            call_command('rebalance_channel_layer', *arguments, stdout=StringIO())
+
+        after = self.make_layer(4)
+        moved = [group for group in groups if before.consistent_hash(group) != after.consistent_hash(group)]
+        self.assertTrue(0 < len(moved) < len(groups) * 0.4)
+        for group in groups:
+            self.assertEqual(self.group_nodes(group), [after.consistent_hash(group)])
+
+        async def deliver():
+            for group in moved:
+                await after.group_send(group, {"type": "rebot.message", "group": group})
+            received = [
+                (await asyncio.wait_for(after.receive(f"test.member{groups.index(group)}"), 5))["group"]
+                for group in moved
+            ]
+            await after.close_pools()
+            return received
+
+        self.assertEqual(asyncio.run(deliver()), moved)
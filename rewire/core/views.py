@@ -1,3 +1,12 @@
-from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 
-# Create your views here.
+from .backpressure import metrics
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_websocket_metrics(request):
+    """Get outbound WebSocket queue depth and drop counters for this process"""
+    return Response(metrics.snapshot())
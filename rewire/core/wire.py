@@ -0,0 +1,121 @@
+import json
+import zlib
+
+import msgpack
+from django.conf import settings
+
+# Subprotocols a client can ask for in Sec-WebSocket-Protocol; without one it gets JSON
+MSGPACK = 'rewire.msgpack'
+MSGPACK_COMPRESSED = 'rewire.msgpack.z'
+
+# Leading byte of every rewire.msgpack.z frame
+RAW = b'\x00'
+ZLIB = b'\x01'
+
+
+class FrameDecodeError(ValueError):
+    """Raised when an incoming frame can't be decoded with the connection's codec"""
+
+
+class JSONCodec:
+    subprotocol = None
+
+    def encode(self, content):
+        return {"text_data": json.dumps(content)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        try:
+            return json.loads(text_data if text_data is not None else bytes_data)
+        except (TypeError, ValueError) as e:
+            raise FrameDecodeError("Invalid JSON frame") from e
+
+
+class MsgpackCodec:
+    subprotocol = MSGPACK
+
+    def encode(self, content):
+        return {"bytes_data": msgpack.packb(content)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        # Text frames are still accepted as JSON, so simple clients can send commands
+        if bytes_data is None:
+            return JSONCodec().decode(text_data)
+        try:
+            return msgpack.unpackb(bytes_data)
+        except Exception as e:
+            raise FrameDecodeError("Invalid msgpack frame") from e
+
+
+class CompressedMsgpackCodec(MsgpackCodec):
+    """
+    msgpack frames prefixed with one flag byte; payloads of at least
+    WEBSOCKET_COMPRESS_MIN_SIZE bytes (e.g. task lists) are zlib-compressed
+
+    Incoming compressed frames may inflate to at most
+    WEBSOCKET_MAX_INBOUND_SIZE bytes, so a small frame can't expand into a
+    decompression bomb.
+    """
+    subprotocol = MSGPACK_COMPRESSED
+
+    def __init__(self, min_size=None, level=6, max_inbound_size=None):
+        self.min_size = min_size or getattr(settings, 'WEBSOCKET_COMPRESS_MIN_SIZE', 1024)
+        self.level = level
+        self.max_inbound_size = max_inbound_size or getattr(settings, 'WEBSOCKET_MAX_INBOUND_SIZE', 64 * 1024)
+
+    def encode(self, content):
+        payload = msgpack.packb(content)
+        if len(payload) >= self.min_size:
+            return {"bytes_data": ZLIB + zlib.compress(payload, self.level)}
+        return {"bytes_data": RAW + payload}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return JSONCodec().decode(text_data)
+        try:
+            flag, payload = bytes_data[:1], bytes_data[1:]
+            if flag == ZLIB:
+                decompressor = zlib.decompressobj()
+                payload = decompressor.decompress(payload, self.max_inbound_size)
+                if decompressor.unconsumed_tail:
+                    raise ValueError(f"Frame inflates past {self.max_inbound_size} bytes")
+                if not decompressor.eof:
+                    raise ValueError("Truncated compressed frame")
+            elif flag != RAW:
+                raise ValueError(f"Unknown frame flag {flag!r}")
+        except (ValueError, zlib.error) as e:
+            raise FrameDecodeError("Invalid compressed frame") from e
+        return super().decode(bytes_data=payload)
+
+
+CODECS = {
+    MSGPACK_COMPRESSED: CompressedMsgpackCodec,
+    MSGPACK: MsgpackCodec,
+}
+
+
+def negotiate(subprotocols):
+    """Codec for the first subprotocol the client offered that we support, else JSON"""
+    for subprotocol in subprotocols or []:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]()
+    return JSONCodec()
+
+
+class WireProtocolMixin:
+    """
+    Lets a WebSocket consumer speak JSON (default) or msgpack
+
+    The codec is picked when the connection is accepted, from the
+    subprotocols the client offered. Handlers send with send_message() and
+    read incoming frames with decode_message() instead of json.dumps/loads.
+    """
+
+    async def accept(self, subprotocol=None, headers=None):
+        self.codec = negotiate(self.scope.get("subprotocols"))
+        await super().accept(subprotocol or self.codec.subprotocol, headers)
+
+    async def send_message(self, content, **kwargs):
+        await self.send(**self.codec.encode(content), **kwargs)
+
+    def decode_message(self, text_data=None, bytes_data=None):
+        return getattr(self, 'codec', JSONCodec()).decode(text_data, bytes_data)
@@ -0,0 +1,16 @@
+from django.contrib import admin
+from .models import RebotMessage, RebotRoom
+
+@admin.register(RebotRoom)
+class RebotRoomAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'created_at')
+    search_fields = ('name', 'owner__email')
+    list_select_related = ('owner',)
+
+
+@admin.register(RebotMessage)
+class RebotMessageAdmin(admin.ModelAdmin):
+    list_display = ('room_name', 'user', 'role', 'created_at')
+    search_fields = ('room_name', 'user__email', 'content')
+    list_filter = ('role',)
+    list_select_related = ('user',)
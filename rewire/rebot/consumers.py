@@ -1,40 +1,263 @@
-import json
+import asyncio
+import logging
+import time
+import uuid
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import sync_to_async
+from channels.consumer import get_handler_name
+from channels.db import aclose_old_connections, database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 
+from core.backpressure import BackpressureMixin
+from core.wire import FrameDecodeError, WireProtocolMixin
+from recommendations.throttling import RateLimited, TokenBucket
+from .context import room_contexts
+from .history import can_access_room, get_history_page, get_message_buffer
+from .models import RebotMessage
+from .providers import get_reply_provider
 
-class RebotConsumer(WebsocketConsumer):
-    def connect(self):
+logger = logging.getLogger(__name__)
+
+
+class RoomBatcher:
+    """
+    Throttles outbound room messages to one group event per room per tick
+
+    Messages are queued per room and a flusher task sends whatever has queued
+    up as a single group event, then waits a tick before sending the next
+    batch. A quiet room gets its message on the next loop iteration; a busy
+    room costs one group_send (and one frame per client) per tick instead of
+    one per message.
+    """
+
+    def __init__(self, tick=None):
+        self.tick = tick if tick is not None else getattr(settings, 'REBOT_BATCH_TICK', 0.05)
+        self._pending = {}
+        self._flushers = {}
+
+    def send(self, channel_layer, group, message):
+        self._pending.setdefault(group, []).append(message)
+        if group not in self._flushers:
+            self._flushers[group] = asyncio.ensure_future(self._flush(channel_layer, group))
+
+    async def _flush(self, channel_layer, group):
+        try:
+            while True:
+                messages = self._pending.pop(group, None)
+                if not messages:
+                    break
+
+                if len(messages) == 1:
+                    await channel_layer.group_send(group, {"type": "rebot.message", "message": messages[0]})
+                else:
+                    await channel_layer.group_send(group, {"type": "rebot.batch", "messages": messages})
+                await asyncio.sleep(self.tick)
+        finally:
+            self._flushers.pop(group, None)
+
+
+# Every message a user sends costs an LLM reply, so users get a token bucket of messages
+reply_bucket = TokenBucket(
+    'rebot:user',
+    getattr(settings, 'REBOT_USER_BURST', 5),
+    getattr(settings, 'REBOT_USER_PER_MINUTE', 10),
+)
+
+
+# One batcher per event loop; a process normally runs a single loop
+_batchers = {}
+
+
+def get_batcher():
+    loop = asyncio.get_running_loop()
+    if loop not in _batchers:
+        _batchers.clear()
+        _batchers[loop] = RoomBatcher()
+    return _batchers[loop]
+
+
+class RebotConsumer(WireProtocolMixin, BackpressureMixin, AsyncWebsocketConsumer):
+    # Events whose handlers use the database; room group events, the bulk of the traffic, never do
+    DATABASE_EVENTS = {"websocket.connect", "websocket.receive"}
+
+    async def dispatch(self, message):
+        # AsyncConsumer.dispatch closes stale database connections before every event, a thread
+        # hop each time; do it only before the events that can reach the database
+        handler = getattr(self, get_handler_name(message), None)
+        if handler is None:
+            raise ValueError(f"No handler for message type {message['type']}")
+        if message["type"] in self.DATABASE_EVENTS:
+            await aclose_old_connections()
+        await handler(message)
+
+    async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"rebot_{self.room_name}"
+        # Replies still being generated for this socket
+        self.reply_tasks = set()
+
+        # Only a room's owner may join it; the first user to open a room claims it
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated or not await database_sync_to_async(can_access_room)(
+            self.room_name, user, claim=True
+        ):
+            await self.close()
+            return
 
         # Join room group
-        async_to_sync(self.channel_layer.group_add)(
+        await self.channel_layer.group_add(
             self.room_group_name, self.channel_name
         )
 
-        self.accept()
+        await self.accept()
+
+        # Send the most recent page of the room's history; older pages are fetched on demand
+        await get_message_buffer().flush()
+        await self.send_history()
+
+    async def disconnect(self, close_code):
+        # Nobody is left to receive the replies of this socket
+        for task in self.reply_tasks:
+            task.cancel()
 
-    def disconnect(self, close_code):
         # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(
+        await self.channel_layer.group_discard(
             self.room_group_name, self.channel_name
         )
 
     # Receive message from WebSocket
-    def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.decode_message(text_data, bytes_data)
+            if data.get("action") == "history":
+                await self.send_history(data.get("before"))
+                return
+            message = data["message"]
+        except (TypeError, KeyError, AttributeError, FrameDecodeError):
+            await self.send_message({"error": "Invalid message format"})
+            return
+        except ValueError:
+            await self.send_message({"error": "Invalid cursor"})
+            return
+
+        # The message goes to the LLM and the database as text
+        if not isinstance(message, str) or not message.strip():
+            await self.send_message({"error": "Invalid message format"})
+            return
+        if len(message) > getattr(settings, 'REBOT_MAX_MESSAGE_LENGTH', 2000):
+            await self.send_message({"error": "Message too long"})
+            return
+
+        try:
+            # The bucket may live in Redis, so take the token off the event loop
+            await sync_to_async(reply_bucket.consume, thread_sensitive=False)(self.scope["user"].id)
+        except RateLimited as e:
+            await self.send_message({"error": "Too many messages", "retry_after": round(e.retry_after, 1)})
+            return
+
+        # Send message to room group and queue it for the write-behind buffer
+        get_batcher().send(self.channel_layer, self.room_group_name, message)
+        self.save_message("user", message)
+
+        # Rebot answers in the background so this socket keeps receiving
+        task = asyncio.ensure_future(self.reply(message))
+        self.reply_tasks.add(task)
+        task.add_done_callback(self.reply_done)
+
+    def reply_done(self, task):
+        self.reply_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error in Rebot reply task: {str(task.exception())}")
+
+    async def reply(self, message):
+        """Generate Rebot's reply to the message and fold old turns into the room's summary"""
+        window = room_contexts.get(self.room_name)
+        reply_id = uuid.uuid4().hex
+        timeout = getattr(settings, 'REBOT_REPLY_TIMEOUT', 60)
+
+        async with window.lock:
+            try:
+                window.add("user", message)
+                provider = get_reply_provider()
+                # A hung provider call must not hold the room's lock
+                content = await asyncio.wait_for(self.stream_reply(provider, window, reply_id), timeout)
+                window.add("assistant", content)
+                self.save_message("assistant", content)
+            except Exception as e:
+                logger.error(f"Error generating Rebot reply: {str(e) or type(e).__name__}")
+                await self.send_reply(reply_id, error="Rebot is unavailable right now. Please try again.", done=True)
+                return
 
-        # Send message to room group
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name, {"type": "rebot.message", "message": message}
+            try:
+                await asyncio.wait_for(window.compact(provider), timeout)
+            except Exception as e:
+                logger.error(f"Error summarizing Rebot context: {str(e) or type(e).__name__}")
+
+    async def stream_reply(self, provider, window, reply_id):
+        """
+        Stream Rebot's reply to the room, coalescing tokens into at most one frame per tick
+
+        Frames are sent in the background, one at a time: tokens that arrive
+        while a frame is in flight (or within a tick of the last one) join
+        the next frame. An overloaded loop therefore sends fewer, larger
+        frames instead of falling behind one frame per token.
+
+        Returns:
+            The full reply text
+        """
+        tick = get_batcher().tick
+        started = time.perf_counter()
+        parts = []
+        pending = []
+        sending = None
+        last_sent = None
+        async for delta in provider.stream_reply(window.messages()):
+            parts.append(delta)
+            pending.append(delta)
+            # The first token goes out immediately, later ones once the previous frame
+            # is out and a tick has passed
+            now = time.perf_counter()
+            if sending is None or (sending.done() and now - last_sent >= tick):
+                if sending is None:
+                    logger.info(f"Rebot first token in room {self.room_name} after {(now - started) * 1000:.0f}ms")
+                else:
+                    sending.result()
+                sending = asyncio.ensure_future(self.send_reply(reply_id, delta="".join(pending)))
+                pending = []
+                last_sent = now
+
+        if sending is not None:
+            await sending
+        content = "".join(parts).strip()
+        await self.send_reply(reply_id, delta="".join(pending), content=content, done=True)
+        return content
+
+    def save_message(self, role, content):
+        get_message_buffer().add(RebotMessage(
+            room_name=self.room_name,
+            user=self.scope["user"],
+            role=role,
+            content=content
+        ))
+
+    async def send_history(self, before=None):
+        page = await database_sync_to_async(get_history_page)(self.room_name, cursor=before)
+        await self.send_message({"history": page})
+
+    async def send_reply(self, reply_id, **reply):
+        await self.channel_layer.group_send(
+            self.room_group_name, {"type": "rebot.reply", "reply": {"id": reply_id, **reply}}
         )
 
-    # Receive message from room group
-    def chat_message(self, event):
-        message = event["message"]
+    # Receive a single message from room group
+    async def rebot_message(self, event):
+        await self.send_message({"message": event["message"]})
+
+    # Receive a batch of messages from room group, delivered as one frame
+    async def rebot_batch(self, event):
+        await self.send_message({"messages": event["messages"]})
 
-        # Send message to WebSocket
-        self.send(text_data=json.dumps({"message": message}))
\ No newline at end of file
+    # Receive a partial or final Rebot reply from room group
+    async def rebot_reply(self, event):
+        await self.send_message({"reply": event["reply"]})
@@ -0,0 +1,79 @@
+import asyncio
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from .providers import SYSTEM_PROMPT
+
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token), good enough for budgeting"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ConversationWindow:
+    """
+    Rolling conversation context for one room, bounded by a token budget
+
+    Recent turns are kept verbatim. Once they exceed the budget, the oldest
+    turns are folded into a running summary by the reply provider, and the
+    summary itself is truncated to its last quarter of the budget's worth
+    of tokens (at ~4 characters per token).
+    """
+
+    def __init__(self, token_budget=None):
+        self.token_budget = token_budget or getattr(settings, 'REBOT_CONTEXT_TOKENS', 2000)
+        self.summary = ''
+        self.turns = deque()
+        self.tokens = 0
+        # Replies in a room are generated one at a time so turns stay ordered
+        self.lock = asyncio.Lock()
+
+    def add(self, role, content):
+        self.turns.append({"role": role, "content": content})
+        self.tokens += estimate_tokens(content)
+
+    def messages(self):
+        """Chat messages for the provider: system prompt, summary, then recent turns"""
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Conversation so far: {self.summary}"})
+        return messages + list(self.turns)
+
+    async def compact(self, provider):
+        """Fold the oldest turns into the summary until the window fits its budget"""
+        folded = []
+        # Always keep the latest exchange verbatim
+        while self.tokens > self.token_budget and len(self.turns) > 2:
+            turn = self.turns.popleft()
+            self.tokens -= estimate_tokens(turn['content'])
+            folded.append(turn)
+
+        if folded:
+            summary = await provider.summarize(self.summary, folded)
+            limit = max(self.token_budget // 4, 1) * CHARS_PER_TOKEN
+            self.summary = summary[-limit:]
+
+
+class RoomContexts:
+    """Per-process LRU of room conversation windows, capped at REBOT_MAX_ROOMS"""
+
+    def __init__(self, max_rooms=None):
+        self.max_rooms = max_rooms or getattr(settings, 'REBOT_MAX_ROOMS', 1000)
+        self._windows = OrderedDict()
+
+    def get(self, room_name):
+        window = self._windows.get(room_name)
+        if window is None:
+            window = self._windows[room_name] = ConversationWindow()
+            if len(self._windows) > self.max_rooms:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(room_name)
+        return window
+
+
+room_contexts = RoomContexts()
@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import RebotMessage, RebotRoom
+from .serializers import RebotMessageSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """
+    Write-behind buffer for Rebot messages
+
+    Messages are queued in memory and written with one bulk_create once
+    REBOT_HISTORY_FLUSH_SIZE messages are waiting or REBOT_HISTORY_FLUSH_MS
+    milliseconds after the first queued message, whichever comes first.
+    """
+
+    def __init__(self, flush_size=None, flush_ms=None):
+        self.flush_size = flush_size or getattr(settings, 'REBOT_HISTORY_FLUSH_SIZE', 50)
+        self.flush_ms = flush_ms or getattr(settings, 'REBOT_HISTORY_FLUSH_MS', 500)
+        self._messages = []
+        self._timer = None
+
+    def add(self, message):
+        self._messages.append(message)
+        if len(self._messages) >= self.flush_size:
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.flush_ms / 1000, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        """Write every queued message in one bulk_create"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        messages, self._messages = self._messages, []
+        if not messages:
+            return
+
+        try:
+            await database_sync_to_async(RebotMessage.objects.bulk_create)(messages)
+        except Exception as e:
+            logger.error(f"Error saving {len(messages)} Rebot messages: {str(e)}")
+
+
+# One buffer per event loop; a process normally runs a single loop
+_buffers = {}
+
+
+def get_message_buffer():
+    loop = asyncio.get_running_loop()
+    if loop not in _buffers:
+        _buffers.clear()
+        _buffers[loop] = MessageBuffer()
+    return _buffers[loop]
+
+
+def encode_cursor(message):
+    """Opaque cursor pointing just before the given message in (created_at, id) order"""
+    raw = f"{message.created_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, message_id = raw.split('|')
+        created_at = parse_datetime(created_at)
+        message_id = int(message_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if created_at is None:
+        raise ValueError("Invalid cursor")
+    return created_at, message_id
+
+
+def can_access_room(room_name, user, claim=False):
+    """
+    Whether the user owns the room
+
+    With claim, a room nobody owns yet becomes the user's, unless another
+    user already posted in it (rooms from before rooms had owners).
+    """
+    room = RebotRoom.objects.filter(name=room_name).first()
+    if room is None:
+        if not claim or RebotMessage.objects.filter(room_name=room_name, user__isnull=False).exclude(user=user).exists():
+            return False
+        room, _ = RebotRoom.objects.get_or_create(name=room_name, defaults={'owner': user})
+    return room.owner_id == user.id
+
+
+def get_history_page(room_name, cursor=None, page_size=None):
+    """
+    Most recent messages of a room, keyset-paginated backwards in time
+
+    Args:
+        room_name: Room to read
+        cursor: next_cursor from the previous page, or None for the latest page
+        page_size: Number of messages (defaults to and is capped by REBOT_HISTORY_PAGE_SIZE)
+
+    Returns:
+        Dictionary with the page's serialized messages (oldest first) and the
+        cursor for the next, older page (None when there is none)
+    """
+    maximum = getattr(settings, 'REBOT_HISTORY_PAGE_SIZE', 50)
+    page_size = max(1, min(page_size or maximum, maximum))
+
+    messages = RebotMessage.objects.filter(room_name=room_name)
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+
+    # Fetch one extra row to know whether an older page exists
+    rows = list(messages.order_by('-created_at', '-id')[:page_size + 1])
+    page = rows[:page_size]
+    return {
+        "messages": RebotMessageSerializer(reversed(page), many=True).data,
+        "next_cursor": encode_cursor(page[-1]) if len(rows) > page_size else None
+    }
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+import tracemalloc
+
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from rebot import consumers, providers
+from rebot.providers import StubReplyProvider
+from rebot.routing import websocket_urlpatterns
+from recommendations.throttling import TokenBucket
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark RebotConsumer in one process: concurrent rooms/connections, memory per connection, "
+        "room broadcast throughput and first-token latency of streamed replies"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=20)
+        parser.add_argument('--connections', type=int, default=10, help="Connections per room")
+        parser.add_argument('--messages', type=int, default=20, help="Messages sent into each room")
+        parser.add_argument('--reply-delay', type=float, default=0.0, help="Per-token delay of the stub reply provider (s)")
+        parser.add_argument(
+            '--layer', choices=['memory', 'configured'], default='memory',
+            help="Use an in-memory channel layer, or the one configured in CHANNEL_LAYERS (e.g. Redis)"
+        )
+
+    def handle(self, *args, **options):
+        if options['layer'] == 'memory':
+            channel_layers.set('default', InMemoryChannelLayer(capacity=10000))
+
+        # Replies come from the local stub so the benchmark never calls the LLM
+        providers._provider = StubReplyProvider(delay=options['reply_delay'])
+        # Every room's burst comes from the same user; give it enough tokens for the whole run
+        consumers.reply_bucket = TokenBucket('rebot:benchmark', options['rooms'] * (options['messages'] + 1), 1)
+
+        user, _ = get_user_model().objects.get_or_create(email='rebot-benchmark@example.com', defaults={'user_name': 'rebot-benchmark'})
+        result = asyncio.run(self.run(user, options['rooms'], options['connections'], options['messages']))
+        for key, value in result.items():
+            self.stdout.write(f"{key:>24}: {value}")
+
+    async def run(self, user, rooms, connections, messages):
+        application = URLRouter(websocket_urlpatterns)
+        tracemalloc.start()
+
+        # Open every connection
+        started = time.perf_counter()
+        clients = {}
+        for room in range(rooms):
+            clients[room] = []
+            for _ in range(connections):
+                communicator = WebsocketCommunicator(application, f"/ws/rebot/bench{room}/")
+                communicator.scope["user"] = user
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise RuntimeError(f"Connection to room {room} was rejected")
+                # Drain the history page sent on connect
+                await communicator.receive_from(timeout=10)
+                clients[room].append(communicator)
+        connect_time = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+
+        # Every room gets a burst of messages from its first connection
+        started = time.perf_counter()
+        for room, members in clients.items():
+            for i in range(messages):
+                await members[0].send_to(text_data=json.dumps({"message": f"message {i}"}))
+
+        # Every member must receive every message and every finished reply, however they were batched
+        frames = chat_frames = 0
+        for members in clients.values():
+            for communicator in members:
+                received = replies = 0
+                while received < messages or replies < messages:
+                    payload = json.loads(await communicator.receive_from(timeout=10))
+                    if "reply" in payload:
+                        replies += payload["reply"].get("done", False)
+                    else:
+                        received += len(payload.get("messages", [])) or 1
+                        chat_frames += 1
+                    frames += 1
+        broadcast_time = time.perf_counter() - started
+        tracemalloc.stop()
+
+        # First-token latency: one message per room, timed until the first reply frame
+        latencies = []
+        for members in clients.values():
+            sender, listener = members[0], members[-1]
+            started = time.perf_counter()
+            await sender.send_to(text_data=json.dumps({"message": "latency probe"}))
+            first_token = None
+            while True:
+                payload = json.loads(await listener.receive_from(timeout=10))
+                if "reply" in payload and first_token is None:
+                    first_token = time.perf_counter() - started
+                    latencies.append(first_token)
+                if payload.get("reply", {}).get("done"):
+                    break
+        latencies.sort()
+
+        for members in clients.values():
+            for communicator in members:
+                await communicator.disconnect()
+
+        total_connections = rooms * connections
+        deliveries = total_connections * messages
+        return {
+            'rooms': rooms,
+            'connections': total_connections,
+            'connect time (s)': round(connect_time, 3),
+            'memory/connection (KB)': round(memory / total_connections / 1024, 2),
+            'messages delivered': deliveries,
+            'replies delivered': deliveries,
+            'frames sent': frames,
+            'messages per chat frame': round(deliveries / chat_frames, 2),
+            'broadcast time (s)': round(broadcast_time, 3),
+            'deliveries/s': round(deliveries / broadcast_time),
+            'first token p50 (ms)': round(latencies[len(latencies) // 2] * 1000, 2),
+            'first token p95 (ms)': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        }
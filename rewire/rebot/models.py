@@ -0,0 +1,33 @@
+from django.db import models
+from django.utils import timezone
+from core.models import User
+
+class RebotRoom(models.Model):
+    # Rooms are private to the user who opened them first
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rebot_rooms')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.owner})"
+
+
+class RebotMessage(models.Model):
+    room_name = models.CharField(max_length=100)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='rebot_messages')
+    role = models.CharField(max_length=20, choices=[
+        ('user', 'User'),
+        ('assistant', 'Assistant')
+    ])
+    content = models.TextField()
+    # Set when the message is received, not when the write-behind buffer flushes it
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Newest-first keyset pagination per room
+            models.Index(fields=['room_name', '-created_at', '-id'], name='rebotmsg_room_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.room_name} - {self.role}: {self.content[:50]}"
@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+import openai
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+SYSTEM_PROMPT = (
+    "You are Rebot, a supportive recovery coach in the Rewire app. You help people working "
+    "through addiction with short, practical and compassionate replies. Encourage them to "
+    "contact a professional or an emergency service if they are in danger."
+)
+
+
+class BaseReplyProvider:
+    """Interface for the backends that generate Rebot's replies"""
+
+    async def stream_reply(self, messages):
+        """
+        Stream a reply to the conversation
+
+        Args:
+            messages: Chat messages ({"role", "content"}) including the system prompt
+
+        Yields:
+            Pieces of reply text as they are generated
+        """
+        raise NotImplementedError
+        yield
+
+    async def summarize(self, summary, messages):
+        """Fold older messages into the running conversation summary"""
+        raise NotImplementedError
+
+
+class OpenAIReplyProvider(BaseReplyProvider):
+    def __init__(self):
+        self.api_key = os.getenv('OPENAI_API_KEY')
+        if not self.api_key:
+            raise ValueError("OpenAI API key is missing")
+        self.model = getattr(settings, 'REBOT_MODEL', 'gpt-4')
+        self.request_timeout = getattr(settings, 'REBOT_REPLY_TIMEOUT', 60)
+
+    async def stream_reply(self, messages):
+        response = await openai.ChatCompletion.acreate(
+            model=self.model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=500,
+            stream=True,
+            api_key=self.api_key,
+            request_timeout=self.request_timeout,
+        )
+        async for chunk in response:
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                yield content
+
+    async def summarize(self, summary, messages):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        response = await openai.ChatCompletion.acreate(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "Summarize this recovery coaching conversation in under 100 words, keeping goals, triggers and commitments."},
+                {"role": "user", "content": f"Summary so far: {summary or 'none'}\n\nNew messages:\n{transcript}"}
+            ],
+            temperature=0.3,
+            max_tokens=200,
+            api_key=self.api_key,
+            request_timeout=self.request_timeout,
+        )
+        return response.choices[0].message.content.strip()
+
+
+class StubReplyProvider(BaseReplyProvider):
+    """Local, deterministic provider for tests and benchmarks"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    async def stream_reply(self, messages):
+        last = messages[-1]['content'] if messages else ''
+        reply = f"I hear you: {last}. Let's take this one step at a time."
+        for word in reply.split(' '):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word + ' '
+
+    async def summarize(self, summary, messages):
+        # Append the folded messages and keep only the tail, so the summary stays bounded
+        parts = ([summary] if summary else []) + [message['content'] for message in messages]
+        return ' | '.join(parts)[-1000:]
+
+
+_provider = None
+
+
+def get_reply_provider():
+    """Return the provider configured by REBOT_REPLY_PROVIDER (a dotted path), creating it once"""
+    global _provider
+    if _provider is None:
+        path = getattr(settings, 'REBOT_REPLY_PROVIDER', 'rebot.providers.OpenAIReplyProvider')
+        _provider = import_string(path)()
+    return _provider
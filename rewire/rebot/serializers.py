@@ -0,0 +1,7 @@
+from rest_framework import serializers
+from .models import RebotMessage
+
+class RebotMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RebotMessage
+        fields = ['id', 'room_name', 'user', 'role', 'content', 'created_at']
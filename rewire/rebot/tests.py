@@ -1,3 +1,205 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from recommendations.throttling import TokenBucket
+from .consumers import RoomBatcher
+from .context import ConversationWindow, estimate_tokens, room_contexts
+from .history import get_message_buffer
+from .models import RebotMessage, RebotRoom
+from .providers import BaseReplyProvider, StubReplyProvider
+from .routing import websocket_urlpatterns
+
+
+class HungReplyProvider(BaseReplyProvider):
+    """Provider whose reply never arrives"""
+
+    async def stream_reply(self, messages):
+        await asyncio.Event().wait()
+        yield ''
+
+
+class RoomBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = mock.Mock(group_send=mock.AsyncMock())
+        self.batcher = RoomBatcher(tick=0.05)
+
+    async def wait_until_idle(self):
+        while self.batcher._flushers:
+            await asyncio.sleep(0.01)
+        return [call.args for call in self.layer.group_send.call_args_list]
+
+    async def test_lone_message_is_sent_unbatched(self):
+        self.batcher.send(self.layer, 'rebot_room', "hello")
+
+        self.assertEqual(await self.wait_until_idle(), [('rebot_room', {"type": "rebot.message", "message": "hello"})])
+
+    async def test_messages_within_a_tick_are_sent_as_one_batch(self):
+        self.batcher.send(self.layer, 'rebot_room', "first")
+        # The flusher sends the first message, then collects the next ones during its tick
+        await asyncio.sleep(0)
+        for message in ("second", "third", "fourth"):
+            self.batcher.send(self.layer, 'rebot_room', message)
+        self.batcher.send(self.layer, 'rebot_other', "elsewhere")
+
+        self.assertEqual(await self.wait_until_idle(), [
+            ('rebot_room', {"type": "rebot.message", "message": "first"}),
+            ('rebot_other', {"type": "rebot.message", "message": "elsewhere"}),
+            ('rebot_room', {"type": "rebot.batch", "messages": ["second", "third", "fourth"]}),
+        ])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class RebotConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='rebot@example.com', user_name='rebot')
+        patcher = mock.patch('rebot.consumers.get_reply_provider', return_value=StubReplyProvider())
+        self.provider = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def communicator(self, room, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/rebot/{room}/")
+        communicator.scope["user"] = user
+        return communicator
+
+    async def connect(self, room, user):
+        communicator = self.communicator(room, user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # History page sent on connect
+        await communicator.receive_json_from()
+        return communicator
+
+    async def close(self, communicator):
+        await get_message_buffer().flush()
+        await communicator.disconnect()
+
+    async def receive_reply(self, communicator):
+        while True:
+            payload = await communicator.receive_json_from()
+            if payload.get("reply", {}).get("done"):
+                return payload["reply"]
+
+    async def test_anonymous_socket_is_rejected(self):
+        connected, _ = await self.communicator('anonymous', AnonymousUser()).connect()
+
+        self.assertFalse(connected)
+        self.provider.assert_not_called()
+
+    async def test_only_the_owner_joins_a_room(self):
+        other = await get_user_model().objects.acreate(email='other@example.com', user_name='other')
+        communicator = await self.connect('private', self.user)
+
+        connected, _ = await self.communicator('private', other).connect()
+
+        self.assertFalse(connected)
+        await self.close(communicator)
+
+    async def test_room_claimed_by_another_poster_is_rejected(self):
+        other = await get_user_model().objects.acreate(email='other@example.com', user_name='other')
+        await RebotMessage.objects.acreate(room_name='legacy', user=other, role='user', content='hi')
+
+        connected, _ = await self.communicator('legacy', self.user).connect()
+
+        self.assertFalse(connected)
+        self.assertFalse(await RebotRoom.objects.filter(name='legacy').aexists())
+
+    async def test_overlong_room_name_is_rejected(self):
+        with self.assertRaises(ValueError):
+            await self.communicator('r' * 101, self.user).connect()
+
+    async def test_user_messages_are_throttled(self):
+        communicator = await self.connect('throttled', self.user)
+
+        with mock.patch('rebot.consumers.reply_bucket', TokenBucket('rebot:test', 1, 1)):
+            await communicator.send_to(text_data=json.dumps({"message": "first"}))
+            self.assertEqual((await communicator.receive_json_from())["message"], "first")
+            await self.receive_reply(communicator)
+
+            await communicator.send_to(text_data=json.dumps({"message": "second"}))
+            error = await communicator.receive_json_from()
+
+        self.assertEqual(error["error"], "Too many messages")
+        self.assertGreater(error["retry_after"], 0)
+        await self.close(communicator)
+
+    @override_settings(REBOT_MAX_MESSAGE_LENGTH=10)
+    async def test_non_text_and_oversized_messages_are_rejected(self):
+        communicator = await self.connect('invalid', self.user)
+
+        for message, error in ((5, "Invalid message format"), (["hi"], "Invalid message format"),
+                               ("   ", "Invalid message format"), ("x" * 11, "Message too long")):
+            await communicator.send_to(text_data=json.dumps({"message": message}))
+            self.assertEqual(await communicator.receive_json_from(), {"error": error})
+
+        self.provider.assert_not_called()
+        await self.close(communicator)
+
+    async def test_disconnect_cancels_pending_reply(self):
+        self.provider.return_value = HungReplyProvider()
+        communicator = await self.connect('left', self.user)
+        await communicator.send_to(text_data=json.dumps({"message": "hello"}))
+        await communicator.receive_json_from()
+        self.assertTrue(room_contexts.get('left').lock.locked())
+
+        await self.close(communicator)
+        await asyncio.sleep(0)
+
+        self.assertFalse(room_contexts.get('left').lock.locked())
+
+    @override_settings(REBOT_REPLY_TIMEOUT=0.1)
+    async def test_hung_reply_times_out_and_releases_room(self):
+        self.provider.return_value = HungReplyProvider()
+        communicator = await self.connect('hung', self.user)
+
+        await communicator.send_to(text_data=json.dumps({"message": "hello"}))
+        reply = await self.receive_reply(communicator)
+
+        self.assertIn("error", reply)
+        self.assertFalse(room_contexts.get('hung').lock.locked())
+        await self.close(communicator)
+
+
+class ConversationWindowTests(SimpleTestCase):
+    async def test_summary_is_kept_to_a_quarter_of_the_budget(self):
+        window = ConversationWindow(token_budget=100)
+        for i in range(20):
+            window.add("user", f"message {i} " * 10)
+
+        await window.compact(StubReplyProvider())
+
+        self.assertLessEqual(window.tokens, 100)
+        # 25 tokens at ~4 characters each
+        self.assertEqual(len(window.summary), 100)
+        self.assertLessEqual(estimate_tokens(window.summary), 26)
+
+
+class RoomHistoryViewTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create(email='owner@example.com', user_name='owner')
+        self.other = User.objects.create(email='other@example.com', user_name='other')
+        RebotRoom.objects.create(name='private', owner=self.owner)
+        RebotMessage.objects.create(room_name='private', user=self.owner, role='user', content='hi')
+        self.client = APIClient()
+
+    def test_owner_reads_history(self):
+        self.client.force_authenticate(self.owner)
+
+        response = self.client.get('/rebot/private/history/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([message['content'] for message in response.data['messages']], ['hi'])
+
+    def test_other_users_cannot_read_history(self):
+        self.client.force_authenticate(self.other)
+
+        self.assertEqual(self.client.get('/rebot/private/history/').status_code, 404)
+        self.assertEqual(self.client.get('/rebot/unclaimed/history/').status_code, 404)
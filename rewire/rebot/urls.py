@@ -0,0 +1,6 @@
+from django.urls import re_path
+from . import views
+
+urlpatterns = [
+    re_path(r'^(?P<room_name>\w{1,100})/history/$', views.get_room_history, name='get_room_history'),
+]
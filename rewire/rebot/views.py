@@ -0,0 +1,19 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .history import can_access_room, get_history_page
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_room_history(request, room_name):
+    """Get a room's messages, newest page first; pass next_cursor as cursor for older pages"""
+    if not can_access_room(room_name, request.user):
+        return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        page_size = int(request.query_params.get('page_size', 0)) or None
+        page = get_history_page(room_name, cursor=request.query_params.get('cursor'), page_size=page_size)
+    except ValueError:
+        return Response({"detail": "Invalid cursor or page size."}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(page)
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import AddictionProfile, Task, UserTask
+from .models import (
+    AddictionProfile, Task, UserTask, UserStats, UserTaskChange, TaskGenerationJob,
+    PregeneratedTaskSet, PregenerationRun
+)
 
 @admin.register(AddictionProfile)
 class AddictionProfileAdmin(admin.ModelAdmin):
@@ -12,6 +15,7 @@ class TaskAdmin(admin.ModelAdmin):
     list_display = ('title', 'difficulty', 'marks', 'created_at')
     search_fields = ('title', 'description')
     list_filter = ('difficulty', 'marks')
+    readonly_fields = ('content_hash', 'created_at')
 
 @admin.register(UserTask)
 class UserTaskAdmin(admin.ModelAdmin):
@@ -19,3 +23,39 @@ class UserTaskAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'user__user_name', 'task__title')
     list_filter = ('completed', 'user_rating', 'task__difficulty')
     readonly_fields = ('assigned_at',)
+    list_select_related = ('user', 'task')
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total_tasks', 'completed_tasks', 'total_marks', 'updated_at')
+    search_fields = ('user__email', 'user__user_name')
+    readonly_fields = ('updated_at',)
+    list_select_related = ('user',)
+
+@admin.register(TaskGenerationJob)
+class TaskGenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'count', 'status', 'created_at', 'finished_at')
+    search_fields = ('user__email', 'user__user_name')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'finished_at')
+
+@admin.register(UserTaskChange)
+class UserTaskChangeAdmin(admin.ModelAdmin):
+    list_display = ('user', 'version', 'op', 'created_at')
+    search_fields = ('user__email', 'user__user_name')
+    list_filter = ('op',)
+    readonly_fields = ('created_at',)
+    list_select_related = ('user',)
+
+@admin.register(PregeneratedTaskSet)
+class PregeneratedTaskSetAdmin(admin.ModelAdmin):
+    list_display = ('user', 'for_date', 'count', 'created_at', 'used_at')
+    search_fields = ('user__email', 'user__user_name')
+    list_filter = ('for_date',)
+    readonly_fields = ('created_at',)
+    list_select_related = ('user',)
+
+@admin.register(PregenerationRun)
+class PregenerationRunAdmin(admin.ModelAdmin):
+    list_display = ('for_date', 'last_user_id', 'generated', 'skipped', 'failed', 'started_at', 'finished_at')
+    readonly_fields = ('started_at', 'updated_at')
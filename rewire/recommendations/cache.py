@@ -0,0 +1,119 @@
+# tasks/cache.py
+import copy
+import hashlib
+import json
+import logging
+import re
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+HITS_KEY = 'task_sets:stats:hits'
+MISSES_KEY = 'task_sets:stats:misses'
+
+
+def _normalize_text(value):
+    """Lowercase, strip punctuation and collapse whitespace"""
+    value = re.sub(r'[^\w\s,;]', ' ', (value or '').lower())
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def _normalize_list(value):
+    """Normalize a free-text list (comma/semicolon/newline separated) into a sorted, de-duplicated list"""
+    items = re.split(r'[,;\n]', (value or '').lower())
+    return sorted({_normalize_text(item) for item in items if _normalize_text(item)})
+
+
+def profile_fingerprint(profile, count):
+    """
+    Build a stable fingerprint for the profile fields that drive task generation
+
+    Profiles that only differ in casing, punctuation, spacing or the order of
+    their triggers/goals share a fingerprint.
+    """
+    payload = {
+        'addiction_type': _normalize_text(profile.addiction_type),
+        'severity': (profile.severity or '').upper(),
+        'triggers': _normalize_list(profile.triggers),
+        'recovery_goals': _normalize_list(profile.recovery_goals),
+        'count': int(count),
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class TaskSetCache:
+    """
+    Cache of generated task sets keyed on a profile fingerprint
+
+    Entries live in a fixed number of slots (TASK_CACHE_MAX_ENTRIES), so the
+    cache stays bounded on every Django backend, including Redis which does
+    not honour MAX_ENTRIES. A new fingerprint that lands in an occupied slot
+    evicts the previous entry. Cache failures are logged and treated as misses.
+    """
+
+    def __init__(self, alias=None, timeout=None, max_entries=None):
+        self.alias = alias or getattr(settings, 'TASK_CACHE_ALIAS', 'task_sets')
+        self.timeout = timeout or getattr(settings, 'TASK_CACHE_TIMEOUT', 60 * 60 * 6)
+        self.max_entries = max_entries or getattr(settings, 'TASK_CACHE_MAX_ENTRIES', 10000)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _slot_key(self, fingerprint):
+        return f"task_sets:slot:{int(fingerprint, 16) % self.max_entries}"
+
+    def get(self, profile, count):
+        """Return a copy of the cached task list for the profile, or None on a miss"""
+        fingerprint = profile_fingerprint(profile, count)
+        try:
+            entry = self.cache.get(self._slot_key(fingerprint))
+        except Exception as e:
+            logger.error(f"Error reading task set cache: {str(e)}")
+            return None
+
+        if entry and entry.get('fingerprint') == fingerprint:
+            self._incr(HITS_KEY)
+            return copy.deepcopy(entry['tasks'])
+
+        self._incr(MISSES_KEY)
+        return None
+
+    def set(self, profile, count, tasks):
+        """Store a generated task list for the profile"""
+        fingerprint = profile_fingerprint(profile, count)
+        try:
+            self.cache.set(
+                self._slot_key(fingerprint),
+                {'fingerprint': fingerprint, 'tasks': tasks},
+                timeout=self.timeout
+            )
+        except Exception as e:
+            logger.error(f"Error writing task set cache: {str(e)}")
+
+    def stats(self):
+        """Return hit/miss counters and the hit rate"""
+        try:
+            counters = self.cache.get_many([HITS_KEY, MISSES_KEY])
+        except Exception as e:
+            logger.error(f"Error reading task set cache stats: {str(e)}")
+            counters = {}
+
+        hits = counters.get(HITS_KEY, 0)
+        misses = counters.get(MISSES_KEY, 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total * 100, 2) if total > 0 else 0
+        }
+
+    def _incr(self, key):
+        try:
+            # add() is a no-op when the counter exists, incr() is atomic on every backend
+            self.cache.add(key, 0, timeout=None)
+            self.cache.incr(key)
+        except Exception as e:
+            logger.error(f"Error updating task set cache stats: {str(e)}")
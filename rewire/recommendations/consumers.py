@@ -1,10 +1,15 @@
 # tasks/consumers.py
-import json
-from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import UserTask
+from channels.generic.websocket import AsyncWebsocketConsumer
+from core.backpressure import BackpressureMixin
+from core.wire import FrameDecodeError, WireProtocolMixin
+from . import stats
+from .sync import resume_task_sync
+
+class TaskConsumer(WireProtocolMixin, BackpressureMixin, AsyncWebsocketConsumer):
+    # Last task list version sent to this client; None until it sends subscribe_tasks
+    task_version = None
 
-class TaskConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         
@@ -26,10 +31,10 @@ class TaskConsumer(AsyncWebsocketConsumer):
         
         # Send initial stats when connecting
         stats = await self.get_user_stats()
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'user_stats',
             'data': stats
-        }))
+        }, coalesce_key='user_stats')
 
     async def disconnect(self, close_code):
         # Leave room group
@@ -39,70 +44,76 @@ class TaskConsumer(AsyncWebsocketConsumer):
         )
 
     # Receive message from WebSocket
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
+            text_data_json = self.decode_message(text_data, bytes_data)
+            # Valid frames that aren't objects have no action
             action = text_data_json.get("action")
-            
-            if action == "get_stats":
-                stats = await self.get_user_stats()
-                await self.send(text_data=json.dumps({
-                    'type': 'user_stats',
-                    'data': stats
-                }))
-                
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except (FrameDecodeError, AttributeError):
+            await self.send_message({
                 'type': 'error',
+                # Clients match on this text; keep it for every codec
                 'message': 'Invalid JSON format'
-            }))
+            })
+            return
+
+        if action == "get_stats":
+            stats = await self.get_user_stats()
+            await self.send_message({
+                'type': 'user_stats',
+                'data': stats
+            }, coalesce_key='user_stats')
+
+        elif action == "subscribe_tasks":
+            # Clients resume from the version of the last change they applied
+            version = text_data_json.get("version")
+            await self.subscribe_tasks(version if isinstance(version, int) else None)
 
     # Send task update to WebSocket
     async def task_update(self, event):
         # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'task_update',
             'data': event["data"]
-        }))
+        })
         
-    @database_sync_to_async
-    def get_user_stats(self):
-        """Get user's task statistics"""
-        # Get total tasks
-        total_tasks = UserTask.objects.filter(user=self.user).count()
-        completed_tasks = UserTask.objects.filter(user=self.user, completed=True).count()
-        
-        # Calculate completion rate
-        completion_rate = 0
-        if total_tasks > 0:
-            completion_rate = round(completed_tasks / total_tasks * 100, 2)
-            
-        # Get tasks by difficulty
-        easy_completed = UserTask.objects.filter(
-            user=self.user, 
-            completed=True,
-            task__difficulty='EASY'
-        ).count()
+    # Send coalesced stats changes to WebSocket
+    async def stats_delta(self, event):
+        await self.send_message({
+            'type': 'stats_delta',
+            'data': event["data"]
+        })
         
-        medium_completed = UserTask.objects.filter(
-            user=self.user, 
-            completed=True,
-            task__difficulty='MEDIUM'
-        ).count()
+    # Send task list changes to a subscribed client
+    async def task_changes(self, event):
+        if self.task_version is None:
+            return
+
+        # Skip changes the client already has (e.g. from its snapshot)
+        changes = [change for change in event["data"]["changes"] if change["version"] > self.task_version]
+        if not changes:
+            return
+
+        # Events from concurrent commits can arrive out of order; catch up from the log
+        if changes[0]["version"] != self.task_version + 1:
+            await self.subscribe_tasks(self.task_version)
+            return
+
+        self.task_version = changes[-1]["version"]
+        await self.send_message({
+            'type': 'task_changes',
+            'data': {
+                'version': self.task_version,
+                'changes': changes
+            }
+        })
         
-        hard_completed = UserTask.objects.filter(
-            user=self.user, 
-            completed=True,
-            task__difficulty='HARD'
-        ).count()
+    async def subscribe_tasks(self, version=None):
+        """Send a snapshot of the task list, or only the changes since the client's version"""
+        message = await database_sync_to_async(resume_task_sync)(self.user, version)
+        self.task_version = message['data']['version']
+        await self.send_message(message)
         
-        return {
-            "total_tasks": total_tasks,
-            "completed_tasks": completed_tasks,
-            "completion_rate": completion_rate,
-            "difficulty_breakdown": {
-                "easy": easy_completed,
-                "medium": medium_completed,
-                "hard": hard_completed
-            }
-        }
\ No newline at end of file
+    async def get_user_stats(self):
+        """Get user's task statistics"""
+        return await stats.aget_user_stats(self.user)
@@ -0,0 +1,105 @@
+# tasks/events.py
+import logging
+import threading
+import time
+from collections import Counter
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def user_tasks_group(user_id):
+    """Name of the channel group TaskConsumer joins for a user"""
+    return f"tasks_user_{user_id}_tasks"
+
+
+class StatsEventCoalescer:
+    """
+    Coalesces stats deltas into at most one event per user per window
+
+    The first delta for a user opens a window of TASK_EVENT_COALESCE_WINDOW
+    seconds; every delta that arrives before it closes is summed into the
+    same pending event, which is then sent to the user's group as a single
+    stats_delta message. One flusher thread, started on first use, closes
+    the windows of all users.
+    """
+
+    def __init__(self, window=None):
+        self.window = window if window is not None else getattr(settings, 'TASK_EVENT_COALESCE_WINDOW', 0.5)
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._flusher = None
+
+    def publish(self, user_id, **delta):
+        """Queue a delta (e.g. completed_tasks=1) for the user's next stats event"""
+        with self._condition:
+            pending = self._pending.get(user_id)
+            if pending is None:
+                pending = self._pending[user_id] = {
+                    'delta': Counter(), 'events': 0, 'due': time.monotonic() + self.window
+                }
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run, name='stats-events', daemon=True)
+                    self._flusher.start()
+                self._condition.notify()
+            pending['delta'].update(delta)
+            pending['events'] += 1
+
+    def _run(self):
+        # Windows close in the order they opened, so the first pending user is always due first
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                user_id, pending = next(iter(self._pending.items()))
+                wait = pending['due'] - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+            self.flush(user_id)
+
+    def flush(self, user_id):
+        """Send the user's pending delta, if any"""
+        with self._condition:
+            pending = self._pending.pop(user_id, None)
+        if not pending:
+            return
+
+        try:
+            async_to_sync(get_channel_layer().group_send)(user_tasks_group(user_id), {
+                'type': 'stats_delta',
+                'data': {
+                    'delta': dict(pending['delta']),
+                    'events': pending['events']
+                }
+            })
+        except Exception as e:
+            logger.error(f"Error publishing stats delta for user {user_id}: {str(e)}")
+
+
+stats_events = StatsEventCoalescer()
+
+
+def publish_stats_delta(user_id, **delta):
+    """Publish a stats delta once the current transaction (if any) commits"""
+    transaction.on_commit(lambda: stats_events.publish(user_id, **delta))
+
+
+def publish_task_changes(user_id, changes):
+    """Send task list changes to the user's group once the current transaction (if any) commits"""
+    def send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(user_tasks_group(user_id), {
+                'type': 'task_changes',
+                'data': {
+                    'version': changes[-1]['version'],
+                    'changes': changes
+                }
+            })
+        except Exception as e:
+            logger.error(f"Error publishing task changes for user {user_id}: {str(e)}")
+
+    transaction.on_commit(send)
@@ -0,0 +1,283 @@
+# tasks/llm.py
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import aiohttp
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    asyncio.TimeoutError,
+    aiohttp.ClientError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open"""
+
+
+def is_retryable(error):
+    if isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500:
+        return True
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an unhealthy provider for a while
+
+    After `failure_threshold` consecutive failed calls the circuit opens and
+    every call is refused for `reset_timeout` seconds. Then one trial call
+    is let through (half-open): success closes the circuit, failure opens
+    it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or getattr(settings, 'LLM_BREAKER_FAILURES', 5)
+        self.reset_timeout = reset_timeout or getattr(settings, 'LLM_BREAKER_RESET', 30)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Whether a call may go to the provider now"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_cancelled(self):
+        # A cancelled call says nothing about the provider's health, but frees the trial slot
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.error(f"LLM circuit breaker opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "open_for": round(time.monotonic() - self._opened_at, 1) if state != self.CLOSED else None,
+            }
+
+
+class LLMClient:
+    """
+    Long-lived OpenAI client shared by the whole process
+
+    Requests run on a background event loop that owns one aiohttp session,
+    so HTTP connections to the API are pooled and reused instead of opened
+    per request. Every call has a deadline (LLM_DEADLINE seconds, retries
+    included) and a per-attempt timeout (LLM_REQUEST_TIMEOUT). Retryable
+    errors are retried up to LLM_MAX_RETRIES times with full-jitter
+    exponential backoff. Calls fail fast with CircuitOpenError while the
+    model's circuit breaker is open, so callers go straight to their
+    fallback. Each model has its own breaker: routes to a healthy model
+    keep working while another is down.
+    """
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        if not self.api_key:
+            raise ValueError("OpenAI API key is missing")
+
+        # Another API-compatible endpoint (e.g. manage.py stub_llm_server) when set
+        self.api_base = getattr(settings, 'OPENAI_API_BASE', None)
+        self.request_timeout = getattr(settings, 'LLM_REQUEST_TIMEOUT', 20)
+        self.deadline = getattr(settings, 'LLM_DEADLINE', 45)
+        self.max_retries = getattr(settings, 'LLM_MAX_RETRIES', 2)
+        self.backoff = getattr(settings, 'LLM_RETRY_BACKOFF', 0.5)
+        self.pool_size = getattr(settings, 'LLM_POOL_SIZE', 20)
+        self.breakers = {}
+        self._breakers_lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "short_circuited": 0, "cancelled": 0}
+
+        self._session = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='llm-client', daemon=True).start()
+
+    def _run(self, coroutine):
+        """Run a coroutine on the client's loop and wait for it from any thread"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _use_session(self):
+        # Must run on the client's loop; openai reads the session from a context variable
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        openai.aiosession.set(self._session)
+
+    def breaker(self, model):
+        """The model's circuit breaker, created on first use"""
+        with self._breakers_lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker()
+            return self.breakers[model]
+
+    def _check_breaker(self, breaker):
+        self.counters["calls"] += 1
+        if not breaker.allow():
+            self.counters["short_circuited"] += 1
+            raise CircuitOpenError("LLM provider is unavailable")
+
+    def _backoff_delay(self, attempt, deadline):
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    async def _acomplete(self, **params):
+        breaker = self.breaker(params.get('model'))
+        self._check_breaker(breaker)
+        self._use_session()
+        if self.api_base:
+            params['api_base'] = self.api_base
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        delay = 0
+        while True:
+            try:
+                if delay:
+                    await asyncio.sleep(delay)
+                remaining = deadline - time.monotonic()
+                response = await asyncio.wait_for(
+                    openai.ChatCompletion.acreate(
+                        api_key=self.api_key,
+                        request_timeout=min(self.request_timeout, remaining),
+                        **params
+                    ),
+                    timeout=remaining
+                )
+                breaker.record_success()
+                return response
+            except asyncio.CancelledError:
+                self.counters["cancelled"] += 1
+                breaker.record_cancelled()
+                raise
+            except Exception as e:
+                delay = self._backoff_delay(attempt, deadline) if is_retryable(e) else None
+                if delay is None or attempt >= self.max_retries:
+                    self.counters["failures"] += 1
+                    breaker.record_failure()
+                    raise
+                logger.error(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                self.counters["retries"] += 1
+                attempt += 1
+
+    def complete(self, **params):
+        """ChatCompletion.create with pooling, deadline, retries and the circuit breaker"""
+        return self._run(self._acomplete(**params))
+
+    def submit(self, **params):
+        """
+        Start complete() without waiting for it
+
+        Returns a concurrent.futures.Future of the response. Cancelling the
+        future aborts the request and releases its pooled connection.
+        """
+        return asyncio.run_coroutine_threadsafe(self._acomplete(**params), self._loop)
+
+    async def _astream_open(self, params):
+        """Open a streamed completion; retried like complete() since nothing was received yet"""
+        response = await self._acomplete(stream=True, **params)
+        return response.__aiter__()
+
+    async def _anext_chunk(self, chunks, deadline):
+        # A stalled stream counts against the per-attempt timeout and the call's deadline
+        timeout = min(self.request_timeout, deadline - time.monotonic())
+        try:
+            return await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+        except StopAsyncIteration:
+            return None
+
+    def stream(self, **params):
+        """
+        Streamed ChatCompletion, yielding chunks to a synchronous caller
+
+        Opening the stream is retried; once chunks have arrived a failure is
+        raised to the caller, which decides what to do with the partial result.
+        """
+        deadline = time.monotonic() + self.deadline
+        chunks = self._run(self._astream_open(params))
+        finished = False
+        try:
+            while True:
+                chunk = self._run(self._anext_chunk(chunks, deadline))
+                if chunk is None:
+                    finished = True
+                    return
+                yield chunk
+        except Exception:
+            self.counters["failures"] += 1
+            self.breaker(params.get('model')).record_failure()
+            raise
+        finally:
+            # Release the pooled connection if the caller stopped early or the stream failed
+            if not finished:
+                self._run(self._aclose(chunks))
+
+    async def _aclose(self, chunks):
+        try:
+            await chunks.aclose()
+        except Exception as e:
+            logger.error(f"Error closing LLM stream: {str(e)}")
+
+    def stats(self):
+        with self._breakers_lock:
+            breakers = dict(self.breakers)
+        return {"breakers": {model: breaker.snapshot() for model, breaker in breakers.items()}, **self.counters}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """The process-wide LLMClient, created on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recommendations.models import Task, UserTask
+
+
+class Command(BaseCommand):
+    help = "Backfill Task.content_hash and merge duplicate tasks into a shared catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            # Group every task by its content hash; the oldest row becomes canonical
+            canonical = {}
+            duplicate_of = {}
+            hashes = {}
+            tasks = Task.objects.order_by('id').only('id', 'title', 'description', 'difficulty', 'content_hash')
+            for task in tasks.iterator(chunk_size=batch_size):
+                content_hash = Task.compute_content_hash(task.title, task.description, task.difficulty)
+                if content_hash in canonical:
+                    duplicate_of[task.id] = canonical[content_hash]
+                else:
+                    canonical[content_hash] = task.id
+                    if task.content_hash != content_hash:
+                        task.content_hash = content_hash
+                        hashes[task.id] = task
+
+            # Collapse assignments of the same user onto the canonical task,
+            # keeping the most progressed one (completed, then rated, then oldest)
+            affected_ids = set(duplicate_of) | set(duplicate_of.values())
+            assignments = defaultdict(list)
+            user_tasks = UserTask.objects.filter(task_id__in=affected_ids).only(
+                'id', 'user_id', 'task_id', 'completed', 'user_rating', 'assigned_at'
+            )
+            for user_task in user_tasks.iterator(chunk_size=batch_size):
+                canonical_id = duplicate_of.get(user_task.task_id, user_task.task_id)
+                assignments[(user_task.user_id, canonical_id)].append(user_task)
+
+            to_update = []
+            to_delete = []
+            for (user_id, canonical_id), group in assignments.items():
+                group.sort(key=lambda ut: (not ut.completed, ut.user_rating is None, ut.assigned_at, ut.id))
+                keep, drop = group[0], group[1:]
+                to_delete.extend(ut.id for ut in drop)
+                if keep.task_id != canonical_id:
+                    keep.task_id = canonical_id
+                    to_update.append(keep)
+
+            self.stdout.write(
+                f"{len(canonical)} unique tasks, {len(duplicate_of)} duplicates, "
+                f"{len(to_update)} assignments repointed, {len(to_delete)} duplicate assignments removed"
+            )
+
+            if dry_run:
+                transaction.set_rollback(True)
+                return
+
+            UserTask.objects.filter(id__in=to_delete).delete()
+            UserTask.objects.bulk_update(to_update, ['task'], batch_size=batch_size)
+            Task.objects.filter(id__in=list(duplicate_of)).delete()
+            Task.objects.bulk_update(hashes.values(), ['content_hash'], batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS("Task catalog deduplicated"))
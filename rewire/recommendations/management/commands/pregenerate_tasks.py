@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recommendations.cache import profile_fingerprint
+from recommendations.models import PregeneratedTaskSet, PregenerationRun
+from recommendations.pregeneration import active_profiles, store_task_set
+from recommendations.services import TaskGenerationService
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-generate a task set for every active profile, for tomorrow by default, so morning "
+        "requests are served without calling the LLM. Run it off-peak (e.g. nightly from cron). "
+        "Progress is checkpointed after every batch; running it again for the same date resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help="Day to generate for (YYYY-MM-DD, default tomorrow)")
+        parser.add_argument('--count', type=int, default=getattr(settings, 'PREGENERATION_COUNT', 9))
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'PREGENERATION_CONCURRENCY', 4),
+            help="Profiles generated at the same time"
+        )
+        parser.add_argument(
+            '--active-days', type=int, default=getattr(settings, 'PREGENERATION_ACTIVE_DAYS', 7),
+            help="Only profiles of users active in this many days"
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help="Profiles per checkpoint")
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Start over from the first profile; profiles with a current set are still skipped, so this retries failures"
+        )
+
+    def handle(self, *args, **options):
+        for_date = options['date'] or timezone.localdate() + timedelta(days=1)
+        count = options['count']
+
+        # Sets for past days can no longer be handed out
+        PregeneratedTaskSet.objects.filter(for_date__lt=timezone.localdate()).delete()
+
+        run, created = PregenerationRun.objects.get_or_create(for_date=for_date)
+        if options['restart'] and not created:
+            run.last_user_id = run.generated = run.skipped = run.failed = 0
+            run.finished_at = None
+            run.save()
+        elif run.finished_at:
+            self.stdout.write(f"Pregeneration for {for_date} already finished; use --restart to run it again")
+            return
+        elif run.last_user_id:
+            self.stdout.write(f"Resuming pregeneration for {for_date} after user {run.last_user_id}")
+
+        profiles = active_profiles(timezone.now() - timedelta(days=options['active_days'])).order_by('user_id')
+        service = TaskGenerationService()
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while True:
+                batch = list(profiles.filter(user_id__gt=run.last_user_id)[:options['batch_size']])
+                if not batch:
+                    break
+
+                # Profiles whose set for the day is still current are skipped
+                current = set(PregeneratedTaskSet.objects.filter(
+                    user_id__in=[profile.user_id for profile in batch],
+                    for_date=for_date,
+                    count=count,
+                    used_at__isnull=True
+                ).values_list('user_id', 'fingerprint'))
+                todo = [
+                    profile for profile in batch
+                    if (profile.user_id, profile_fingerprint(profile, count)) not in current
+                ]
+                run.skipped += len(batch) - len(todo)
+
+                # Only the LLM calls run on the pool; database work stays on this thread
+                futures = []
+                for profile in todo:
+                    reused_tasks = service.reuse_rated_tasks(profile, count)
+                    history = service.recent_task_history(profile)
+                    futures.append((profile, reused_tasks, executor.submit(
+                        service.generate_tasks, profile, count=count - len(reused_tasks), fallback=False, reuse=False,
+                        history=history
+                    )))
+                for profile, reused_tasks, future in futures:
+                    try:
+                        store_task_set(profile, for_date, count, reused_tasks + future.result())
+                        run.generated += 1
+                    except Exception as e:
+                        self.stderr.write(f"User {profile.user_id}: {str(e)}")
+                        run.failed += 1
+
+                run.last_user_id = batch[-1].user_id
+                run.save(update_fields=['last_user_id', 'generated', 'skipped', 'failed', 'updated_at'])
+                self.stdout.write(
+                    f"Up to user {run.last_user_id}: {run.generated} generated, "
+                    f"{run.skipped} already current, {run.failed} failed"
+                )
+
+        run.finished_at = timezone.now()
+        run.save(update_fields=['finished_at', 'updated_at'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Pregenerated {run.generated} task sets for {for_date} ({run.skipped} already current, {run.failed} failed)"
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recommendations.models import UserStats
+from recommendations.stats import COUNTER_FIELDS, compute_user_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized UserStats counters from UserTask rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help="Only rebuild these user ids")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        batch_size = options['batch_size']
+
+        # One grouped query computes every counter for every user
+        counters = compute_user_counters(user_ids)
+
+        stats = [UserStats(user_id=user_id, **row) for user_id, row in counters.items()]
+
+        with transaction.atomic():
+            # Users without any tasks left are reset rather than keeping stale counters
+            stale = UserStats.objects.exclude(user_id__in=[s.user_id for s in stats])
+            if user_ids:
+                stale = stale.filter(user_id__in=user_ids)
+            stale.update(**{field: 0 for field in COUNTER_FIELDS})
+
+            UserStats.objects.bulk_create(
+                stats,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=COUNTER_FIELDS
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {len(stats)} users"))
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from types import SimpleNamespace
+
+from aiohttp import web
+from django.core.management.base import BaseCommand
+
+from recommendations.providers import TemplateTaskProvider
+
+PROFILE_FIELDS = {
+    'addiction_type': r"- Addiction Type: (.*)",
+    'severity': r"- Severity: (.*)",
+    'triggers': r"- Triggers: (.*)",
+    'recovery_goals': r"- Recovery Goals: (.*)",
+}
+
+# Error responses the real API returns when it is overloaded
+ERRORS = [
+    (429, "rate_limit_exceeded", "Rate limit reached for requests"),
+    (500, "server_error", "The server had an error while processing your request"),
+    (503, "server_error", "The engine is currently overloaded, please try again later"),
+]
+
+
+def parse_prompt(messages):
+    """Profile, task count and batch index from a TaskGenerationService prompt"""
+    prompt = "\n".join(message.get('content', '') for message in messages)
+    profile = SimpleNamespace(**{
+        field: (match.group(1).strip() if (match := re.search(pattern, prompt)) else '')
+        for field, pattern in PROFILE_FIELDS.items()
+    })
+    count = sum(int(number) for number in re.findall(r"- (\d+) (?:EASY|MEDIUM|HARD) tasks", prompt)) or 9
+    batch = int(match.group(1)) - 1 if (match := re.search(r"This is batch (\d+) of", prompt)) else 0
+    return profile, count, batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local server mimicking the OpenAI chat completions API, answering with "
+        "TemplateTaskProvider tasks after a configurable latency and with a configurable error rate. "
+        "Point the app at it with OPENAI_API_BASE=http://<host>:<port>/v1"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--latency', type=float, default=0.5, help="Mean delay before the response starts (s)")
+        parser.add_argument('--jitter', type=float, default=0.2, help="Uniform jitter added to the latency (+/- s)")
+        parser.add_argument('--token-delay', type=float, default=0.02, help="Delay between streamed chunks (s)")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with 429/500/503")
+        parser.add_argument('--hang-rate', type=float, default=0.0, help="Share of requests that never get an answer")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for latency and error sampling")
+        parser.add_argument(
+            '--model-latency', action='append', default=[], metavar='MODEL=SECONDS',
+            help="Mean latency for one model, overriding --latency (repeatable)"
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.provider = TemplateTaskProvider()
+        self.model_latency = {}
+        for value in options['model_latency']:
+            model, _, seconds = value.partition('=')
+            self.model_latency[model] = float(seconds)
+
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        self.stdout.write(f"Stub LLM server on http://{options['host']}:{options['port']}/v1")
+        web.run_app(app, host=options['host'], port=options['port'], print=None)
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        options = self.options
+
+        mean_latency = self.model_latency.get(body.get('model'), options['latency'])
+        latency = max(0.0, mean_latency + self.random.uniform(-options['jitter'], options['jitter']))
+        await asyncio.sleep(latency)
+
+        roll = self.random.random()
+        if roll < options['hang_rate']:
+            # Like a hung upstream: the client's timeout has to give up
+            await asyncio.sleep(3600)
+        if roll < options['hang_rate'] + options['error_rate']:
+            status, code, message = self.random.choice(ERRORS)
+            return web.json_response(
+                {"error": {"message": message, "type": code, "param": None, "code": code}}, status=status
+            )
+
+        profile, count, batch = parse_prompt(body.get('messages', []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get('model', 'gpt-4')
+        created = int(time.time())
+
+        if not body.get('stream'):
+            content = self.provider.complete(profile, count, body.get('messages', []), batch=batch)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for piece in self.provider.stream(profile, count, body.get('messages', []), batch=batch):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            if options['token_delay']:
+                await asyncio.sleep(options['token_delay'])
+        await response.write(b"data: [DONE]\n\n")
+        return response
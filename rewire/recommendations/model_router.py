@@ -0,0 +1,244 @@
+# tasks/model_router.py
+import bisect
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .providers import get_task_provider
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds (seconds per generated task), spaced 25% apart from 10ms to ~2 minutes
+LATENCY_BUCKETS = [0.01 * 1.25 ** i for i in range(43)]
+
+
+class LatencyHistogram:
+    """
+    Bucketed latency histogram that slowly forgets old samples
+
+    Every `half_life` samples all counts are halved, so quantiles follow a
+    route whose latency changes instead of being anchored by its history.
+    """
+
+    def __init__(self, half_life=200):
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._counts = [0.0] * (len(LATENCY_BUCKETS) + 1)
+        self._since_decay = 0
+        self.samples = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.samples += 1
+            self._since_decay += 1
+            if self._since_decay >= self.half_life:
+                self._counts = [count / 2 for count in self._counts]
+                self._since_decay = 0
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, or None without samples"""
+        with self._lock:
+            total = sum(self._counts)
+            if not total:
+                return None
+            running = 0.0
+            for index, count in enumerate(self._counts):
+                running += count
+                if running >= q * total:
+                    break
+        return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+
+
+class Route:
+    """A provider and model task generation can be sent to, with its observed latency"""
+
+    def __init__(self, name, provider, max_count=None):
+        self.name = name
+        self.provider = provider
+        self.max_count = max_count
+        # Latency per requested task, since completions grow with the task count
+        self.histogram = LatencyHistogram()
+        self.counters = {"calls": 0, "wins": 0, "failures": 0, "cancelled": 0}
+
+    def accepts(self, count):
+        return self.max_count is None or count <= self.max_count
+
+    def estimate(self, count, quantile, min_samples):
+        """Expected latency of a `count` task request at the quantile, None until there is enough data"""
+        if self.histogram.samples < min_samples:
+            return None
+        return self.histogram.quantile(quantile) * count
+
+    def record(self, seconds, count):
+        self.histogram.record(seconds / max(count, 1))
+
+    def stats(self, quantile):
+        p50 = self.histogram.quantile(0.5)
+        p95 = self.histogram.quantile(quantile)
+        return {
+            "name": self.name,
+            "model": self.provider.model,
+            "max_count": self.max_count,
+            "samples": self.histogram.samples,
+            "p50_per_task": round(p50, 3) if p50 is not None else None,
+            "p95_per_task": round(p95, 3) if p95 is not None else None,
+            **self.counters,
+        }
+
+
+class TaskRouter:
+    """
+    Chooses the route for each generation request and hedges slow ones
+
+    The primary is the first configured route that accepts the count and
+    whose expected latency at the hedge quantile (p95) is within the SLO;
+    if none is, the fastest. Routes without enough samples yet count as
+    within the SLO so they get measured. If the primary hasn't answered by
+    its p95 deadline (capped at the SLO), or fails first, the same request
+    goes to the fastest other route and whichever answers first wins; the
+    other is cancelled. A cancelled call's elapsed time is recorded as a
+    lower bound of its latency, so a route that keeps losing still looks slow.
+    """
+
+    def __init__(self, routes, slo=None, quantile=None, min_samples=None, min_hedge_delay=None):
+        self.routes = routes
+        self.slo = slo or getattr(settings, 'TASK_GENERATION_LATENCY_SLO', 15)
+        self.quantile = quantile or getattr(settings, 'TASK_GENERATION_HEDGE_QUANTILE', 0.95)
+        self.min_samples = min_samples or getattr(settings, 'TASK_GENERATION_ROUTE_MIN_SAMPLES', 20)
+        self.min_hedge_delay = min_hedge_delay or getattr(settings, 'TASK_GENERATION_MIN_HEDGE_DELAY', 1.0)
+        self.counters = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+    def select(self, count):
+        """The primary route for a request of `count` tasks and the route to hedge it with (or None)"""
+        candidates = [route for route in self.routes if route.accepts(count)] or self.routes
+        estimates = {route: route.estimate(count, self.quantile, self.min_samples) for route in candidates}
+
+        within_slo = [route for route in candidates if estimates[route] is None or estimates[route] <= self.slo]
+        primary = within_slo[0] if within_slo else min(candidates, key=lambda route: estimates[route])
+
+        # Unmeasured routes sort first so they get measured
+        others = sorted(
+            (route for route in candidates if route is not primary),
+            key=lambda route: estimates[route] or 0
+        )
+        return primary, (others[0] if others else None)
+
+    def hedge_delay(self, route, count):
+        """Seconds to wait for the route before hedging: its p95, at most the SLO"""
+        estimate = route.estimate(count, self.quantile, self.min_samples)
+        # Unmeasured: leave the hedge half the SLO to answer in
+        delay = self.slo / 2 if estimate is None else min(estimate, self.slo)
+        return max(delay, self.min_hedge_delay)
+
+    def complete(self, profile, count, messages, batch=0):
+        """Generate through the selected route, hedging it if needed; returns the completion text"""
+        self.counters["requests"] += 1
+        primary, secondary = self.select(count)
+        calls = {}
+
+        def start(route):
+            route.counters["calls"] += 1
+            calls[route.provider.submit(profile, count, messages, batch=batch)] = (route, time.monotonic())
+
+        start(primary)
+        hedge_at = time.monotonic() + self.hedge_delay(primary, count)
+        hedged = secondary is None
+        pending = set(calls)
+        error = None
+
+        while True:
+            timeout = None if hedged else max(0.0, hedge_at - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                route, started = calls[future]
+                try:
+                    content = future.result()
+                except Exception as e:
+                    route.counters["failures"] += 1
+                    error = error or e
+                    continue
+
+                route.record(time.monotonic() - started, count)
+                route.counters["wins"] += 1
+                if route is not primary:
+                    self.counters["hedge_wins"] += 1
+                for loser in pending:
+                    loser_route, loser_started = calls[loser]
+                    loser.cancel()
+                    loser_route.counters["cancelled"] += 1
+                    loser_route.record(time.monotonic() - loser_started, count)
+                return content
+
+            # The primary is past its deadline or has failed: send the request to the secondary too
+            if not hedged and (not pending or time.monotonic() >= hedge_at):
+                hedged = True
+                self.counters["hedged"] += 1
+                start(secondary)
+                pending = set(future for future in calls if not future.done())
+                continue
+
+            if not pending:
+                raise error
+
+    def stream(self, profile, count, messages, batch=0):
+        """Stream from the primary route; a stream can't be hedged once it has started"""
+        route, _ = self.select(count)
+        route.counters["calls"] += 1
+        started = time.monotonic()
+        try:
+            yield from route.provider.stream(profile, count, messages, batch=batch)
+        except Exception:
+            route.counters["failures"] += 1
+            raise
+        route.counters["wins"] += 1
+        route.record(time.monotonic() - started, count)
+
+    def stats(self):
+        return {
+            "slo": self.slo,
+            "quantile": self.quantile,
+            **self.counters,
+            "routes": [route.stats(self.quantile) for route in self.routes],
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def build_routes():
+    """
+    Routes from TASK_GENERATION_ROUTES
+
+    Each entry is a dict with a "name" and optionally a "provider" (dotted
+    path, default TASK_GENERATION_PROVIDER), a "model" and a "max_count".
+    Without routes, everything goes to the TASK_GENERATION_PROVIDER.
+    """
+    configured = getattr(settings, 'TASK_GENERATION_ROUTES', None)
+    if not configured:
+        return [Route('default', get_task_provider())]
+
+    default_path = getattr(settings, 'TASK_GENERATION_PROVIDER', 'recommendations.providers.OpenAITaskProvider')
+    return [
+        Route(
+            config['name'],
+            import_string(config.get('provider', default_path))(model=config.get('model')),
+            max_count=config.get('max_count')
+        )
+        for config in configured
+    ]
+
+
+def get_task_router():
+    """The process-wide TaskRouter, created on first use"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = TaskRouter(build_routes())
+        return _router
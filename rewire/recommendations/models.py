@@ -1,5 +1,9 @@
 # tasks/models.py
-from django.db import models
+import hashlib
+import re
+import uuid
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max
 from core.models import User
 
 class AddictionProfile(models.Model):
@@ -27,11 +31,32 @@ class Task(models.Model):
         ('HARD', 'Hard')
     ])
     marks = models.IntegerField()
+    # SHA-256 of the normalized title/description/difficulty, shared by identical tasks
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.title} ({self.difficulty})"
 
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash(self.title, self.description, self.difficulty)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def normalize_text(value):
+        """Strip surrounding whitespace and collapse internal runs of whitespace"""
+        return re.sub(r'\s+', ' ', value or '').strip()
+
+    @classmethod
+    def compute_content_hash(cls, title, description, difficulty):
+        """Hash of the task content, ignoring case and whitespace differences"""
+        content = '\x1f'.join([
+            cls.normalize_text(title).lower(),
+            cls.normalize_text(description).lower(),
+            (difficulty or '').upper()
+        ])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
 class UserTask(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tasks')
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
@@ -50,6 +75,156 @@ class UserTask(models.Model):
 
     class Meta:
         unique_together = ('user', 'task')
+        indexes = [
+            # Completed/pending filters and the stats counts
+            models.Index(fields=['user', 'completed'], name='usertask_user_completed_idx'),
+            # Task list keyset pagination (newest first)
+            models.Index(fields=['user', '-assigned_at', '-id'], name='usertask_user_assigned_idx'),
+            # Completed rows only: per-difficulty completion counts and marks
+            models.Index(
+                fields=['user', 'task'],
+                condition=models.Q(completed=True),
+                name='usertask_completed_part_idx'
+            ),
+        ]
         
     def __str__(self):
-        return f"{self.user.user_name} - {self.task.title}"
\ No newline at end of file
+        return f"{self.user.user_name} - {self.task.title}"
+
+class UserStats(models.Model):
+    """Per-user task counters, kept up to date on every assignment and completion"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='task_stats')
+    total_tasks = models.PositiveIntegerField(default=0)
+    completed_tasks = models.PositiveIntegerField(default=0)
+    easy_completed = models.PositiveIntegerField(default=0)
+    medium_completed = models.PositiveIntegerField(default=0)
+    hard_completed = models.PositiveIntegerField(default=0)
+    total_marks = models.IntegerField(default=0)
+    # Bumped once per UserTaskChange; clients resume the task list delta-sync from it
+    task_version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'User stats'
+
+    def __str__(self):
+        return f"{self.user.user_name}'s stats"
+
+    @classmethod
+    def increment(cls, user, **deltas):
+        """
+        Atomically add deltas to the user's counters, creating the row if needed
+
+        Must run in the transaction that made the change being counted. Uses
+        F-expressions so concurrent updates never lose increments; one query
+        when the row exists. A missing row is seeded from the user's UserTask
+        rows, which already include this change, so users whose tasks predate
+        their row keep their history; task_version continues from the last
+        logged UserTaskChange.
+        """
+        increments = {field: F(field) + value for field, value in deltas.items()}
+        if cls.objects.filter(user=user).update(**increments):
+            return
+
+        # Imported here: stats imports this module
+        from .stats import COUNTER_FIELDS, compute_user_counters
+        seed = compute_user_counters([user.id]).get(user.id, dict.fromkeys(COUNTER_FIELDS, 0))
+        last_version = UserTaskChange.objects.filter(user=user).aggregate(last=Max('version'))['last']
+        seed['task_version'] = (last_version or 0) + deltas.get('task_version', 0)
+        try:
+            with transaction.atomic():
+                cls.objects.create(user=user, **seed)
+        except IntegrityError:
+            # A concurrent transaction created the row first, without seeing this change
+            cls.objects.filter(user=user).update(**increments)
+
+class UserTaskChange(models.Model):
+    """
+    Bounded per-user log of task list changes, one row per task_version
+
+    Lets a reconnecting TaskConsumer client catch up from its last version
+    instead of refetching its whole task list.
+    """
+    OP_INSERT = 'insert'
+    OP_UPDATE = 'update'
+    OP_COMPLETE = 'complete'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_changes')
+    version = models.PositiveBigIntegerField()
+    op = models.CharField(max_length=10, choices=[
+        (OP_INSERT, 'Insert'),
+        (OP_UPDATE, 'Update'),
+        (OP_COMPLETE, 'Complete')
+    ])
+    # The serialized UserTask after the change
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'version')
+
+    def __str__(self):
+        return f"{self.user.user_name} v{self.version} {self.op}"
+
+class TaskGenerationJob(models.Model):
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_COMPLETED = 'COMPLETED'
+    STATUS_FAILED = 'FAILED'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_jobs')
+    count = models.PositiveIntegerField(default=9)
+    status = models.CharField(max_length=20, default=STATUS_PENDING, choices=[
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed')
+    ])
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user.user_name} - {self.count} tasks ({self.status})"
+
+class PregeneratedTaskSet(models.Model):
+    """
+    Task set generated ahead of time for a user and day
+
+    Filled by the nightly pregenerate_tasks command and after profile
+    changes; get_recommended_tasks hands it out once instead of calling
+    the LLM, as long as the profile still has the fingerprint it was
+    generated for.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pregenerated_task_sets')
+    for_date = models.DateField()
+    count = models.PositiveIntegerField(default=9)
+    # profile_fingerprint() of the profile and count the set was generated for
+    fingerprint = models.CharField(max_length=64)
+    tasks = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'for_date', 'count')
+
+    def __str__(self):
+        return f"{self.user.user_name} - {self.count} tasks for {self.for_date}"
+
+class PregenerationRun(models.Model):
+    """Checkpoint of a pregenerate_tasks run, so an interrupted run resumes where it stopped"""
+    for_date = models.DateField(unique=True)
+    # Profiles are processed in user id order; everything up to this id is done
+    last_user_id = models.PositiveBigIntegerField(default=0)
+    generated = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Pregeneration for {self.for_date} (up to user {self.last_user_id})"
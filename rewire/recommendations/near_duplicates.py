@@ -0,0 +1,144 @@
+# tasks/near_duplicates.py
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .models import UserTask
+from .sync import get_task_version
+
+NUM_PERMUTATIONS = 64
+# Words are cut to this many characters, so "meditate"/"meditation" or "trigger"/"triggers" match
+STEM_LENGTH = 5
+STOP_WORDS = frozenset(
+    "a an and are as at be by each every for from in into is it of on or that the their this to with "
+    "you your yourself".split()
+)
+
+# Multiply-shift hash family: the high 32 bits of a*x + b (mod 2**64), with odd a
+_random = np.random.default_rng(20240611)
+_A = _random.integers(1, 2 ** 63, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64) | np.uint64(1)
+_B = _random.integers(0, 2 ** 63, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64)
+_EMPTY = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint32).max, dtype=np.uint32)
+
+
+def word_shingles(text):
+    """Stems of the text's words, ignoring case, punctuation, word order and stop words"""
+    return {word[:STEM_LENGTH] for word in re.findall(r'\w+', (text or '').lower()) if word not in STOP_WORDS}
+
+
+def minhash(text):
+    """MinHash signature of the text's shingles"""
+    shingles = word_shingles(text)
+    if not shingles:
+        return _EMPTY
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    return ((_A * hashes + _B) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+
+def task_signatures(tasks):
+    """
+    Signatures of task dictionaries (or Task instances), shape (tasks, 2, NUM_PERMUTATIONS)
+
+    The first signature covers the title, the second title and description.
+    """
+    signatures = np.empty((len(tasks), 2, NUM_PERMUTATIONS), dtype=np.uint32)
+    for i, task in enumerate(tasks):
+        title, description = (
+            (task['title'], task['description']) if isinstance(task, dict) else (task.title, task.description)
+        )
+        signatures[i, 0] = minhash(title)
+        signatures[i, 1] = minhash(f"{title} {description}")
+    return signatures
+
+
+def find_near_duplicates(history, batch, threshold=None, title_threshold=None):
+    """
+    Which tasks of a batch near-duplicate the history or an earlier task of the batch
+
+    Two tasks are near-duplicates when the estimated Jaccard similarity of
+    their title+description shingles reaches NEAR_DUPLICATE_THRESHOLD, or
+    that of their titles reaches NEAR_DUPLICATE_TITLE_THRESHOLD.
+
+    Returns:
+        Boolean array with one entry per batch task
+    """
+    threshold = threshold or getattr(settings, 'NEAR_DUPLICATE_THRESHOLD', 0.5)
+    title_threshold = title_threshold or getattr(settings, 'NEAR_DUPLICATE_TITLE_THRESHOLD', 0.7)
+
+    candidates = np.concatenate([history, batch])
+    # Share of equal MinHash values estimates the Jaccard similarity: (batch, candidates, 2)
+    similarity = (batch[:, None] == candidates[None]).mean(axis=-1)
+    duplicate = (similarity[..., 0] >= title_threshold) | (similarity[..., 1] >= threshold)
+
+    # Within the batch only earlier tasks count, so the first of a pair is kept
+    duplicate[:, len(history):] &= np.tri(len(batch), k=-1, dtype=bool)
+    return duplicate.any(axis=1)
+
+
+class SignatureCache:
+    """
+    Per-user MinHash signatures of the user's most recent tasks
+
+    Entries are tagged with the user's task_version and reloaded when it
+    has moved on; assignments made by this process extend the entry in
+    place instead. The least recently used users are evicted beyond
+    NEAR_DUPLICATE_CACHE_USERS.
+    """
+
+    def __init__(self, history_size=None, max_users=None):
+        self.history_size = history_size or getattr(settings, 'NEAR_DUPLICATE_HISTORY', 50)
+        self.max_users = max_users or getattr(settings, 'NEAR_DUPLICATE_CACHE_USERS', 2000)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _store(self, user_id, version, signatures, titles):
+        with self._lock:
+            self._entries[user_id] = (version, signatures[-self.history_size:], titles[-self.history_size:])
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def history(self, user_id):
+        """Signatures and titles of the user's recent tasks, oldest first"""
+        version = get_task_version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1], entry[2]
+
+        recent = list(
+            UserTask.objects.filter(user_id=user_id)
+            .select_related('task')
+            .only('task__title', 'task__description')
+            .order_by('-assigned_at', '-id')[:self.history_size]
+        )[::-1]
+        tasks = [user_task.task for user_task in recent]
+        signatures, titles = task_signatures(tasks), [task.title for task in tasks]
+        self._store(user_id, version, signatures, titles)
+        return signatures, titles
+
+    def record_inserts(self, user_id, previous_version, version, tasks):
+        """Append newly assigned tasks to the user's entry if it was current before the assignment"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        if entry[0] != previous_version:
+            with self._lock:
+                self._entries.pop(user_id, None)
+            return
+        self._store(
+            user_id, version,
+            np.concatenate([entry[1], task_signatures(tasks)]),
+            entry[2] + [task.title for task in tasks]
+        )
+
+
+signature_cache = SignatureCache()
@@ -0,0 +1,75 @@
+# tasks/pagination.py
+import base64
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(user_task):
+    """Opaque cursor pointing just after the given UserTask in (assigned_at, id) order"""
+    raw = f"{user_task.assigned_at.isoformat()}|{user_task.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        assigned_at, user_task_id = raw.split('|')
+        assigned_at = parse_datetime(assigned_at)
+        user_task_id = int(user_task_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if assigned_at is None:
+        raise ValueError("Invalid cursor")
+    return assigned_at, user_task_id
+
+
+def get_page_size(value):
+    """Parse a requested page size, falling back to the default and capping it at the maximum"""
+    default = getattr(settings, 'TASK_LIST_PAGE_SIZE', 20)
+    maximum = getattr(settings, 'TASK_LIST_MAX_PAGE_SIZE', 100)
+    try:
+        page_size = int(value) if value is not None else default
+    except ValueError:
+        page_size = default
+    return max(1, min(page_size, maximum))
+
+
+def seek_after(queryset, cursor):
+    """Restrict the queryset to rows that come after the cursor in (assigned_at, id) descending order"""
+    assigned_at, user_task_id = decode_cursor(cursor)
+    return queryset.filter(
+        Q(assigned_at__lt=assigned_at) | Q(assigned_at=assigned_at, id__lt=user_task_id)
+    )
+
+
+def paginate_user_tasks(queryset, cursor=None, page_size=20):
+    """
+    Keyset pagination over UserTasks, newest first
+
+    Seeks on (assigned_at, id) instead of using OFFSET, so every page costs
+    the same however deep the client has scrolled.
+
+    Args:
+        queryset: UserTask queryset (filters and projections already applied)
+        cursor: Cursor returned with the previous page, or None for the first page
+        page_size: Number of rows per page
+
+    Returns:
+        Tuple of (list of UserTasks, next cursor or None)
+    """
+    if cursor:
+        queryset = seek_after(queryset, cursor)
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset.order_by('-assigned_at', '-id')[:page_size + 1])
+    page = rows[:page_size]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > page_size else None
+    return page, next_cursor
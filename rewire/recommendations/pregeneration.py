@@ -0,0 +1,111 @@
+# tasks/pregeneration.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .cache import profile_fingerprint
+from .models import AddictionProfile, PregeneratedTaskSet, UserTask
+from .services import TaskGenerationService
+
+
+def active_profiles(since=None):
+    """
+    Profiles of users who were assigned tasks, logged in or changed their profile since `since`
+
+    Defaults to the last PREGENERATION_ACTIVE_DAYS days.
+    """
+    if since is None:
+        since = timezone.now() - timedelta(days=getattr(settings, 'PREGENERATION_ACTIVE_DAYS', 7))
+    recently_assigned = UserTask.objects.filter(user_id=OuterRef('user_id'), assigned_at__gte=since)
+    return AddictionProfile.objects.filter(
+        Exists(recently_assigned) | Q(user__last_login__gte=since) | Q(updated_at__gte=since)
+    )
+
+
+def store_task_set(profile, for_date, count, tasks):
+    """
+    Save a generated set, replacing the user's previous set for the day
+
+    Sets with fewer than `count` tasks raise instead: they would be handed
+    out as complete sets.
+    """
+    if len(tasks) < count:
+        raise ValueError(f"Generated {len(tasks)} of {count} tasks")
+    task_set, _ = PregeneratedTaskSet.objects.update_or_create(
+        user_id=profile.user_id,
+        for_date=for_date,
+        count=count,
+        defaults={
+            'fingerprint': profile_fingerprint(profile, count),
+            'tasks': tasks,
+            'used_at': None,
+        }
+    )
+    return task_set
+
+
+def pregenerate_task_set(profile, for_date, count=None, service=None):
+    """
+    Generate and store the user's task set for a day, unless a matching unused one exists
+
+    Generation failures raise instead of storing the fallback tasks.
+
+    Returns:
+        True if a set was generated, False if the existing one was kept
+    """
+    count = count or getattr(settings, 'PREGENERATION_COUNT', 9)
+    exists = PregeneratedTaskSet.objects.filter(
+        user_id=profile.user_id,
+        for_date=for_date,
+        count=count,
+        fingerprint=profile_fingerprint(profile, count),
+        used_at__isnull=True
+    ).exists()
+    if exists:
+        return False
+
+    tasks = (service or TaskGenerationService()).generate_tasks(profile, count=count, fallback=False)
+    store_task_set(profile, for_date, count, tasks)
+    return True
+
+
+def regenerate_for_profile(profile):
+    """
+    Bring the user's pre-generated sets in line with their current profile
+
+    Today's set is always (re)generated; sets already made for later days
+    are regenerated too, since they were built from the old profile.
+    """
+    today = timezone.localdate()
+    dates = {today} | set(PregeneratedTaskSet.objects.filter(
+        user_id=profile.user_id, for_date__gt=today
+    ).values_list('for_date', flat=True))
+
+    service = TaskGenerationService()
+    for for_date in sorted(dates):
+        pregenerate_task_set(profile, for_date, service=service)
+
+
+def take_pregenerated_tasks(user, profile, count):
+    """
+    Claim the user's unused set for today, if it was generated for this profile and count
+
+    Returns:
+        The set's task dictionaries, or None when there is no usable set
+    """
+    task_set = PregeneratedTaskSet.objects.filter(
+        user=user,
+        for_date=timezone.localdate(),
+        count=count,
+        fingerprint=profile_fingerprint(profile, count),
+        used_at__isnull=True
+    ).only('id', 'tasks').first()
+    if task_set is None:
+        return None
+
+    # Only one of several concurrent requests gets to claim the set
+    claimed = PregeneratedTaskSet.objects.filter(id=task_set.id, used_at__isnull=True).update(used_at=timezone.now())
+    return task_set.tasks if claimed else None
+
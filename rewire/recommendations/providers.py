@@ -0,0 +1,272 @@
+# tasks/providers.py
+import json
+import math
+import threading
+import zlib
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .llm import get_llm_client
+
+# Default tasks, used as the fallback when generation fails and by TemplateTaskProvider
+FALLBACK_TASKS = [
+    {
+        "title": "Daily Reflection Journal",
+        "description": "Spend 5 minutes writing about your feelings and progress today.",
+        "difficulty": "EASY",
+        "marks": 5
+    },
+    {
+        "title": "Hydration Goal",
+        "description": "Drink 8 glasses of water throughout the day to maintain hydration.",
+        "difficulty": "EASY",
+        "marks": 5
+    },
+    {
+        "title": "Trigger Identification",
+        "description": "Make a list of 3 situations that triggered cravings in the past week.",
+        "difficulty": "EASY",
+        "marks": 5
+    },
+    {
+        "title": "30-Minute Exercise",
+        "description": "Complete 30 minutes of moderate exercise like walking, jogging, or cycling.",
+        "difficulty": "MEDIUM",
+        "marks": 10
+    },
+    {
+        "title": "Support Meeting",
+        "description": "Attend a support group meeting online or in person.",
+        "difficulty": "MEDIUM",
+        "marks": 10
+    },
+    {
+        "title": "Stress Management Practice",
+        "description": "Learn and practice a new stress management technique for 15 minutes.",
+        "difficulty": "MEDIUM",
+        "marks": 10
+    },
+    {
+        "title": "Difficult Conversation",
+        "description": "Have an honest conversation with someone impacted by your addiction.",
+        "difficulty": "HARD",
+        "marks": 15
+    },
+    {
+        "title": "Full Day Challenge",
+        "description": "Complete a full day without engaging in your addictive behavior, using all your coping strategies.",
+        "difficulty": "HARD",
+        "marks": 15
+    },
+    {
+        "title": "Temptation Navigation",
+        "description": "Deliberately expose yourself to a moderate trigger and practice your coping skills to overcome it.",
+        "difficulty": "HARD",
+        "marks": 15
+    }
+]
+
+
+def split_difficulty_counts(count):
+    """Number of EASY, MEDIUM and HARD tasks in a request of `count` tasks"""
+    easy_count = medium_count = hard_count = count // 3
+    # Adjust if count is not divisible by 3
+    if count % 3 == 1:
+        easy_count += 1
+    elif count % 3 == 2:
+        easy_count += 1
+        medium_count += 1
+    return {'EASY': easy_count, 'MEDIUM': medium_count, 'HARD': hard_count}
+
+
+def split_into_chunks(count, chunk_size):
+    """
+    Split a request of `count` tasks into chunks of at most `chunk_size` tasks
+
+    Chunks hold whole EASY/MEDIUM/HARD triples and are as even as possible;
+    the 1 or 2 leftover tasks go to the smallest chunk. Splitting each chunk
+    with split_difficulty_counts then adds up to the split of `count`.
+    """
+    triples, remainder = divmod(count, 3)
+    per_chunk = max(1, chunk_size // 3)
+    chunk_count = max(1, math.ceil((triples + (1 if remainder else 0)) / per_chunk))
+    base, extra = divmod(triples, chunk_count)
+    chunks = [3 * (base + (1 if i < extra else 0)) for i in range(chunk_count)]
+    chunks[-1] += remainder
+    return [chunk for chunk in chunks if chunk]
+
+
+def _chain_future(future, transform):
+    """A Future of transform(future's result) that cancels `future` when it is cancelled"""
+    chained = Future()
+
+    def copy_result(source):
+        if source.cancelled():
+            chained.cancel()
+        elif not chained.done():
+            try:
+                chained.set_result(transform(source.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+    def propagate_cancel(target):
+        if target.cancelled():
+            future.cancel()
+
+    chained.add_done_callback(propagate_cancel)
+    future.add_done_callback(copy_result)
+    return chained
+
+
+class BaseTaskProvider:
+    """Interface for the backends that generate recommended tasks"""
+
+    def __init__(self, model=None):
+        # Backends with several models take the one to use; others ignore it
+        self.model = model
+
+    def complete(self, profile, count, messages, batch=0):
+        """
+        Generate tasks for a profile
+
+        Args:
+            profile: The user's AddictionProfile (or an object with the same fields)
+            count: Number of tasks requested
+            messages: Chat messages built by TaskGenerationService
+            batch: Index of this chunk when a large request is split into several
+
+        Returns:
+            The completion text, expected to contain a JSON array of tasks
+        """
+        raise NotImplementedError
+
+    def stream(self, profile, count, messages, batch=0):
+        """Yield the completion text in pieces as it is generated"""
+        yield self.complete(profile, count, messages, batch=batch)
+
+    def submit(self, profile, count, messages, batch=0):
+        """
+        Start complete() without waiting for it
+
+        Returns a concurrent.futures.Future of the completion text. This
+        default runs complete() on its own thread, which cancelling the
+        future cannot interrupt; backends that can abort a request override it.
+        """
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.complete(profile, count, messages, batch=batch))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name='task-provider', daemon=True).start()
+        return future
+
+
+class OpenAITaskProvider(BaseTaskProvider):
+    """Chat completions through the pooled, retrying LLMClient (or any API-compatible server)"""
+
+    def __init__(self, model=None):
+        super().__init__(model or getattr(settings, 'TASK_GENERATION_MODEL', 'gpt-4'))
+        self.client = get_llm_client()
+
+    def _params(self, messages, count):
+        # Room for this chunk's tasks and the surrounding JSON, not a fixed worst case
+        max_tokens = min(
+            count * getattr(settings, 'TASK_GENERATION_TOKENS_PER_TASK', 150)
+            + getattr(settings, 'TASK_GENERATION_TOKENS_OVERHEAD', 200),
+            getattr(settings, 'TASK_GENERATION_MAX_TOKENS', 4000)
+        )
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": max_tokens,
+            "top_p": 1.0,
+        }
+
+    def complete(self, profile, count, messages, batch=0):
+        # The batch is described in the prompt
+        response = self.client.complete(**self._params(messages, count))
+        return response.choices[0].message.content
+
+    def stream(self, profile, count, messages, batch=0):
+        for chunk in self.client.stream(**self._params(messages, count)):
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                yield content
+
+    def submit(self, profile, count, messages, batch=0):
+        # Cancelling aborts the HTTP request on the client's event loop
+        return _chain_future(
+            self.client.submit(**self._params(messages, count)),
+            lambda response: response.choices[0].message.content
+        )
+
+
+class TemplateTaskProvider(BaseTaskProvider):
+    """
+    Local, deterministic generator built from FALLBACK_TASKS
+
+    Tasks are picked per difficulty in an order seeded by the profile and
+    personalized with its addiction type, triggers and goals, so the same
+    profile always gets the same set. Needs no network and no API key.
+    """
+
+    def __init__(self, chunk_size=40, model=None):
+        super().__init__(model)
+        self.chunk_size = chunk_size
+
+    def generate(self, profile, count, batch=0):
+        seed = batch + zlib.crc32(
+            f"{profile.addiction_type}|{profile.severity}|{profile.triggers}|{profile.recovery_goals}".encode('utf-8')
+        )
+        trigger = (profile.triggers or '').split(',')[0].strip() or 'your usual'
+        goal = (profile.recovery_goals or '').split(',')[0].strip() or 'your recovery goals'
+
+        tasks = []
+        for difficulty, needed in split_difficulty_counts(count).items():
+            pool = [task for task in FALLBACK_TASKS if task['difficulty'] == difficulty]
+            for i in range(needed):
+                template = pool[(seed + i) % len(pool)]
+                # Past the end of the pool, templates repeat as numbered rounds (and sets, for
+                # later batches) so titles stay unique
+                round_number = i // len(pool)
+                labels = ([f"Set {batch + 1}"] if batch else []) + ([f"Round {round_number + 1}"] if round_number else [])
+                title = f"{template['title']} ({', '.join(labels)})" if labels else template['title']
+                tasks.append({
+                    "title": title,
+                    "description": (
+                        f"{template['description']} Keep your {profile.addiction_type} recovery in mind, "
+                        f"especially around {trigger} triggers, and note how it moves you towards {goal}."
+                    ),
+                    "difficulty": difficulty,
+                    "marks": template['marks']
+                })
+        return tasks
+
+    def complete(self, profile, count, messages, batch=0):
+        return json.dumps(self.generate(profile, count, batch=batch))
+
+    def stream(self, profile, count, messages, batch=0):
+        # Pieces of a fixed size exercise the incremental parser like a real stream
+        content = self.complete(profile, count, messages, batch=batch)
+        for start in range(0, len(content), self.chunk_size):
+            yield content[start:start + self.chunk_size]
+
+
+_provider = None
+
+
+def get_task_provider():
+    """Return the provider configured by TASK_GENERATION_PROVIDER (a dotted path), creating it once"""
+    global _provider
+    if _provider is None:
+        path = getattr(settings, 'TASK_GENERATION_PROVIDER', 'recommendations.providers.OpenAITaskProvider')
+        _provider = import_string(path)()
+    return _provider
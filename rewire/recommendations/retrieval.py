@@ -0,0 +1,229 @@
+# tasks/retrieval.py
+import logging
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from .cache import _normalize_list, _normalize_text
+from .models import AddictionProfile, UserTask
+
+logger = logging.getLogger(__name__)
+
+
+def profile_features(profile):
+    """Field-prefixed word unigrams and bigrams of the profile fields that drive generation"""
+    features = [f"severity:{(profile.severity or '').upper()}"]
+    fields = [
+        ('type', [_normalize_text(profile.addiction_type)]),
+        ('trigger', _normalize_list(profile.triggers)),
+        ('goal', _normalize_list(profile.recovery_goals)),
+    ]
+    for prefix, items in fields:
+        for item in items:
+            words = item.split()
+            features.extend(f"{prefix}:{word}" for word in words)
+            features.extend(f"{prefix}:{first} {second}" for first, second in zip(words, words[1:]))
+    return features
+
+
+def task_data(task):
+    """The generated-task dictionary for a catalog Task"""
+    return {
+        "title": task.title,
+        "description": task.description,
+        "difficulty": task.difficulty,
+        "marks": task.marks,
+    }
+
+
+class TaskRetrievalIndex:
+    """
+    In-process index of highly rated tasks, searchable by profile similarity
+
+    Every user with tasks rated at least TASK_REUSE_MIN_RATING is one row:
+    a hashed n-gram term-frequency vector of their profile, and those
+    tasks. Queries weight rows by TF-IDF and take the cosine top-k most
+    similar profiles; their tasks are scored by similarity times rating.
+
+    The index is loaded from the database on first use and kept current by
+    record_rating() and update_profile(). Ratings given in other processes
+    are picked up by a full rebuild every TASK_RETRIEVAL_REBUILD_INTERVAL
+    seconds.
+    """
+
+    def __init__(self, dimensions=None, min_rating=None, rebuild_interval=None):
+        self.dimensions = dimensions or getattr(settings, 'TASK_RETRIEVAL_DIMENSIONS', 1024)
+        self.min_rating = min_rating or getattr(settings, 'TASK_REUSE_MIN_RATING', 4)
+        self.rebuild_interval = rebuild_interval or getattr(settings, 'TASK_RETRIEVAL_REBUILD_INTERVAL', 3600)
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._reset()
+
+    def _reset(self):
+        self._tf = np.zeros((0, self.dimensions), dtype=np.float32)
+        self._df = np.zeros(self.dimensions, dtype=np.float32)
+        self._rows = {}
+        self._row_users = []
+        self._row_tasks = []
+        self._matrix = None
+
+    def _vector(self, profile):
+        tf = np.zeros(self.dimensions, dtype=np.float32)
+        buckets = [zlib.crc32(feature.encode('utf-8')) % self.dimensions for feature in profile_features(profile)]
+        np.add.at(tf, buckets, 1.0)
+        return tf
+
+    def _idf(self):
+        return np.log((len(self._row_users) + 1) / (self._df + 1)) + 1
+
+    def _set_profile(self, row, profile):
+        """Replace the row's profile vector, keeping document frequencies in step"""
+        old = self._tf[row]
+        new = self._vector(profile)
+        self._df += (new > 0).astype(np.float32) - (old > 0).astype(np.float32)
+        self._tf[row] = new
+        self._matrix = None
+
+    def _add_row(self, user_id, profile):
+        row = len(self._row_users)
+        if row == len(self._tf):
+            # Grow by doubling so appends stay amortized O(1)
+            grown = np.zeros((max(16, 2 * row), self.dimensions), dtype=np.float32)
+            grown[:row] = self._tf
+            self._tf = grown
+        self._rows[user_id] = row
+        self._row_users.append(user_id)
+        self._row_tasks.append({})
+        self._set_profile(row, profile)
+        return row
+
+    def build(self):
+        """Load every highly rated task and the profile of the user who rated it"""
+        rated = (
+            UserTask.objects
+            .filter(user_rating__gte=self.min_rating, user__addiction_profile__isnull=False)
+            .select_related('task')
+            .only('user_id', 'user_rating', 'task__id', 'task__title', 'task__description',
+                  'task__difficulty', 'task__marks')
+        )
+        tasks_by_user = {}
+        for user_task in rated.iterator(chunk_size=2000):
+            tasks_by_user.setdefault(user_task.user_id, {})[user_task.task.id] = (
+                task_data(user_task.task), user_task.user_rating
+            )
+        profiles = AddictionProfile.objects.filter(user_id__in=list(tasks_by_user))
+
+        with self._lock:
+            self._reset()
+            for profile in profiles.iterator(chunk_size=2000):
+                row = self._add_row(profile.user_id, profile)
+                self._row_tasks[row] = tasks_by_user[profile.user_id]
+            self._built_at = time.monotonic()
+        logger.info(f"Task retrieval index built with {len(self._row_users)} profiles")
+
+    def _is_fresh(self):
+        return self._built_at is not None and time.monotonic() - self._built_at <= self.rebuild_interval
+
+    def _ensure_built(self):
+        if self._is_fresh():
+            return
+        with self._build_lock:
+            # Another thread may have rebuilt it while this one waited
+            if not self._is_fresh():
+                self.build()
+
+    def record_rating(self, user_task):
+        """Add, update or drop a task after its rating changed"""
+        if self._built_at is None:
+            # Not built yet; the first query loads it from the database
+            return
+        highly_rated = user_task.user_rating is not None and user_task.user_rating >= self.min_rating
+
+        profile = None
+        if highly_rated and user_task.user_id not in self._rows:
+            profile = AddictionProfile.objects.filter(user_id=user_task.user_id).first()
+            if profile is None:
+                return
+
+        with self._lock:
+            row = self._rows.get(user_task.user_id)
+            if highly_rated:
+                if row is None:
+                    row = self._add_row(user_task.user_id, profile)
+                self._row_tasks[row][user_task.task_id] = (task_data(user_task.task), user_task.user_rating)
+            elif row is not None:
+                self._row_tasks[row].pop(user_task.task_id, None)
+
+    def update_profile(self, profile):
+        """Re-vectorize a user's row after their profile changed"""
+        with self._lock:
+            row = self._rows.get(profile.user_id)
+            if row is not None:
+                self._set_profile(row, profile)
+
+    def _normalized_matrix(self):
+        # TF-IDF rows scaled to unit length; recomputed only after the index changed
+        if self._matrix is None:
+            weighted = self._tf[:len(self._row_users)] * self._idf()
+            norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+            self._matrix = weighted / np.maximum(norms, 1e-9)
+        return self._matrix
+
+    def similar_tasks(self, profile, neighbors=None, min_similarity=None, exclude_user_id=None):
+        """
+        Highly rated tasks of the profiles most similar to `profile`
+
+        Returns:
+            List of (task_id, task dictionary, score) sorted by descending score
+        """
+        neighbors = neighbors or getattr(settings, 'TASK_REUSE_NEIGHBORS', 20)
+        if min_similarity is None:
+            min_similarity = getattr(settings, 'TASK_REUSE_MIN_SIMILARITY', 0.3)
+
+        self._ensure_built()
+        with self._lock:
+            if not self._row_users:
+                return []
+            matrix = self._normalized_matrix()
+            query = self._vector(profile) * self._idf()
+            query /= max(float(np.linalg.norm(query)), 1e-9)
+            similarities = matrix @ query
+
+            own_row = self._rows.get(exclude_user_id)
+            if own_row is not None:
+                similarities[own_row] = -1.0
+
+            k = min(neighbors, len(similarities))
+            top_rows = np.argpartition(-similarities, k - 1)[:k]
+
+            scores = {}
+            for row in top_rows:
+                similarity = float(similarities[row])
+                if similarity < min_similarity:
+                    continue
+                for task_id, (task, rating) in self._row_tasks[row].items():
+                    _, score = scores.get(task_id, (task, 0.0))
+                    scores[task_id] = (task, score + similarity * rating / 5)
+
+        return sorted(
+            ((task_id, dict(task), score) for task_id, (task, score) in scores.items()),
+            key=lambda item: item[2],
+            reverse=True
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_task_index():
+    """The process-wide TaskRetrievalIndex, created on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = TaskRetrievalIndex()
+        return _index
@@ -1,6 +1,6 @@
 # tasks/serializers.py
 from rest_framework import serializers
-from .models import AddictionProfile, Task, UserTask
+from .models import AddictionProfile, Task, UserTask, TaskGenerationJob
 
 class AddictionProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,18 +15,46 @@ class AddictionProfileSerializer(serializers.ModelSerializer):
         )
         return profile
 
-class TaskSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Lets callers restrict a serializer to a subset of its fields via fields=[...]"""
+    
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class TaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Task
         fields = ['id', 'title', 'description', 'difficulty', 'marks']
 
-class UserTaskSerializer(serializers.ModelSerializer):
+class UserTaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     task = TaskSerializer(read_only=True)
     
     class Meta:
         model = UserTask
         fields = ['id', 'task', 'assigned_at', 'completed', 'completed_at', 
                  'user_rating', 'user_feedback', 'marks_earned']
+        
+    def __init__(self, *args, **kwargs):
+        # Dotted names (e.g. "task.title") select fields of the nested task, unless the
+        # whole task was asked for too
+        fields = kwargs.pop('fields', None)
+        task_fields = None
+        if fields is not None and 'task' not in fields:
+            task_fields = [name.split('.', 1)[1] for name in fields if name.startswith('task.')]
+        if fields is not None:
+            fields = {name.split('.', 1)[0] for name in fields}
+        super().__init__(*args, fields=fields, **kwargs)
+        if task_fields and 'task' in self.fields:
+            self.fields['task'] = TaskSerializer(read_only=True, fields=task_fields)
+
+class TaskGenerationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TaskGenerationJob
+        fields = ['id', 'status', 'count', 'result', 'error', 'created_at', 'started_at', 'finished_at']
 
 class TaskRatingSerializer(serializers.Serializer):
     rating = serializers.IntegerField(min_value=1, max_value=5)
@@ -1,74 +1,570 @@
 # tasks/services.py
-import os
 import json
 import logging
-import openai
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from django.conf import settings
-from .models import Task
+from django.db import transaction
+from .cache import TaskSetCache
+from .events import publish_stats_delta
+from .llm import CircuitOpenError
+from .models import Task, UserTask, UserStats, UserTaskChange
+from .model_router import get_task_router
+from .near_duplicates import find_near_duplicates, signature_cache, task_signatures
+from .providers import FALLBACK_TASKS, split_difficulty_counts, split_into_chunks
+from .retrieval import get_task_index
+from .sync import record_task_changes
 
 logger = logging.getLogger(__name__)
 
+# Default of generate_tasks' history argument: load it from the database
+LOAD_HISTORY = object()
+
+def build_catalog_task(task_data):
+    """Build an unsaved Task (with its content hash) from a generated task dictionary"""
+    title = Task.normalize_text(task_data['title'])
+    description = task_data['description'].strip()
+    difficulty = task_data['difficulty']
+
+    return Task(
+        title=title,
+        description=description,
+        difficulty=difficulty,
+        marks=task_data['marks'],
+        content_hash=Task.compute_content_hash(title, description, difficulty)
+    )
+
+def assign_tasks_to_user(user, task_data_list):
+    """
+    Assign generated tasks to the user, reusing shared catalog tasks
+
+    Everything runs in one transaction with a constant number of queries,
+    whatever the batch size: look up existing tasks by content hash,
+    bulk insert the missing ones, bulk insert the assignments, then bump
+    the user's UserStats counters and log the inserts for delta-sync.
+
+    Args:
+        user: The User the tasks are assigned to
+        task_data_list: List of task dictionaries as returned by TaskGenerationService
+
+    Returns:
+        List of created UserTask instances, with their tasks attached.
+        Tasks the user already has are skipped.
+    """
+    # Normalize the batch, dropping duplicates within it
+    tasks_by_hash = {}
+    for task_data in task_data_list:
+        task = build_catalog_task(task_data)
+        tasks_by_hash.setdefault(task.content_hash, task)
+
+    if not tasks_by_hash:
+        return []
+
+    with transaction.atomic():
+        # Reuse catalog tasks that already exist
+        catalog = {task.content_hash: task for task in Task.objects.filter(content_hash__in=tasks_by_hash)}
+
+        missing = [task for content_hash, task in tasks_by_hash.items() if content_hash not in catalog]
+        if missing:
+            # Concurrent requests may insert the same content; re-read to pick up their ids
+            Task.objects.bulk_create(missing, ignore_conflicts=True)
+            catalog.update({
+                task.content_hash: task
+                for task in Task.objects.filter(content_hash__in=[task.content_hash for task in missing])
+            })
+
+        # Skip tasks already assigned to the user
+        already_assigned = set(UserTask.objects.filter(
+            user=user,
+            task_id__in=[task.id for task in catalog.values()]
+        ).values_list('task_id', flat=True))
+
+        user_tasks = [
+            UserTask(user=user, task=catalog[content_hash])
+            for content_hash in tasks_by_hash
+            if catalog[content_hash].id not in already_assigned
+        ]
+        UserTask.objects.bulk_create(user_tasks)
+
+        if user_tasks:
+            UserStats.increment(user, total_tasks=len(user_tasks))
+            publish_stats_delta(user.id, total_tasks=len(user_tasks))
+            version = record_task_changes(user, UserTaskChange.OP_INSERT, user_tasks)
+            # Keep the user's cached near-duplicate signatures current without reloading them
+            transaction.on_commit(lambda: signature_cache.record_inserts(
+                user.id, version - len(user_tasks), version, [user_task.task for user_task in user_tasks]
+            ))
+
+    return user_tasks
+
+_chunk_executor = None
+_chunk_executor_lock = threading.Lock()
+
+def get_chunk_executor():
+    """
+    Thread pool the chunks of large generation requests run on
+
+    Shared by the whole process, so TASK_GENERATION_CONCURRENCY caps the
+    number of chunk completions in flight across all requests.
+    """
+    global _chunk_executor
+    with _chunk_executor_lock:
+        if _chunk_executor is None:
+            _chunk_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TASK_GENERATION_CONCURRENCY', 4),
+                thread_name_prefix='task-generation'
+            )
+        return _chunk_executor
+
+def task_title_key(task):
+    """Key two generated tasks are considered duplicates on"""
+    return Task.normalize_text(task['title']).lower()
+
+class IncrementalTaskParser:
+    """
+    Incremental parser for a streamed JSON array of task objects
+    
+    Text is fed in arbitrary chunks; every top-level object inside the first
+    JSON array is returned as soon as its closing brace arrives. Anything
+    before the array (e.g. a preamble from the model) is ignored.
+    """
+    
+    def __init__(self):
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.buffer = []
+    
+    def feed(self, text):
+        """Consume a chunk of text and return the list of objects completed by it"""
+        completed = []
+        for char in text:
+            if self.done:
+                break
+            
+            if not self.in_array:
+                if char == '[':
+                    self.in_array = True
+                continue
+            
+            if self.depth == 0:
+                # Between objects: only an opening brace or the closing bracket matter
+                if char == '{':
+                    self.depth = 1
+                    self.buffer = [char]
+                elif char == ']':
+                    self.done = True
+                continue
+            
+            self.buffer.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        completed.append(json.loads(''.join(self.buffer)))
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Skipping malformed task in stream: {str(e)}")
+                    self.buffer = []
+        
+        return completed
+
 class TaskGenerationService:
     def __init__(self):
-        # Get API key from environment variables
-        self.api_key = os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
+        # Routes to the backends configured by TASK_GENERATION_ROUTES (or TASK_GENERATION_PROVIDER),
+        # shared by the process
+        try:
+            self.router = get_task_router()
+        except ValueError:
             logger.error("OpenAI API key is not set in environment variables")
-            raise ValueError("OpenAI API key is missing")
+            raise
         
-        openai.api_key = self.api_key
+        self.cache = TaskSetCache()
+        self.max_count = getattr(settings, 'TASK_GENERATION_MAX_COUNT', 30)
+        self.chunk_size = getattr(settings, 'TASK_GENERATION_CHUNK_SIZE', 9)
     
-    def generate_tasks(self, addiction_profile, count=9):
+    def generate_tasks(self, addiction_profile, count=9, fallback=True, reuse=True, history=LOAD_HISTORY):
         """
         Generate tasks based on addiction profile
         Returns tasks of varying difficulty (easy, medium, hard)
         
+        Up to TASK_REUSE_MAX_SHARE of the slots are filled with tasks that
+        users with similar profiles rated highly, without calling the LLM.
+        Requests larger than TASK_GENERATION_CHUNK_SIZE are split into
+        difficulty-balanced chunks generated concurrently, so no single
+        completion gets long enough to be truncated. Tasks that near-duplicate
+        the user's recent tasks are regenerated.
+        
         Args:
             addiction_profile: The user's AddictionProfile instance
-            count: Total number of tasks to generate (default=9, 3 of each difficulty)
+            count: Total number of tasks to generate (default=9, 3 of each difficulty),
+                capped at TASK_GENERATION_MAX_COUNT
+            fallback: Return the default tasks if generation fails, instead of raising
+            reuse: Fill slots with highly rated tasks of similar profiles (needs the database)
+            history: The user's recent tasks from recent_task_history() (None skips the
+                near-duplicate check); loaded here, from the database, by default
             
         Returns:
             List of dictionaries representing tasks
         """
+        count = min(count, self.max_count)
+        
+        if history is LOAD_HISTORY:
+            history = self.recent_task_history(addiction_profile)
+        reused_tasks = self.reuse_rated_tasks(addiction_profile, count) if reuse else []
+        if len(reused_tasks) < count:
+            reused_tasks += self._generate_tasks(addiction_profile, count - len(reused_tasks), fallback, history)
+        return self._replace_near_duplicates(addiction_profile, reused_tasks, history)
+    
+    def _generate_tasks(self, addiction_profile, count, fallback, history=None):
+        # Profiles with the same fingerprint reuse a previously generated set, unless this user
+        # already has some of it: assignment would skip those tasks and come up short
+        cached_tasks = self.cache.get(addiction_profile, count)
+        if cached_tasks is not None and not self._includes_recent_tasks(cached_tasks, history):
+            return cached_tasks
+        
         try:
-            # Calculate number of tasks per difficulty level
-            easy_count = medium_count = hard_count = count // 3
-            # Adjust if count is not divisible by 3
-            if count % 3 == 1:
-                easy_count += 1
-            elif count % 3 == 2:
-                easy_count += 1
-                medium_count += 1
-                
-            # Construct prompt for OpenAI
-            prompt = self._construct_prompt(
-                addiction_profile, 
-                easy_count=easy_count,
-                medium_count=medium_count,
-                hard_count=hard_count
-            )
-            
-            # Call OpenAI API
-            response = openai.ChatCompletion.create(
-                model="gpt-4",  # You can adjust the model as needed
-                messages=[
-                    {"role": "system", "content": "You are a recovery coach specializing in addiction treatment. You create personalized tasks to help individuals overcome addiction, with careful attention to their specific triggers, goals, and severity level."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000,
-                top_p=1.0,
-            )
+            # Call the routed provider, hedged if slow (for OpenAI: with a deadline, retries and the circuit breaker)
+            chunks = split_into_chunks(count, self.chunk_size)
+            if len(chunks) == 1:
+                tasks = self._generate_chunk(addiction_profile, count)
+            else:
+                tasks = self._generate_chunks(addiction_profile, count, chunks)
+            # Only complete sets are cached; short ones are topped up with default tasks
+            if len(tasks) == count:
+                self.cache.set(addiction_profile, count, tasks)
+            elif fallback:
+                tasks += self._fallback_top_up(tasks, count)
+            return tasks
             
-            # Process the response
-            return self._process_response(response)
+        except CircuitOpenError:
+            # The provider is unhealthy; don't wait on it
+            if not fallback:
+                raise
+            return self._generate_fallback_tasks(count)
             
         except Exception as e:
             logger.error(f"Error generating tasks: {str(e)}")
+            if not fallback:
+                raise
             # Return some default tasks in case of error
             return self._generate_fallback_tasks(count)
     
-    def _construct_prompt(self, profile, easy_count=3, medium_count=3, hard_count=3):
+    def reuse_rated_tasks(self, profile, count):
+        """
+        Highly rated tasks of similar profiles for up to TASK_REUSE_MAX_SHARE of the slots
+        
+        Only whole EASY/MEDIUM/HARD triples are reused, so the rest of the
+        request keeps the usual difficulty split. Tasks the user already has
+        are skipped.
+        """
+        per_difficulty = int(count * getattr(settings, 'TASK_REUSE_MAX_SHARE', 0.5)) // 3
+        user_id = getattr(profile, 'user_id', None)
+        if not per_difficulty or user_id is None:
+            return []
+        
+        try:
+            candidates = get_task_index().similar_tasks(profile, exclude_user_id=user_id)
+            if not candidates:
+                return []
+            already_assigned = set(UserTask.objects.filter(
+                user_id=user_id,
+                task_id__in=[task_id for task_id, _, _ in candidates]
+            ).values_list('task_id', flat=True))
+        except Exception as e:
+            logger.error(f"Error looking up rated tasks to reuse: {str(e)}")
+            return []
+        
+        by_difficulty = {'EASY': [], 'MEDIUM': [], 'HARD': []}
+        for task_id, task, _ in candidates:
+            picked = by_difficulty.get(task['difficulty'])
+            if picked is not None and task_id not in already_assigned and len(picked) < per_difficulty:
+                picked.append(task)
+        
+        triples = min(len(picked) for picked in by_difficulty.values())
+        return [task for picked in by_difficulty.values() for task in picked[:triples]]
+    
+    def recent_task_history(self, profile):
+        """Signatures and titles of the user's recent tasks, or None when there is no user or they can't be loaded"""
+        user_id = getattr(profile, 'user_id', None)
+        if user_id is None:
+            return None
+        try:
+            return signature_cache.history(user_id)
+        except Exception as e:
+            logger.error(f"Error loading recent tasks for the near-duplicate check: {str(e)}")
+            return None
+    
+    def _includes_recent_tasks(self, tasks, history):
+        """Whether any of the tasks has the title of one of the user's recent tasks"""
+        if history is None:
+            return False
+        recent_titles = {title.lower() for title in history[1]}
+        return any(task_title_key(task) in recent_titles for task in tasks)
+    
+    def _replace_near_duplicates(self, profile, tasks, history):
+        """
+        Replace tasks that near-duplicate the user's recent tasks or an earlier task of the set
+        
+        Only the duplicate slots are regenerated, TASK_GENERATION_CHUNK_SIZE
+        per completion; a slot keeps its original task if no replacement of
+        its difficulty passes the check.
+        """
+        if history is None or not tasks:
+            return tasks
+        history_signatures, history_titles = history
+        
+        signatures = task_signatures(tasks)
+        duplicate = find_near_duplicates(history_signatures, signatures)
+        if not duplicate.any():
+            return tasks
+        
+        kept_titles = [task['title'] for task, is_duplicate in zip(tasks, duplicate) if not is_duplicate]
+        replacements = iter(self._regenerate_slots(
+            profile,
+            [task for task, is_duplicate in zip(tasks, duplicate) if is_duplicate],
+            np.concatenate([history_signatures, signatures[~duplicate]]),
+            history_titles + kept_titles
+        ))
+        return [next(replacements) if is_duplicate else task for task, is_duplicate in zip(tasks, duplicate)]
+    
+    def _regenerate_slots(self, profile, slots, signatures, titles):
+        """
+        New tasks for the `slots`, each of the same difficulty and no near-duplicate of `signatures`
+        
+        Slots are regenerated a chunk at a time; later chunks also avoid the
+        replacements found so far.
+        
+        Returns:
+            One task per slot: its replacement, or the slot's own task if there is none
+        """
+        replacements = []
+        for start in range(0, len(slots), self.chunk_size):
+            chunk = slots[start:start + self.chunk_size]
+            chunk_replacements = self._regenerate_chunk(profile, chunk, signatures, titles)
+            found = [task for task, slot in zip(chunk_replacements, chunk) if task is not slot]
+            if found:
+                signatures = np.concatenate([signatures, task_signatures(found)])
+                titles = titles + [task['title'] for task in found]
+            replacements += chunk_replacements
+        return replacements
+    
+    def _regenerate_chunk(self, profile, slots, signatures, titles):
+        """Replacements for at most one chunk of slots, from one completion"""
+        try:
+            candidates = self._generate_chunk(
+                profile, len(slots), batch=1, batches=2, avoid_titles=titles,
+                counts=Counter(task['difficulty'] for task in slots)
+            )
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                logger.error(f"Error regenerating near-duplicate tasks: {str(e)}")
+            return slots
+        
+        by_difficulty = {}
+        duplicate = find_near_duplicates(signatures, task_signatures(candidates))
+        for task, is_duplicate in zip(candidates, duplicate):
+            if not is_duplicate:
+                by_difficulty.setdefault(task['difficulty'], []).append(task)
+        
+        replacements = []
+        for task in slots:
+            same_difficulty = by_difficulty.get(task['difficulty'])
+            replacements.append(same_difficulty.pop(0) if same_difficulty else task)
+        return replacements
+    
+    def _generate_chunk(self, profile, count, batch=0, batches=1, avoid_titles=(), counts=None):
+        """Generate one chunk of tasks, raising if the provider fails or its answer can't be parsed"""
+        messages = self._build_messages(
+            profile, count, batch=batch, batches=batches, avoid_titles=avoid_titles, counts=counts
+        )
+        content = self.router.complete(profile, count, messages, batch=batch)
+        return self._process_response(content)[:count]
+    
+    def _generate_chunks(self, profile, count, chunks):
+        """
+        Generate the chunks concurrently and merge them, dropping duplicate titles
+        
+        Failed chunks are skipped. Tasks lost to failures or duplicates are
+        topped up with one more chunk that is told which titles to avoid.
+        """
+        executor = get_chunk_executor()
+        futures = [
+            executor.submit(self._generate_chunk, profile, chunk, batch, len(chunks))
+            for batch, chunk in enumerate(chunks)
+        ]
+        
+        tasks = []
+        seen = set()
+        errors = []
+        for future in futures:
+            try:
+                chunk_tasks = future.result()
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError):
+                    logger.error(f"Error generating task chunk: {str(e)}")
+                errors.append(e)
+                continue
+            tasks.extend(self._drop_duplicates(chunk_tasks, seen))
+        
+        if not tasks and errors:
+            raise errors[0]
+        
+        shortfall = min(count - len(tasks), self.chunk_size)
+        if shortfall > 0:
+            try:
+                extra_tasks = self._generate_chunk(
+                    profile, shortfall, batch=len(chunks), batches=len(chunks) + 1,
+                    avoid_titles=[task['title'] for task in tasks]
+                )
+                tasks.extend(self._drop_duplicates(extra_tasks, seen))
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError):
+                    logger.error(f"Error topping up generated tasks: {str(e)}")
+        
+        return tasks
+    
+    def _drop_duplicates(self, tasks, seen):
+        """Tasks whose titles are not in `seen`, adding theirs to it"""
+        unique = []
+        for task in tasks:
+            key = task_title_key(task)
+            if key not in seen:
+                seen.add(key)
+                unique.append(task)
+        return unique
+    
+    def stream_tasks(self, addiction_profile, count=9):
+        """
+        Generate tasks based on addiction profile, yielding each task as soon as it is complete
+        
+        The completion is streamed and fed through an IncrementalTaskParser, so
+        the first task is available long before the whole batch is generated.
+        If the stream fails part-way, the remaining slots are filled with
+        fallback tasks.
+        
+        Large requests are streamed chunk by chunk, dropping tasks whose
+        titles were already emitted. Tasks that near-duplicate the user's
+        recent tasks (or ones already emitted) are held back and their
+        replacements yielded at the end.
+        
+        Args:
+            addiction_profile: The user's AddictionProfile instance
+            count: Total number of tasks to generate (default=9, 3 of each difficulty),
+                capped at TASK_GENERATION_MAX_COUNT
+            
+        Yields:
+            Validated task dictionaries
+        """
+        history = self.recent_task_history(addiction_profile)
+        if history is None:
+            yield from self._stream_tasks(addiction_profile, count, history)
+            return
+        signatures, titles = history
+        
+        held = []
+        for task in self._stream_tasks(addiction_profile, count, history):
+            signature = task_signatures([task])
+            if find_near_duplicates(signatures, signature)[0]:
+                held.append(task)
+                continue
+            signatures = np.concatenate([signatures, signature])
+            titles = titles + [task['title']]
+            yield task
+        
+        if held:
+            yield from self._regenerate_slots(addiction_profile, held, signatures, titles)
+    
+    def _stream_tasks(self, addiction_profile, count, history):
+        count = min(count, self.max_count)
+        
+        # Reused highly rated tasks are ready immediately
+        reused_tasks = self.reuse_rated_tasks(addiction_profile, count)
+        yield from reused_tasks
+        count -= len(reused_tasks)
+        if not count:
+            return
+        
+        cached_tasks = self.cache.get(addiction_profile, count)
+        if cached_tasks is not None and not self._includes_recent_tasks(cached_tasks, history):
+            yield from cached_tasks
+            return
+        
+        tasks = []
+        seen = set()
+        try:
+            chunks = split_into_chunks(count, self.chunk_size)
+            for batch, chunk in enumerate(chunks):
+                messages = self._build_messages(addiction_profile, chunk, batch=batch, batches=len(chunks))
+                
+                parser = IncrementalTaskParser()
+                emitted = 0
+                for content in self.router.stream(addiction_profile, chunk, messages, batch=batch):
+                    for task_data in parser.feed(content):
+                        task = self._validate_task(task_data)
+                        if task is not None and emitted < chunk and self._drop_duplicates([task], seen):
+                            emitted += 1
+                            tasks.append(task)
+                            yield task
+            
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                logger.error(f"Error streaming tasks: {str(e)}")
+        
+        if len(tasks) == count:
+            self.cache.set(addiction_profile, count, tasks)
+            return
+        
+        # The stream failed, was cut off or had nothing parseable: fill the remaining slots with
+        # default tasks not already emitted, and don't cache the short set
+        if tasks:
+            logger.error(f"Task stream ended after {len(tasks)} of {count} tasks")
+        yield from self._fallback_top_up(tasks, count)
+    
+    def _build_messages(self, profile, count, batch=0, batches=1, avoid_titles=(), counts=None):
+        """Build the chat messages for a request (or one chunk of a request) of `count` tasks"""
+        # Calculate number of tasks per difficulty level, unless the caller needs a specific mix
+        counts = counts or split_difficulty_counts(count)
+        
+        # Chunks are generated independently; steer them apart so fewer duplicates get dropped
+        batch_note = ""
+        if batches > 1:
+            batch_note = (
+                f"This is batch {batch + 1} of {batches} generated separately for the same person. "
+                f"Give this batch its own angle so its tasks differ from the other batches."
+            )
+        if avoid_titles:
+            batch_note += f" Do not reuse any of these task titles: {', '.join(avoid_titles)}."
+            
+        # Construct prompt for OpenAI
+        prompt = self._construct_prompt(
+            profile, 
+            easy_count=counts['EASY'],
+            medium_count=counts['MEDIUM'],
+            hard_count=counts['HARD'],
+            batch_note=batch_note.strip()
+        )
+        
+        return [
+            {"role": "system", "content": "You are a recovery coach specializing in addiction treatment. You create personalized tasks to help individuals overcome addiction, with careful attention to their specific triggers, goals, and severity level."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _construct_prompt(self, profile, easy_count=3, medium_count=3, hard_count=3, batch_note=""):
         """Constructs a detailed prompt for the OpenAI API based on the user's profile"""
         
         return f"""
@@ -84,6 +580,7 @@ class TaskGenerationService:
         - {easy_count} EASY tasks (worth 5 marks each)
         - {medium_count} MEDIUM tasks (worth 10 marks each)
         - {hard_count} HARD tasks (worth 15 marks each)
+        {batch_note}
         
         TASK REQUIREMENTS:
         1. Be specific and actionable
@@ -101,22 +598,21 @@ class TaskGenerationService:
         
         Example format (this is just an example, generate relevant tasks based on the profile):
         [
-            {
+            {{
                 "title": "Morning Meditation",
                 "description": "Complete a 5-minute guided meditation focusing on cravings.",
                 "difficulty": "EASY",
                 "marks": 5
-            }
+            }}
         ]
         
         YOUR RESPONSE MUST BE VALID JSON THAT CAN BE PARSED.
         """
     
-    def _process_response(self, response):
-        """Process and validate the OpenAI API response"""
+    def _process_response(self, content):
+        """Process and validate the completion text returned by the provider"""
         try:
-            # Extract content from response
-            content = response.choices[0].message.content.strip()
+            content = content.strip()
             
             # Find JSON array in the response
             start_idx = content.find('[')
@@ -131,89 +627,50 @@ class TaskGenerationService:
             # Validate each task
             validated_tasks = []
             for task in tasks:
-                # Ensure required fields are present
-                if all(key in task for key in ['title', 'description', 'difficulty', 'marks']):
-                    # Normalize difficulty to uppercase
-                    task['difficulty'] = task['difficulty'].upper()
-                    
-                    # Validate difficulty and marks
-                    if task['difficulty'] not in ['EASY', 'MEDIUM', 'HARD']:
-                        task['difficulty'] = 'MEDIUM'
-                    
-                    # Ensure marks match difficulty
-                    if task['difficulty'] == 'EASY':
-                        task['marks'] = 5
-                    elif task['difficulty'] == 'MEDIUM':
-                        task['marks'] = 10
-                    elif task['difficulty'] == 'HARD':
-                        task['marks'] = 15
-                    
+                task = self._validate_task(task)
+                if task is not None:
                     validated_tasks.append(task)
             
             return validated_tasks
             
         except Exception as e:
-            logger.error(f"Error processing OpenAI response: {str(e)}")
+            logger.error(f"Error processing task generation response: {str(e)}")
             raise
     
+    def _validate_task(self, task):
+        """Validate a single generated task, returning it normalized or None if unusable"""
+        # Ensure required fields are present
+        if not isinstance(task, dict) or not all(key in task for key in ['title', 'description', 'difficulty', 'marks']):
+            return None
+        
+        # Title and description are stored as text, so e.g. null or a number is unusable
+        if not all(isinstance(task[key], str) and task[key].strip() for key in ['title', 'description']):
+            return None
+        
+        # Normalize difficulty to uppercase
+        task['difficulty'] = str(task['difficulty']).upper()
+        
+        # Validate difficulty and marks
+        if task['difficulty'] not in ['EASY', 'MEDIUM', 'HARD']:
+            task['difficulty'] = 'MEDIUM'
+        
+        # Ensure marks match difficulty, whatever the model answered
+        if task['difficulty'] == 'EASY':
+            task['marks'] = 5
+        elif task['difficulty'] == 'MEDIUM':
+            task['marks'] = 10
+        elif task['difficulty'] == 'HARD':
+            task['marks'] = 15
+        
+        return task
+    
+    def _fallback_top_up(self, tasks, count):
+        """Default tasks, not already among `tasks`, for the slots it leaves empty"""
+        titles = {task['title'] for task in tasks}
+        remaining = [task for task in self._generate_fallback_tasks(count) if task['title'] not in titles]
+        return remaining[:max(count - len(tasks), 0)]
+    
     def _generate_fallback_tasks(self, count):
         """Generate fallback tasks in case of API failure"""
-        fallback_tasks = [
-            {
-                "title": "Daily Reflection Journal",
-                "description": "Spend 5 minutes writing about your feelings and progress today.",
-                "difficulty": "EASY",
-                "marks": 5
-            },
-            {
-                "title": "Hydration Goal",
-                "description": "Drink 8 glasses of water throughout the day to maintain hydration.",
-                "difficulty": "EASY",
-                "marks": 5
-            },
-            {
-                "title": "Trigger Identification",
-                "description": "Make a list of 3 situations that triggered cravings in the past week.",
-                "difficulty": "EASY",
-                "marks": 5
-            },
-            {
-                "title": "30-Minute Exercise",
-                "description": "Complete 30 minutes of moderate exercise like walking, jogging, or cycling.",
-                "difficulty": "MEDIUM",
-                "marks": 10
-            },
-            {
-                "title": "Support Meeting",
-                "description": "Attend a support group meeting online or in person.",
-                "difficulty": "MEDIUM",
-                "marks": 10
-            },
-            {
-                "title": "Stress Management Practice",
-                "description": "Learn and practice a new stress management technique for 15 minutes.",
-                "difficulty": "MEDIUM",
-                "marks": 10
-            },
-            {
-                "title": "Difficult Conversation",
-                "description": "Have an honest conversation with someone impacted by your addiction.",
-                "difficulty": "HARD",
-                "marks": 15
-            },
-            {
-                "title": "Full Day Challenge",
-                "description": "Complete a full day without engaging in your addictive behavior, using all your coping strategies.",
-                "difficulty": "HARD",
-                "marks": 15
-            },
-            {
-                "title": "Temptation Navigation",
-                "description": "Deliberately expose yourself to a moderate trigger and practice your coping skills to overcome it.",
-                "difficulty": "HARD",
-                "marks": 15
-            }
-        ]
-        
         # Return the requested number of tasks
-        return fallback_tasks[:count]
\ No newline at end of file
+        return [dict(task) for task in FALLBACK_TASKS[:count]]
@@ -0,0 +1,50 @@
+# tasks/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from .cache import profile_fingerprint
+from .models import AddictionProfile
+from .retrieval import get_task_index
+from .workers import enqueue_pregeneration
+
+
+def _generation_fingerprint(profile):
+    """Fingerprint of the fields task sets are generated from, or None if some weren't loaded"""
+    fields = {'addiction_type', 'severity', 'triggers', 'recovery_goals'}
+    if fields & profile.get_deferred_fields():
+        return None
+    return profile_fingerprint(profile, 0)
+
+
+@receiver(post_init, sender=AddictionProfile)
+def remember_generation_fingerprint(sender, instance, **kwargs):
+    instance._generation_fingerprint = _generation_fingerprint(instance)
+
+
+@receiver(post_save, sender=AddictionProfile)
+def queue_task_set_regeneration(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Regenerate the user's pre-made task sets in the background after their profile changes
+
+    Saves that leave the generation fields as they were loaded queue nothing,
+    so they don't spend the user's generation tokens.
+    """
+    if raw or not getattr(settings, 'PREGENERATE_ON_PROFILE_SAVE', True):
+        return
+    fingerprint = _generation_fingerprint(instance)
+    unchanged = fingerprint is not None and fingerprint == instance._generation_fingerprint
+    instance._generation_fingerprint = fingerprint
+    if unchanged and not created:
+        return
+    user_id = instance.user_id
+    transaction.on_commit(lambda: enqueue_pregeneration(user_id))
+
+
+@receiver(post_save, sender=AddictionProfile)
+def reindex_profile(sender, instance, raw=False, **kwargs):
+    """Keep the profile's row in the task retrieval index in step with the profile"""
+    if raw:
+        return
+    transaction.on_commit(lambda: get_task_index().update_profile(instance))
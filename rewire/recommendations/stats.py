@@ -0,0 +1,99 @@
+# tasks/stats.py
+"""
+Task statistics shared by the REST API, TaskConsumer and admin tooling
+
+Reads come from the denormalized UserStats row. The compute_* functions
+rebuild the same counters from UserTask with one conditional-aggregation
+query; they back users without a UserStats row, the rebuild_user_stats
+command and multi-user reports.
+"""
+from django.db.models import Count, Q, Sum
+
+from .models import UserStats, UserTask
+
+COUNTER_FIELDS = ['total_tasks', 'completed_tasks', 'easy_completed', 'medium_completed', 'hard_completed', 'total_marks']
+
+
+def _aggregates():
+    """Conditional aggregates for every counter, evaluated in a single query"""
+    completed = Q(completed=True)
+    return {
+        'total_tasks': Count('id'),
+        'completed_tasks': Count('id', filter=completed),
+        'easy_completed': Count('id', filter=completed & Q(task__difficulty='EASY')),
+        'medium_completed': Count('id', filter=completed & Q(task__difficulty='MEDIUM')),
+        'hard_completed': Count('id', filter=completed & Q(task__difficulty='HARD')),
+        'total_marks': Sum('marks_earned', filter=completed, default=0),
+    }
+
+
+def format_stats(counters):
+    """Shape raw counters into the stats payload returned by the REST and WebSocket APIs"""
+    total_tasks = counters['total_tasks']
+    completed_tasks = counters['completed_tasks']
+    return {
+        "total_tasks": total_tasks,
+        "completed_tasks": completed_tasks,
+        "completion_rate": round(completed_tasks / total_tasks * 100, 2) if total_tasks > 0 else 0,
+        "difficulty_breakdown": {
+            "easy": counters['easy_completed'],
+            "medium": counters['medium_completed'],
+            "hard": counters['hard_completed']
+        },
+        "total_marks": counters['total_marks']
+    }
+
+
+def _row_counters(row):
+    return {field: getattr(row, field) for field in COUNTER_FIELDS}
+
+
+def compute_user_stats(user):
+    """Compute a user's stats from UserTask in one query"""
+    return format_stats(UserTask.objects.filter(user=user).aggregate(**_aggregates()))
+
+
+async def acompute_user_stats(user):
+    """Async variant of compute_user_stats using Django's native async ORM"""
+    return format_stats(await UserTask.objects.filter(user=user).aaggregate(**_aggregates()))
+
+
+def compute_user_counters(user_ids=None):
+    """
+    Compute raw counters for many users in one grouped query
+
+    Args:
+        user_ids: Optional iterable of user ids; all users with tasks when omitted
+
+    Returns:
+        Dictionary mapping user id to its counters
+    """
+    tasks = UserTask.objects.all()
+    if user_ids is not None:
+        tasks = tasks.filter(user_id__in=user_ids)
+
+    rows = tasks.values('user_id').annotate(**_aggregates()).order_by()
+    return {row.pop('user_id'): row for row in rows}
+
+
+def compute_stats_for_users(user_ids):
+    """Stats payloads for several users (e.g. admin dashboards), in one query"""
+    counters = compute_user_counters(user_ids)
+    empty = dict.fromkeys(COUNTER_FIELDS, 0)
+    return {user_id: format_stats(counters.get(user_id, empty)) for user_id in user_ids}
+
+
+def get_user_stats(user):
+    """Get a user's stats from their UserStats row, computing them if the row is missing"""
+    row = UserStats.objects.filter(user=user).first()
+    if row is None:
+        return compute_user_stats(user)
+    return format_stats(_row_counters(row))
+
+
+async def aget_user_stats(user):
+    """Async variant of get_user_stats, for consumers running on the event loop"""
+    row = await UserStats.objects.filter(user=user).afirst()
+    if row is None:
+        return await acompute_user_stats(user)
+    return format_stats(_row_counters(row))
@@ -0,0 +1,101 @@
+# tasks/sync.py
+from django.conf import settings
+
+from .events import publish_task_changes
+from .models import UserStats, UserTask, UserTaskChange
+from .serializers import UserTaskSerializer
+
+
+def record_task_changes(user, op, user_tasks):
+    """
+    Log changes to the user's task list and publish them to TaskConsumer
+
+    Must run inside the transaction that changed the tasks. Each task gets
+    the next task_version; the log keeps the latest TASK_CHANGE_LOG_SIZE
+    entries per user. Changes are published once the transaction commits.
+
+    Args:
+        user: Owner of the tasks
+        op: UserTaskChange.OP_INSERT, OP_UPDATE or OP_COMPLETE
+        user_tasks: Changed UserTask instances, with their tasks attached
+
+    Returns:
+        The user's new task_version (None if nothing changed)
+    """
+    if not user_tasks:
+        return None
+
+    # The F() update locks the stats row, so versions are handed out in commit order
+    UserStats.increment(user, task_version=len(user_tasks))
+    version = UserStats.objects.filter(user=user).values_list('task_version', flat=True).get()
+    first = version - len(user_tasks) + 1
+
+    changes = [
+        UserTaskChange(user=user, version=first + i, op=op, data=UserTaskSerializer(user_task).data)
+        for i, user_task in enumerate(user_tasks)
+    ]
+    UserTaskChange.objects.bulk_create(changes)
+
+    log_size = getattr(settings, 'TASK_CHANGE_LOG_SIZE', 200)
+    if version > log_size:
+        UserTaskChange.objects.filter(user=user, version__lte=version - log_size).delete()
+
+    publish_task_changes(user.id, [format_change(change) for change in changes])
+    return version
+
+
+def format_change(change):
+    return {"version": change.version, "op": change.op, "user_task": change.data}
+
+
+def get_task_version(user):
+    return UserStats.objects.filter(user=user).values_list('task_version', flat=True).first() or 0
+
+
+def changes_since(user, version):
+    """
+    Changes after the given version, oldest first
+
+    Returns:
+        (current version, list of changes), or (current version, None) when
+        the log no longer reaches back to the version (or it is in the future)
+    """
+    current = get_task_version(user)
+    if version > current:
+        return current, None
+
+    changes = list(UserTaskChange.objects.filter(
+        user=user, version__gt=version, version__lte=current
+    ).order_by('version'))
+    if len(changes) != current - version:
+        return current, None
+    return current, [format_change(change) for change in changes]
+
+
+def get_task_snapshot(user):
+    """
+    The user's whole task list and the version it reflects
+
+    The version is read first: a change committing in between may already
+    be in the list and arrive again as a delta, which clients apply as an
+    upsert by user task id.
+    """
+    version = get_task_version(user)
+    user_tasks = UserTask.objects.filter(user=user).select_related('task').order_by('-assigned_at', '-id')
+    return version, UserTaskSerializer(user_tasks, many=True).data
+
+
+def resume_task_sync(user, version=None):
+    """
+    First message of a subscribe_tasks subscription
+
+    Clients resuming from a version still covered by the change log get
+    only the changes since; everyone else gets a full snapshot.
+    """
+    if version is not None:
+        current, changes = changes_since(user, version)
+        if changes is not None:
+            return {'type': 'task_changes', 'data': {'version': current, 'changes': changes}}
+
+    version, tasks = get_task_snapshot(user)
+    return {'type': 'task_snapshot', 'data': {'version': version, 'tasks': tasks}}
@@ -1,3 +1,1297 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import openai
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from channels.layers import get_channel_layer
+from rest_framework.test import APIClient
+
+from core.models import User
+from . import stats
+from .cache import TaskSetCache, profile_fingerprint
+from .events import StatsEventCoalescer, user_tasks_group
+from .llm import CircuitBreaker, CircuitOpenError, LLMClient
+from .model_router import Route, TaskRouter
+from .models import (
+    AddictionProfile, PregeneratedTaskSet, PregenerationRun, Task, TaskGenerationJob, UserStats, UserTask,
+    UserTaskChange
+)
+from .near_duplicates import SignatureCache, find_near_duplicates, task_signatures
+from .pagination import paginate_user_tasks, seek_after
+from .pregeneration import pregenerate_task_set, take_pregenerated_tasks
+from .retrieval import TaskRetrievalIndex
+from .routing import websocket_urlpatterns
+from .serializers import TaskSerializer, UserTaskSerializer
+from .providers import (
+    FALLBACK_TASKS, BaseTaskProvider, OpenAITaskProvider, TemplateTaskProvider, split_difficulty_counts
+)
+from .services import IncrementalTaskParser, TaskGenerationService, assign_tasks_to_user
+from .sync import record_task_changes, resume_task_sync
+from .throttling import RateLimited, SingleFlight, TokenBucket, generation_flights
+from .workers import TaskGenerationWorker, enqueue_generation_job, enqueue_pregeneration, fail_stale_jobs
+
+
+def make_task_data(count, prefix='Task'):
+    difficulties = [('EASY', 5), ('MEDIUM', 10), ('HARD', 15)]
+    return [
+        {
+            'title': f"{prefix} {i}",
+            'description': f"Description for {prefix.lower()} {i}",
+            'difficulty': difficulties[i % 3][0],
+            'marks': difficulties[i % 3][1]
+        }
+        for i in range(count)
+    ]
+
+
+class AssignTasksToUserTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='user@example.com', user_name='user', first_name='Test', last_name='User', mobile='0000'
+        )
+
+    def test_constant_queries_regardless_of_count(self):
+        UserStats.objects.create(user=self.user)
+
+        # savepoint, task lookup, task insert, task re-read, assignment lookup, assignment insert,
+        # stats update, version update, version read, change log insert, release (the change log
+        # is pruned too once it outgrows TASK_CHANGE_LOG_SIZE)
+        for count in (1, 9, 50):
+            with self.subTest(count=count):
+                with self.assertNumQueries(11):
+                    user_tasks = assign_tasks_to_user(self.user, make_task_data(count, prefix=f"Batch {count}"))
+                self.assertEqual(len(user_tasks), count)
+
+    def test_serializes_without_requerying(self):
+        user_tasks = assign_tasks_to_user(self.user, make_task_data(9))
+
+        with self.assertNumQueries(0):
+            data = UserTaskSerializer(user_tasks, many=True).data
+
+        self.assertTrue(all(item['id'] and item['task']['id'] and item['assigned_at'] for item in data))
+
+    def test_reuses_catalog_tasks_and_skips_existing_assignments(self):
+        assign_tasks_to_user(self.user, make_task_data(3))
+        other = User.objects.create(
+            email='other@example.com', user_name='other', first_name='Other', last_name='User', mobile='0000'
+        )
+
+        self.assertEqual(len(assign_tasks_to_user(other, make_task_data(3))), 3)
+        self.assertEqual(assign_tasks_to_user(self.user, make_task_data(3)), [])
+        self.assertEqual(Task.objects.count(), 3)
+        self.assertEqual(UserTask.objects.count(), 6)
+
+
+class StatsVariantsTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(user_name=f"stats{i}", email=f"stats{i}@example.com") for i in range(3)]
+        for i, user in enumerate(self.users[:2]):
+            user_tasks = assign_tasks_to_user(user, make_task_data(3 + i))
+            UserTask.objects.filter(id__in=[ut.id for ut in user_tasks[:i + 1]]).update(completed=True, marks_earned=5)
+
+    def test_batch_matches_single_user_stats(self):
+        user_ids = [user.id for user in self.users]
+
+        with self.assertNumQueries(1):
+            batch = stats.compute_stats_for_users(user_ids)
+
+        self.assertEqual(set(batch), set(user_ids))
+        for user in self.users:
+            self.assertEqual(batch[user.id], stats.compute_user_stats(user))
+        # The user without tasks gets zeroed stats
+        self.assertEqual(batch[self.users[2].id]['total_tasks'], 0)
+        self.assertEqual(batch[self.users[2].id]['completion_rate'], 0)
+
+    async def test_async_matches_sync(self):
+        for user in self.users:
+            self.assertEqual(await stats.aget_user_stats(user), await sync_to_async(stats.get_user_stats)(user))
+
+        # Without a UserStats row both compute from UserTask
+        await UserStats.objects.filter(user=self.users[1]).adelete()
+        self.assertEqual(
+            await stats.aget_user_stats(self.users[1]), await sync_to_async(stats.compute_user_stats)(self.users[1])
+        )
+
+
+class StatsEventCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = mock.Mock(group_send=mock.AsyncMock())
+        patcher = mock.patch('recommendations.events.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.events = StatsEventCoalescer(window=0.05)
+
+    def wait_for_sends(self, count):
+        deadline = time.monotonic() + 2
+        while self.layer.group_send.call_count < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return [call.args for call in self.layer.group_send.call_args_list]
+
+    def test_deltas_in_one_window_are_sent_once_per_user(self):
+        self.events.publish(1, completed_tasks=1, total_marks=5)
+        self.events.publish(1, completed_tasks=1, total_marks=10)
+        self.events.publish(2, total_tasks=9)
+        self.events.publish(1, total_tasks=3)
+
+        sends = self.wait_for_sends(2)
+        time.sleep(0.1)
+
+        self.assertEqual(self.layer.group_send.call_count, 2)
+        self.assertEqual(sends[0], (user_tasks_group(1), {
+            'type': 'stats_delta',
+            'data': {'delta': {'completed_tasks': 2, 'total_marks': 15, 'total_tasks': 3}, 'events': 3}
+        }))
+        self.assertEqual(sends[1][1]['data'], {'delta': {'total_tasks': 9}, 'events': 1})
+
+    def test_delta_after_a_window_opens_a_new_one(self):
+        self.events.publish(1, completed_tasks=1)
+        self.wait_for_sends(1)
+        self.events.publish(1, completed_tasks=1)
+
+        sends = self.wait_for_sends(2)
+
+        self.assertEqual([args[1]['data']['events'] for args in sends], [1, 1])
+        # The flusher thread outlives the window and is reused for the next one
+        self.assertEqual(sum(thread is self.events._flusher for thread in threading.enumerate()), 1)
+
+
+class DedupeTasksCommandTests(TestCase):
+    def setUp(self):
+        # Rows from before content hashes: bulk_create skips Task.save, so nothing is merged yet
+        self.walk, self.walk_copy, self.read = Task.objects.bulk_create([
+            Task(title="Evening Walk", description="Take a 20-minute walk.", difficulty='EASY', marks=5),
+            Task(title="evening  walk", description="Take a 20-minute walk. ", difficulty='EASY', marks=5),
+            Task(title="Read", description="Read a chapter of a book.", difficulty='EASY', marks=5),
+        ])
+        self.both = User.objects.create(user_name="both", email="both@example.com")
+        self.copy_only = User.objects.create(user_name="copy", email="copy@example.com")
+        UserTask.objects.create(user=self.both, task=self.walk)
+        UserTask.objects.create(user=self.both, task=self.walk_copy, completed=True, marks_earned=5, user_rating=4)
+        UserTask.objects.create(user=self.copy_only, task=self.walk_copy, completed=True, marks_earned=5)
+
+    def dedupe(self, *args):
+        call_command('dedupe_tasks', *args, stdout=StringIO())
+
+    def test_merges_duplicates_and_keeps_progress(self):
+        self.dedupe()
+
+        self.assertEqual(set(Task.objects.values_list('id', flat=True)), {self.walk.id, self.read.id})
+        self.walk.refresh_from_db()
+        self.assertEqual(
+            self.walk.content_hash, Task.compute_content_hash("Evening Walk", "Take a 20-minute walk.", 'EASY')
+        )
+        # The completed, rated assignment wins over the pending one and is repointed
+        self.assertEqual(
+            list(UserTask.objects.filter(user=self.both).values_list('task_id', 'completed', 'user_rating')),
+            [(self.walk.id, True, 4)]
+        )
+        self.assertEqual(
+            list(UserTask.objects.filter(user=self.copy_only).values_list('task_id', 'completed', 'marks_earned')),
+            [(self.walk.id, True, 5)]
+        )
+
+    def test_dry_run_changes_nothing(self):
+        self.dedupe('--dry-run')
+
+        self.assertEqual(Task.objects.count(), 3)
+        self.assertEqual(UserTask.objects.count(), 3)
+        self.assertFalse(Task.objects.exclude(content_hash=None).exists())
+
+
+class UserStatsCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name="counted", email="counted@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def complete(self, user_task):
+        return self.client.post(f"/tasks/{user_task.id}/complete/")
+
+    def test_counters_follow_assignment_and_completion(self):
+        user_tasks = assign_tasks_to_user(self.user, make_task_data(3))
+        response = self.complete(user_tasks[1])
+
+        self.assertEqual(response.data['total_marks'], 10)
+        self.assertEqual(stats.get_user_stats(self.user), stats.compute_user_stats(self.user))
+        self.assertEqual(stats.get_user_stats(self.user)['completed_tasks'], 1)
+
+    def test_rating_publishes_no_stats_delta(self):
+        user_task = assign_tasks_to_user(self.user, make_task_data(1))[0]
+        self.complete(user_task)
+
+        with mock.patch('recommendations.views.publish_stats_delta') as publish:
+            for rating in (4, 2):
+                response = self.client.post(f"/tasks/{user_task.id}/rate/", {"rating": rating})
+                self.assertEqual(response.status_code, 200)
+
+        # Ratings are not part of the stats payload
+        publish.assert_not_called()
+        user_task.refresh_from_db()
+        self.assertEqual(user_task.user_rating, 2)
+
+    def test_missing_row_is_seeded_from_existing_tasks(self):
+        # Tasks from before the counters existed: two assigned, the easy one completed
+        user_tasks = assign_tasks_to_user(self.user, make_task_data(2))
+        UserTask.objects.filter(id=user_tasks[0].id).update(completed=True, marks_earned=5)
+        UserStats.objects.filter(user=self.user).delete()
+
+        response = self.complete(user_tasks[1])
+
+        self.assertEqual(response.data['total_marks'], 15)
+        self.assertEqual(stats.get_user_stats(self.user), {
+            "total_tasks": 2,
+            "completed_tasks": 2,
+            "completion_rate": 100.0,
+            "difficulty_breakdown": {"easy": 1, "medium": 1, "hard": 0},
+            "total_marks": 15
+        })
+
+
+class RebuildUserStatsCommandTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(user_name=f"rebuild{i}", email=f"rebuild{i}@example.com") for i in range(3)]
+        for i, user in enumerate(self.users[:2]):
+            user_tasks = assign_tasks_to_user(user, make_task_data(3 + i))
+            UserTask.objects.filter(id__in=[ut.id for ut in user_tasks[:i + 1]]).update(completed=True, marks_earned=5)
+        # Counters drifted; the third user has a row but no tasks left
+        UserStats.objects.update(total_tasks=99, completed_tasks=42, total_marks=7)
+        UserStats.objects.create(user=self.users[2], total_tasks=3, completed_tasks=1)
+
+    def rebuild(self, *args):
+        call_command('rebuild_user_stats', *args, stdout=StringIO())
+
+    def counters(self, user):
+        return {field: getattr(UserStats.objects.get(user=user), field) for field in stats.COUNTER_FIELDS}
+
+    def test_rebuilds_computed_counters(self):
+        self.rebuild()
+
+        expected = stats.compute_user_counters([user.id for user in self.users])
+        for user in self.users[:2]:
+            self.assertEqual(self.counters(user), expected[user.id])
+        self.assertEqual(self.counters(self.users[2]), dict.fromkeys(stats.COUNTER_FIELDS, 0))
+
+    def test_only_rebuilds_given_users(self):
+        self.rebuild('--user', str(self.users[0].id))
+
+        self.assertEqual(self.counters(self.users[0]), stats.compute_user_counters([self.users[0].id])[self.users[0].id])
+        self.assertEqual(self.counters(self.users[1])['total_tasks'], 99)
+
+
+class UserTaskListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name="lister", email="lister@example.com")
+        assign_tasks_to_user(self.user, make_task_data(25))
+        # Every task assigned in the same instant, so only the id breaks ties
+        UserTask.objects.filter(user=self.user).update(assigned_at=timezone.now() - timedelta(hours=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def newest_first(self):
+        return list(UserTask.objects.filter(user=self.user).order_by('-assigned_at', '-id').values_list('id', flat=True))
+
+    def test_without_pagination_params_returns_the_whole_list(self):
+        response = self.client.get("/tasks/list/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data], self.newest_first())
+
+    def test_pages_cover_every_task_once_in_a_stable_order(self):
+        expected = self.newest_first()
+        seen = []
+        response = self.client.get("/tasks/list/", {"page_size": 7})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['id'] for item in response.data['results'])
+            if len(seen) == 7:
+                # Tasks assigned while paging are newer, so they don't shift later pages
+                assign_tasks_to_user(self.user, make_task_data(3, prefix="Later"))
+            if response.data['next_cursor'] is None:
+                break
+            response = self.client.get("/tasks/list/", {"page_size": 7, "cursor": response.data['next_cursor']})
+
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_is_rejected(self):
+        for cursor in ("not-a-cursor", "bm90fGE="):
+            response = self.client.get("/tasks/list/", {"cursor": cursor})
+            self.assertEqual(response.status_code, 400)
+
+    def test_sparse_fields(self):
+        response = self.client.get("/tasks/list/", {"page_size": 2, "fields": "id,task.title"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([set(item) for item in response.data['results']], [{'id', 'task'}] * 2)
+        self.assertEqual(set(response.data['results'][0]['task']), {'title'})
+
+    def test_whole_task_wins_over_dotted_task_fields(self):
+        response = self.client.get("/tasks/list/", {"page_size": 2, "fields": "task,task.title"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'task'})
+        self.assertEqual(set(response.data['results'][0]['task']), set(TaskSerializer.Meta.fields))
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get("/tasks/list/", {"fields": "id,secret,task.nope"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], "Unknown fields: secret, task.nope.")
+
+
+class TaskDeltaSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='user@example.com', user_name='user', first_name='Test', last_name='User', mobile='0000'
+        )
+
+    def test_snapshot_without_version(self):
+        assign_tasks_to_user(self.user, make_task_data(3))
+
+        message = resume_task_sync(self.user)
+        self.assertEqual(message['type'], 'task_snapshot')
+        self.assertEqual(message['data']['version'], 3)
+        self.assertEqual(len(message['data']['tasks']), 3)
+
+    def test_resumes_with_changes_since_version(self):
+        user_tasks = assign_tasks_to_user(self.user, make_task_data(3))
+        user_tasks[0].completed = True
+        record_task_changes(self.user, UserTaskChange.OP_COMPLETE, [user_tasks[0]])
+
+        message = resume_task_sync(self.user, version=2)
+        self.assertEqual(message['type'], 'task_changes')
+        self.assertEqual(message['data']['version'], 4)
+        self.assertEqual(
+            [(change['version'], change['op']) for change in message['data']['changes']],
+            [(3, UserTaskChange.OP_INSERT), (4, UserTaskChange.OP_COMPLETE)]
+        )
+        self.assertTrue(message['data']['changes'][-1]['user_task']['completed'])
+
+        self.assertEqual(resume_task_sync(self.user, version=4)['data']['changes'], [])
+
+    @override_settings(TASK_CHANGE_LOG_SIZE=5)
+    def test_falls_back_to_snapshot_beyond_change_log(self):
+        assign_tasks_to_user(self.user, make_task_data(8))
+
+        self.assertEqual(UserTaskChange.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(resume_task_sync(self.user, version=3)['type'], 'task_changes')
+        self.assertEqual(resume_task_sync(self.user, version=2)['type'], 'task_snapshot')
+        # A version from the future (e.g. another server's database) also gets a snapshot
+        self.assertEqual(resume_task_sync(self.user, version=99)['type'], 'task_snapshot')
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class TaskConsumerTests(TransactionTestCase):
+    async def connect(self):
+        user = await User.objects.acreate(email='socket@example.com', user_name='socket')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/tasks/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # Stats snapshot sent on connect
+        await communicator.receive_json_from()
+        return communicator
+
+    async def test_invalid_frames_get_an_error(self):
+        communicator = await self.connect()
+
+        for frame in ("not json", json.dumps(["subscribe_tasks"])):
+            await communicator.send_to(text_data=frame)
+            self.assertEqual(
+                await communicator.receive_json_from(), {'type': 'error', 'message': 'Invalid JSON format'}
+            )
+        await communicator.disconnect()
+
+    async def test_handler_errors_are_not_reported_as_invalid_frames(self):
+        communicator = await self.connect()
+
+        with mock.patch('recommendations.consumers.resume_task_sync', side_effect=AttributeError("bug")):
+            await communicator.send_to(text_data=json.dumps({"action": "subscribe_tasks"}))
+            with self.assertRaises(AttributeError):
+                await communicator.receive_from()
+
+
+class RepetitiveProvider(BaseTaskProvider):
+    """Answers every chunk with the same titles, unless the prompt lists titles to avoid"""
+
+    def __init__(self):
+        self.calls = []
+
+    def complete(self, profile, count, messages, batch=0):
+        self.calls.append(count)
+        prefix = "Extra" if "Do not reuse" in messages[-1]['content'] else "Task"
+        return json.dumps([
+            {"title": f"{prefix} {difficulty} {i}", "description": "Do it.", "difficulty": difficulty, "marks": 5}
+            for difficulty, needed in split_difficulty_counts(count).items()
+            for i in range(needed)
+        ])
+
+
+@override_settings(TASK_GENERATION_CHUNK_SIZE=9, TASK_GENERATION_MAX_COUNT=30)
+class ChunkedGenerationTests(SimpleTestCase):
+    profile = SimpleNamespace(
+        addiction_type="gaming", severity="MODERATE", triggers="boredom, stress", recovery_goals="sleep earlier"
+    )
+
+    def setUp(self):
+        caches['task_sets'].clear()
+
+    def make_service(self, provider):
+        with mock.patch('recommendations.services.get_task_router', return_value=TaskRouter([Route('test', provider)])):
+            return TaskGenerationService()
+
+    def test_large_count_is_split_into_balanced_chunks(self):
+        provider = TemplateTaskProvider()
+        service = self.make_service(provider)
+        with mock.patch.object(provider, 'complete', wraps=provider.complete) as complete:
+            tasks = service.generate_tasks(self.profile, count=30)
+
+        self.assertEqual(sorted(call.args[1] for call in complete.call_args_list), [6, 6, 9, 9])
+        self.assertEqual(len({task['title'] for task in tasks}), 30)
+        self.assertEqual(Counter(task['difficulty'] for task in tasks), {'EASY': 10, 'MEDIUM': 10, 'HARD': 10})
+
+    def test_duplicates_across_chunks_are_dropped_and_topped_up(self):
+        provider = RepetitiveProvider()
+        tasks = self.make_service(provider).generate_tasks(self.profile, count=12)
+
+        self.assertEqual(provider.calls, [6, 6, 6])
+        self.assertEqual(len({task['title'] for task in tasks}), 12)
+
+    def test_count_is_capped(self):
+        tasks = self.make_service(TemplateTaskProvider()).generate_tasks(self.profile, count=100)
+
+        self.assertEqual(len(tasks), 30)
+
+    def test_tasks_with_unusable_fields_are_dropped(self):
+        content = json.dumps([
+            {"title": None, "description": "No title", "difficulty": "EASY", "marks": 5},
+            {"title": "Blank", "description": "  ", "difficulty": "EASY", "marks": 5},
+            {"title": 42, "description": "Numeric title", "difficulty": "EASY", "marks": 5},
+            {"title": "Good", "description": "Do it.", "difficulty": "hard", "marks": "lots"},
+        ])
+
+        tasks = self.make_service(TemplateTaskProvider())._process_response(content)
+
+        self.assertEqual(tasks, [{"title": "Good", "description": "Do it.", "difficulty": "HARD", "marks": 15}])
+
+
+class IncrementalTaskParserTests(SimpleTestCase):
+    def feed_in_pieces(self, text, size):
+        parser = IncrementalTaskParser()
+        objects = []
+        for start in range(0, len(text), size):
+            objects.extend(parser.feed(text[start:start + size]))
+        return objects
+
+    def test_piece_boundaries_inside_strings(self):
+        tasks = [
+            {"title": 'Say "no" {politely}', "description": "Brackets ] [ and braces } { in text, a \\ too"},
+            {"title": "Second", "description": "Plain"},
+        ]
+        text = "Here are your tasks:\n" + json.dumps(tasks)
+
+        # Every piece size puts boundaries inside strings, escapes and between objects
+        for size in (1, 2, 3, 7):
+            self.assertEqual(self.feed_in_pieces(text, size), tasks)
+
+    def test_truncated_final_object_is_not_returned(self):
+        objects = self.feed_in_pieces('[{"title": "Done"}, {"title": "Cut o', 4)
+
+        self.assertEqual(objects, [{"title": "Done"}])
+
+    def test_malformed_object_is_skipped(self):
+        objects = self.feed_in_pieces('[{"title": "Bad",}, {"title": "Good"}] trailing {"title": "Ignored"}', 5)
+
+        self.assertEqual(objects, [{"title": "Good"}])
+
+
+class CannedProvider(BaseTaskProvider):
+    """Answers every request with the same completion text, streamed in small pieces"""
+
+    def __init__(self, content):
+        super().__init__()
+        self.content = content
+
+    def complete(self, profile, count, messages, batch=0):
+        return self.content
+
+    def stream(self, profile, count, messages, batch=0):
+        for start in range(0, len(self.content), 7):
+            yield self.content[start:start + 7]
+
+
+class StreamTasksTests(SimpleTestCase):
+    profile = SimpleNamespace(
+        addiction_type="caffeine", severity="MILD", triggers="mornings", recovery_goals="sleep better"
+    )
+
+    def setUp(self):
+        caches['task_sets'].clear()
+
+    def stream(self, content, count=9):
+        router = TaskRouter([Route('test', CannedProvider(content))])
+        with mock.patch('recommendations.services.get_task_router', return_value=router):
+            service = TaskGenerationService()
+            return service, list(service.stream_tasks(self.profile, count=count))
+
+    def test_reply_without_tasks_falls_back(self):
+        service, tasks = self.stream("Sorry, I can't help with that.")
+
+        self.assertEqual([task['title'] for task in tasks], [task['title'] for task in FALLBACK_TASKS[:9]])
+        self.assertIsNone(service.cache.get(self.profile, 9))
+
+    def test_cut_off_stream_is_topped_up_and_not_cached(self):
+        content = TemplateTaskProvider().complete(self.profile, 9, [])
+        service, tasks = self.stream(content[:len(content) // 2])
+
+        self.assertEqual(len(tasks), 9)
+        self.assertEqual(len({task['title'] for task in tasks}), 9)
+        self.assertIsNone(service.cache.get(self.profile, 9))
+
+    def test_complete_stream_is_cached(self):
+        service, tasks = self.stream(TemplateTaskProvider().complete(self.profile, 9, []))
+
+        self.assertEqual(service.cache.get(self.profile, 9), tasks)
+
+
+class DelayedProvider(BaseTaskProvider):
+    def __init__(self, model, delay, error=None):
+        super().__init__(model)
+        self.delay = delay
+        self.error = error
+
+    def complete(self, profile, count, messages, batch=0):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.model
+
+
+class OpenAITaskProviderTests(SimpleTestCase):
+    @override_settings(TASK_GENERATION_TOKENS_PER_TASK=100, TASK_GENERATION_TOKENS_OVERHEAD=50,
+                       TASK_GENERATION_MAX_TOKENS=1000)
+    def test_max_tokens_scales_with_chunk_size(self):
+        client = mock.Mock()
+        client.complete.return_value.choices = [SimpleNamespace(message=SimpleNamespace(content="[]"))]
+        with mock.patch('recommendations.providers.get_llm_client', return_value=client):
+            provider = OpenAITaskProvider(model='test')
+
+        for count, max_tokens in ((1, 150), (3, 350), (9, 950), (30, 1000)):
+            provider.complete(make_profile(), count, [])
+            self.assertEqual(client.complete.call_args.kwargs['max_tokens'], max_tokens)
+
+
+class TaskRouterTests(SimpleTestCase):
+    def make_router(self, primary, secondary):
+        return TaskRouter(
+            [Route('primary', primary), Route('fast', secondary)],
+            slo=0.5, min_samples=5, min_hedge_delay=0.1
+        )
+
+    def test_slow_primary_is_hedged(self):
+        router = self.make_router(DelayedProvider('primary', 1.0), DelayedProvider('fast', 0.05))
+        started = time.monotonic()
+
+        self.assertEqual(router.complete(None, 3, []), 'fast')
+        # Hedged at half the SLO, well before the primary answers
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(router.counters['hedged'], 1)
+        self.assertEqual(router.counters['hedge_wins'], 1)
+        self.assertEqual(router.routes[0].counters['cancelled'], 1)
+
+    def test_failed_primary_fails_over_immediately(self):
+        router = self.make_router(DelayedProvider('primary', 0, error=ValueError("down")), DelayedProvider('fast', 0))
+        started = time.monotonic()
+
+        self.assertEqual(router.complete(None, 3, []), 'fast')
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_routes_around_primary_slower_than_slo(self):
+        router = self.make_router(DelayedProvider('primary', 0), DelayedProvider('fast', 0))
+        primary, fast = router.routes
+        self.assertEqual(router.select(3), (primary, fast))
+
+        for _ in range(10):
+            primary.record(3.0, 3)
+            fast.record(0.3, 3)
+        self.assertEqual(router.select(3), (fast, primary))
+        # The hedge deadline follows the measured p95, capped at the SLO
+        self.assertLessEqual(router.hedge_delay(fast, 3), 0.5)
+
+
+class PregenerationTests(TestCase):
+    def setUp(self):
+        caches['task_sets'].clear()
+        self.profiles = []
+        for i in range(3):
+            user = User.objects.create(user_name=f"pregen{i}", email=f"pregen{i}@example.com")
+            self.profiles.append(AddictionProfile.objects.create(
+                user=user, addiction_type="gaming", severity="MODERATE", triggers=f"trigger {i}", recovery_goals="sleep"
+            ))
+        self.router = TaskRouter([Route('test', TemplateTaskProvider())])
+
+    def pregenerate(self, *args):
+        with mock.patch('recommendations.services.get_task_router', return_value=self.router):
+            call_command('pregenerate_tasks', '--date', timezone.localdate().isoformat(), *args, stdout=StringIO())
+
+    def test_pregenerated_set_is_handed_out_once(self):
+        self.pregenerate()
+        self.assertEqual(PregeneratedTaskSet.objects.count(), 3)
+
+        profile = self.profiles[0]
+        tasks = take_pregenerated_tasks(profile.user, profile, 9)
+        self.assertEqual(len(tasks), 9)
+        self.assertIsNone(take_pregenerated_tasks(profile.user, profile, 9))
+
+    def test_changed_profile_does_not_get_stale_set(self):
+        self.pregenerate()
+        profile = self.profiles[0]
+        profile.triggers = "stress"
+
+        self.assertIsNone(take_pregenerated_tasks(profile.user, profile, 9))
+
+    def test_resumes_from_checkpoint(self):
+        PregenerationRun.objects.create(for_date=timezone.localdate(), last_user_id=self.profiles[1].user_id)
+        self.pregenerate()
+
+        self.assertEqual(
+            list(PregeneratedTaskSet.objects.values_list('user_id', flat=True)), [self.profiles[2].user_id]
+        )
+        run = PregenerationRun.objects.get()
+        self.assertEqual(run.generated, 1)
+        self.assertIsNotNone(run.finished_at)
+
+    def test_history_is_loaded_on_the_main_thread(self):
+        threads = []
+        load_history = TaskGenerationService.recent_task_history
+
+        def recent_task_history(service, profile):
+            threads.append(threading.current_thread())
+            return load_history(service, profile)
+
+        with mock.patch.object(TaskGenerationService, 'recent_task_history', recent_task_history):
+            self.pregenerate()
+
+        self.assertEqual(threads, [threading.main_thread()] * 3)
+
+    def test_profile_save_queues_regeneration(self):
+        profile = self.profiles[0]
+        with mock.patch('recommendations.signals.enqueue_pregeneration') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.triggers = "stress"
+                profile.save()
+
+        enqueue.assert_called_once_with(profile.user_id)
+
+    def test_saves_that_keep_the_fingerprint_queue_nothing(self):
+        profile = AddictionProfile.objects.get(id=self.profiles[0].id)
+        with mock.patch('recommendations.signals.enqueue_pregeneration') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.save()
+                # Normalised away by the fingerprint
+                profile.triggers = "Trigger 0 "
+                profile.save(update_fields=['triggers'])
+                profile.triggers = "stress"
+                profile.save()
+                profile.save()
+
+        enqueue.assert_called_once_with(profile.user_id)
+
+    def test_short_sets_are_not_stored(self):
+        profile = self.profiles[0]
+        service = mock.Mock(generate_tasks=mock.Mock(return_value=make_task_data(5)))
+
+        with self.assertRaises(ValueError):
+            pregenerate_task_set(profile, timezone.localdate(), count=9, service=service)
+        self.assertFalse(PregeneratedTaskSet.objects.exists())
+
+        with mock.patch.object(TaskGenerationService, 'generate_tasks', return_value=make_task_data(5)):
+            self.pregenerate()
+        self.assertFalse(PregeneratedTaskSet.objects.exists())
+        self.assertEqual(PregenerationRun.objects.get().failed, 3)
+
+    def enqueue_sends(self, user_id, times, bucket=None):
+        """Messages sent to the worker by `times` enqueue_pregeneration calls"""
+        layer = mock.Mock(send=mock.AsyncMock())
+        bucket = bucket or TokenBucket('test-pregeneration', 100, 60)
+        with mock.patch('recommendations.workers.get_channel_layer', return_value=layer), \
+                mock.patch('recommendations.workers.user_generation_bucket', bucket):
+            for _ in range(times):
+                enqueue_pregeneration(user_id)
+        return layer.send.call_count
+
+    def test_saves_while_queued_join_the_queued_regeneration(self):
+        profile = self.profiles[0]
+        self.assertEqual(self.enqueue_sends(profile.user_id, 3), 1)
+
+        # Once the worker picks it up, the next save queues a new run
+        with mock.patch('recommendations.workers.regenerate_for_profile'):
+            TaskGenerationWorker().pregenerate_tasks({'user_id': profile.user_id})
+        self.assertEqual(self.enqueue_sends(profile.user_id, 1), 1)
+
+    def test_regeneration_is_charged_to_the_generation_bucket(self):
+        profile = self.profiles[0]
+        bucket = TokenBucket('test-pregeneration-limited', 1, 1)
+        self.assertEqual(self.enqueue_sends(profile.user_id, 1, bucket), 1)
+        with mock.patch('recommendations.workers.regenerate_for_profile'):
+            TaskGenerationWorker().pregenerate_tasks({'user_id': profile.user_id})
+
+        self.assertEqual(self.enqueue_sends(profile.user_id, 1, bucket), 0)
+
+
+class TaskReuseTests(TestCase):
+    def make_user(self, name, addiction_type, triggers, goals):
+        user = User.objects.create(user_name=name, email=f"{name}@example.com")
+        AddictionProfile.objects.create(
+            user=user, addiction_type=addiction_type, severity="MODERATE", triggers=triggers, recovery_goals=goals
+        )
+        return user
+
+    def rate(self, user, prefix, rating):
+        user_tasks = assign_tasks_to_user(user, make_task_data(3, prefix=prefix))
+        for user_task in user_tasks:
+            user_task.completed = True
+            user_task.user_rating = rating
+            user_task.save()
+        return user_tasks
+
+    def setUp(self):
+        self.gamer = self.make_user("gamer", "gaming", "boredom, late nights", "sleep earlier")
+        self.drinker = self.make_user("drinker", "alcohol", "parties, work stress", "stay sober")
+        self.newcomer = self.make_user("newcomer", "Gaming", "late nights, boredom", "sleep earlier, exercise")
+        self.rate(self.gamer, "Gaming", 5)
+        self.rate(self.drinker, "Alcohol", 5)
+        self.index = TaskRetrievalIndex()
+
+    def test_similar_profiles_tasks_rank_first(self):
+        results = self.index.similar_tasks(self.newcomer.addiction_profile, exclude_user_id=self.newcomer.id)
+        titles = [task['title'] for _, task, _ in results]
+
+        self.assertEqual(len(titles), 3)
+        self.assertTrue(all(title.startswith("Gaming") for title in titles))
+
+    @override_settings(TASK_REUSE_MAX_SHARE=1.0)
+    def test_service_fills_slots_without_generating(self):
+        router = TaskRouter([Route('test', TemplateTaskProvider())])
+        with mock.patch('recommendations.services.get_task_router', return_value=router), \
+                mock.patch('recommendations.services.get_task_index', return_value=self.index):
+            tasks = TaskGenerationService().reuse_rated_tasks(self.newcomer.addiction_profile, 9)
+
+        # One highly rated task per difficulty is available: one whole triple
+        self.assertEqual(Counter(task['difficulty'] for task in tasks), {'EASY': 1, 'MEDIUM': 1, 'HARD': 1})
+
+    def test_new_ratings_are_indexed_incrementally(self):
+        self.index.similar_tasks(self.newcomer.addiction_profile)
+        poker = self.make_user("poker", "gambling", "payday", "save money")
+        user_task = self.rate(poker, "Gambling", 4)[0]
+
+        with self.assertNumQueries(1):
+            self.index.record_rating(user_task)
+        results = self.index.similar_tasks(poker.addiction_profile, exclude_user_id=self.newcomer.id)
+        self.assertEqual(results[0][1]['title'], user_task.task.title)
+
+
+def make_task(title, description, difficulty='EASY'):
+    return {'title': title, 'description': description, 'difficulty': difficulty, 'marks': 5}
+
+
+class ScriptedProvider(BaseTaskProvider):
+    """Answers each call with the next of the given task lists"""
+
+    def __init__(self, *answers):
+        super().__init__()
+        self.answers = list(answers)
+        self.prompts = []
+
+    def complete(self, profile, count, messages, batch=0):
+        self.prompts.append(messages[-1]['content'])
+        return json.dumps(self.answers.pop(0))
+
+
+class NearDuplicateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name="repeat", email="repeat@example.com")
+        self.profile = AddictionProfile.objects.create(
+            user=self.user, addiction_type="smoking", severity="MILD", triggers="coffee", recovery_goals="quit"
+        )
+        assign_tasks_to_user(self.user, [
+            make_task("Morning Meditation", "Complete a 5-minute guided meditation focusing on cravings."),
+            make_task("Trigger Identification", "Make a list of 3 situations that triggered cravings in the past week.",
+                      'MEDIUM'),
+        ])
+        self.cache = SignatureCache()
+
+    def test_reworded_tasks_are_flagged(self):
+        history = task_signatures([make_task("Morning Meditation", "Complete a 5-minute guided meditation.")])
+        batch = task_signatures([
+            make_task("Meditate in the Morning", "Spend five minutes each morning in guided meditation."),
+            make_task("Hydration Goal", "Drink 8 glasses of water throughout the day."),
+            make_task("Hydration Goal", "Drink 8 glasses of water throughout the day."),
+        ])
+
+        # The second copy within the batch is flagged, the first is kept
+        self.assertEqual(find_near_duplicates(history, batch).tolist(), [True, False, True])
+
+    def test_only_duplicate_slots_are_regenerated(self):
+        provider = ScriptedProvider(
+            [
+                make_task("Identify Your Triggers", "List three situations in the past week that triggered cravings.",
+                          'MEDIUM'),
+                make_task("Hydration Goal", "Drink 8 glasses of water throughout the day."),
+            ],
+            [make_task("Call a Sponsor", "Call your sponsor and talk about your cravings this week.", 'MEDIUM')],
+        )
+        router = TaskRouter([Route('test', provider)])
+        with mock.patch('recommendations.services.get_task_router', return_value=router), \
+                mock.patch('recommendations.services.signature_cache', self.cache):
+            tasks = TaskGenerationService().generate_tasks(self.profile, count=2, reuse=False)
+
+        self.assertEqual([task['title'] for task in tasks], ["Call a Sponsor", "Hydration Goal"])
+        self.assertIn("- 1 MEDIUM tasks", provider.prompts[1])
+        self.assertIn("- 0 EASY tasks", provider.prompts[1])
+        self.assertIn("Trigger Identification", provider.prompts[1])
+
+    def test_duplicate_slots_are_regenerated_in_chunks(self):
+        slots = [make_task(f"Old Task {i}", f"Old description {i}") for i in range(5)]
+        provider = ScriptedProvider(
+            [make_task("Walk", "Take a walk."), make_task("Read", "Read a chapter of a book.")],
+            [make_task("Stretch", "Stretch for ten minutes."), make_task("Journal", "Write one page in a journal.")],
+            [make_task("Cook", "Cook a healthy dinner.")],
+        )
+        with mock.patch('recommendations.services.get_task_router', return_value=TaskRouter([Route('test', provider)])):
+            service = TaskGenerationService()
+            service.chunk_size = 2
+            tasks = service._regenerate_slots(self.profile, slots, task_signatures(slots), [])
+
+        self.assertEqual([task['title'] for task in tasks], ["Walk", "Read", "Stretch", "Journal", "Cook"])
+        self.assertEqual(len(provider.prompts), 3)
+        self.assertIn("- 2 EASY tasks", provider.prompts[0])
+        self.assertIn("- 1 EASY tasks", provider.prompts[2])
+        # Later chunks avoid the replacements already found
+        self.assertIn("Walk", provider.prompts[1])
+
+    def test_cached_signatures_are_extended_by_assignments(self):
+        self.cache.history(self.user.id)
+        with self.assertNumQueries(1):
+            _, titles = self.cache.history(self.user.id)
+        self.assertEqual(titles, ["Morning Meditation", "Trigger Identification"])
+
+        with mock.patch('recommendations.services.signature_cache', self.cache), \
+                self.captureOnCommitCallbacks(execute=True):
+            assign_tasks_to_user(self.user, [make_task("Evening Walk", "Take a 20-minute walk after dinner.")])
+
+        # Only the task_version is read; the entry was extended instead of reloaded
+        with self.assertNumQueries(1):
+            signatures, titles = self.cache.history(self.user.id)
+        self.assertEqual(titles, ["Morning Meditation", "Trigger Identification", "Evening Walk"])
+        self.assertEqual(len(signatures), 3)
+
+
+class RecommendedTasksViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name="again", email="again@example.com")
+        AddictionProfile.objects.create(
+            user=self.user, addiction_type="vaping", severity="MILD", triggers="exams", recovery_goals="run a 5k"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_repeat_request_gets_new_tasks(self):
+        provider = ScriptedProvider(
+            [
+                make_task("Morning Meditation", "Complete a 5-minute guided meditation focusing on cravings."),
+                make_task("Trigger Identification", "List 3 situations that triggered cravings this week.", 'MEDIUM'),
+                make_task("Support Meeting", "Attend a support group meeting online or in person.", 'HARD'),
+            ],
+            [
+                make_task("Hydration Goal", "Drink 8 glasses of water throughout the day."),
+                make_task("Call a Sponsor", "Call your sponsor and talk about your cravings this week.", 'MEDIUM'),
+                make_task("Evening Walk", "Take a 20-minute walk after dinner.", 'HARD'),
+            ],
+        )
+        router = TaskRouter([Route('test', provider)])
+        # Without replaying the first response, as for a double tap within the result TTL
+        with mock.patch('recommendations.services.get_task_router', return_value=router), \
+                mock.patch.object(generation_flights, 'result_ttl', 0):
+            first = self.client.get("/tasks/recommendations/?count=3")
+            # The profile's cached set is all assigned already, so it is generated afresh
+            second = self.client.get("/tasks/recommendations/?count=3")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(
+            [user_task['task']['title'] for user_task in second.data],
+            ["Hydration Goal", "Call a Sponsor", "Evening Walk"]
+        )
+        self.assertNotIn("Do not reuse", provider.prompts[1])
+        self.assertEqual(UserTask.objects.filter(user=self.user).count(), 6)
+
+
+class GenerationJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name="jobs", email="jobs@example.com")
+        AddictionProfile.objects.create(
+            user=self.user, addiction_type="gaming", severity="MILD", triggers="boredom", recovery_goals="sleep"
+        )
+        self.worker = TaskGenerationWorker()
+        self.worker.channel_layer = get_channel_layer()
+        self.router = TaskRouter([Route('test', TemplateTaskProvider())])
+
+    def run_job(self, job):
+        with mock.patch('recommendations.services.get_task_router', return_value=self.router):
+            self.worker.generate_tasks({'type': 'generate.tasks', 'job_id': str(job.id)})
+        job.refresh_from_db()
+
+    def age(self, job, **fields):
+        TaskGenerationJob.objects.filter(id=job.id).update(**fields)
+
+    def test_worker_completes_job(self):
+        job = enqueue_generation_job(self.user, count=3)
+        self.assertEqual(job.status, TaskGenerationJob.STATUS_PENDING)
+
+        self.run_job(job)
+        self.assertEqual(job.status, TaskGenerationJob.STATUS_COMPLETED)
+        self.assertEqual(len(job.result), 3)
+        self.assertIsNotNone(job.started_at)
+        self.assertEqual(UserTask.objects.filter(user=self.user).count(), 3)
+
+    @override_settings(TASK_GENERATION_JOB_QUEUE_TIMEOUT=60)
+    def test_job_lost_in_queue_fails_when_polled(self):
+        job = enqueue_generation_job(self.user, count=3)
+        self.age(job, created_at=timezone.now() - timedelta(seconds=61))
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f"/tasks/recommendations/jobs/{job.id}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], TaskGenerationJob.STATUS_FAILED)
+
+        # A late delivery of its message no longer runs it
+        self.run_job(job)
+        self.assertEqual(job.status, TaskGenerationJob.STATUS_FAILED)
+        self.assertFalse(UserTask.objects.filter(user=self.user).exists())
+
+    @override_settings(TASK_GENERATION_JOB_TIMEOUT=300)
+    def test_job_orphaned_while_running_is_failed(self):
+        job = enqueue_generation_job(self.user, count=3)
+        self.age(job, status=TaskGenerationJob.STATUS_RUNNING, 
+                 started_at=timezone.now() - timedelta(seconds=30))
+        self.assertEqual(fail_stale_jobs(), 0)
+
+        self.age(job, started_at=timezone.now() - timedelta(seconds=301))
+        self.assertEqual(fail_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, TaskGenerationJob.STATUS_FAILED)
+        self.assertTrue(job.error)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial_closes_or_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+
+        # One trial call at a time once the reset timeout has passed
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+@override_settings(LLM_RETRY_BACKOFF=0.01, LLM_BREAKER_FAILURES=100)
+class LLMClientTests(SimpleTestCase):
+    def make_client(self):
+        client = LLMClient(api_key='test-key')
+
+        def close():
+            if client._session is not None:
+                client._run(client._session.close())
+            client._loop.call_soon_threadsafe(client._loop.stop)
+
+        self.addCleanup(close)
+        return client
+
+    def patch_acreate(self, side_effect):
+        patcher = mock.patch('openai.ChatCompletion.acreate', new=mock.AsyncMock(side_effect=side_effect))
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_retryable_errors_are_retried(self):
+        client = self.make_client()
+        acreate = self.patch_acreate([openai.error.Timeout("slow"), openai.error.RateLimitError("busy"), "response"])
+
+        self.assertEqual(client.complete(model='test', messages=[]), "response")
+        self.assertEqual(acreate.call_count, 3)
+        self.assertEqual(client.counters["retries"], 2)
+
+    def test_non_retryable_error_fails_immediately(self):
+        client = self.make_client()
+        acreate = self.patch_acreate(openai.error.InvalidRequestError("bad request", param=None))
+
+        with self.assertRaises(openai.error.InvalidRequestError):
+            client.complete(model='test', messages=[])
+        self.assertEqual(acreate.call_count, 1)
+        self.assertEqual(client.counters["failures"], 1)
+
+    @override_settings(LLM_DEADLINE=0.3, LLM_MAX_RETRIES=1000, LLM_RETRY_BACKOFF=0.05)
+    def test_retries_stop_at_the_deadline(self):
+        client = self.make_client()
+        self.patch_acreate(openai.error.APIConnectionError("down"))
+
+        started = time.monotonic()
+        with self.assertRaises(openai.error.APIConnectionError):
+            client.complete(model='test', messages=[])
+
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertLess(client.counters["retries"], 1000)
+
+    @override_settings(LLM_BREAKER_FAILURES=1)
+    def test_open_breaker_short_circuits(self):
+        client = self.make_client()
+        acreate = self.patch_acreate(openai.error.InvalidRequestError("bad request", param=None))
+        with self.assertRaises(openai.error.InvalidRequestError):
+            client.complete(model='test', messages=[])
+
+        with self.assertRaises(CircuitOpenError):
+            client.complete(model='test', messages=[])
+        self.assertEqual(acreate.call_count, 1)
+        self.assertEqual(client.counters["short_circuited"], 1)
+
+    @override_settings(LLM_BREAKER_FAILURES=1)
+    def test_each_model_has_its_own_breaker(self):
+        client = self.make_client()
+
+        def acreate(model, **params):
+            if model == 'down':
+                raise openai.error.InvalidRequestError("bad request", param=None)
+            return "response"
+
+        self.patch_acreate(acreate)
+        with self.assertRaises(openai.error.InvalidRequestError):
+            client.complete(model='down', messages=[])
+
+        with self.assertRaises(CircuitOpenError):
+            client.complete(model='down', messages=[])
+        self.assertEqual(client.complete(model='up', messages=[]), "response")
+        self.assertEqual(client.stats()["breakers"]["up"]["state"], CircuitBreaker.CLOSED)
+
+
+def make_profile(triggers="coffee, stress", goals="sleep", severity="MODERATE"):
+    return SimpleNamespace(
+        addiction_type="smoking", severity=severity, triggers=triggers, recovery_goals=goals
+    )
+
+
+class TaskSetCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches['task_sets'].clear()
+        self.cache = TaskSetCache(max_entries=4)
+
+    def test_fingerprint_ignores_case_punctuation_and_order(self):
+        self.assertEqual(
+            profile_fingerprint(make_profile("Coffee; STRESS!"), 9),
+            profile_fingerprint(make_profile("stress,  coffee"), 9)
+        )
+        self.assertNotEqual(profile_fingerprint(make_profile(), 9), profile_fingerprint(make_profile(), 6))
+        self.assertNotEqual(
+            profile_fingerprint(make_profile(severity="MILD"), 9), profile_fingerprint(make_profile(), 9)
+        )
+
+    def test_counts_hits_and_misses(self):
+        profile = make_profile()
+        self.assertIsNone(self.cache.get(profile, 9))
+        self.cache.set(profile, 9, make_task_data(9))
+        self.cache.get(profile, 9)
+        self.cache.get(profile, 9)
+
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 1, 'hit_rate': 66.67})
+
+    def test_returned_tasks_are_copies(self):
+        profile = make_profile()
+        self.cache.set(profile, 9, make_task_data(9))
+
+        tasks = self.cache.get(profile, 9)
+        tasks[0]['title'] = "Changed"
+        tasks.pop()
+
+        self.assertEqual(self.cache.get(profile, 9), make_task_data(9))
+
+    def test_colliding_fingerprint_evicts_the_slot(self):
+        first = make_profile("trigger 0")
+        slot = self.cache._slot_key(profile_fingerprint(first, 9))
+        # Another profile whose fingerprint lands in the same slot
+        second = next(
+            profile for profile in (make_profile(f"trigger {i}") for i in range(1, 100))
+            if self.cache._slot_key(profile_fingerprint(profile, 9)) == slot
+        )
+        self.cache.set(first, 9, make_task_data(9, 'First'))
+        self.cache.set(second, 9, make_task_data(9, 'Second'))
+
+        # The evicted profile misses instead of getting the other profile's tasks
+        self.assertIsNone(self.cache.get(first, 9))
+        self.assertEqual(self.cache.get(second, 9), make_task_data(9, 'Second'))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_identical_calls_share_one_result(self):
+        flights = SingleFlight('test-flight')
+        calls = []
+        results = []
+
+        def generate():
+            calls.append(1)
+            time.sleep(0.2)
+            return [{"id": len(calls)}]
+
+        threads = [
+            threading.Thread(target=lambda: results.append(flights.do('user:1', generate)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[{"id": 1}]] * 5)
+
+    def test_leader_returns_result_when_cache_writes_fail(self):
+        flights = SingleFlight('test-flight-errors')
+        cache = flights.cache
+
+        with mock.patch.object(cache, 'set', side_effect=ConnectionError("cache down")), \
+                mock.patch.object(cache, 'delete', side_effect=ConnectionError("cache down")):
+            result = flights.do('user:1', lambda: [{"id": 1}])
+
+        self.assertEqual(result, [{"id": 1}])
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_limited(self):
+        bucket = TokenBucket('test-bucket', capacity=3, per_minute=2)
+        for _ in range(3):
+            bucket.consume('user-1')
+
+        with self.assertRaises(RateLimited) as raised:
+            bucket.consume('user-1')
+        # One token refills in 30 seconds
+        self.assertAlmostEqual(raised.exception.retry_after, 30, delta=1)
+        # Other keys have their own bucket
+        bucket.consume('user-2')
+
+
+class UserTaskQueryPlanTests(TestCase):
+    """
+    Checks that the hot UserTask queries are served by indexes
+
+    Seeds a synthetic dataset large enough for the planner to prefer index
+    scans, then inspects EXPLAIN output. Runs against PostgreSQL in
+    production settings and against SQLite when tests use it.
+    """
+    USERS = 200
+    TASKS_PER_USER = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([
+            User(email=f"user{i}@example.com", user_name=f"user{i}", first_name='Test', last_name='User', mobile='0000')
+            for i in range(cls.USERS)
+        ])
+        difficulties = [('EASY', 5), ('MEDIUM', 10), ('HARD', 15)]
+        tasks = Task.objects.bulk_create([
+            Task(
+                title=f"Task {i}",
+                description=f"Description for task {i}",
+                difficulty=difficulties[i % 3][0],
+                marks=difficulties[i % 3][1],
+                content_hash=Task.compute_content_hash(f"Task {i}", f"Description for task {i}", difficulties[i % 3][0])
+            )
+            for i in range(cls.TASKS_PER_USER * 2)
+        ])
+        UserTask.objects.bulk_create([
+            UserTask(
+                user=user,
+                task=tasks[(u + t) % len(tasks)],
+                completed=t % 4 == 0,
+                marks_earned=tasks[(u + t) % len(tasks)].marks if t % 4 == 0 else 0
+            )
+            for u, user in enumerate(users)
+            for t in range(cls.TASKS_PER_USER)
+        ], batch_size=1000)
+        cls.user = users[cls.USERS // 2]
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, allow_sort=True):
+        plan = queryset.explain()
+        table = UserTask._meta.db_table
+        if connection.vendor == 'postgresql':
+            self.assertIn('Index', plan, plan)
+            self.assertNotIn(f"Seq Scan on {table}", plan, plan)
+            if not allow_sort:
+                self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?Sort', plan)
+        else:
+            self.assertRegex(plan, rf"SEARCH {table}\b.*USING (COVERING INDEX|INDEX|INTEGER PRIMARY KEY)", plan)
+            self.assertNotRegex(plan, rf"SCAN {table}\b", plan)
+            if not allow_sort:
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+        return plan
+
+    def list_queryset(self, **filters):
+        return UserTask.objects.filter(user=self.user, **filters).select_related('task')
+
+    def test_list_first_page(self):
+        queryset = self.list_queryset().order_by('-assigned_at', '-id')[:21]
+        self.assertUsesIndex(queryset, allow_sort=False)
+
+    def test_list_next_page(self):
+        page, next_cursor = paginate_user_tasks(self.list_queryset(), page_size=20)
+        self.assertIsNotNone(next_cursor)
+
+        queryset = seek_after(self.list_queryset(), next_cursor)
+        self.assertUsesIndex(queryset.order_by('-assigned_at', '-id')[:21])
+
+    def test_list_completed_filter(self):
+        self.assertUsesIndex(self.list_queryset(completed=True).order_by('-assigned_at', '-id')[:21])
+
+    def test_detail(self):
+        user_task = UserTask.objects.filter(user=self.user).first()
+        self.assertUsesIndex(UserTask.objects.filter(id=user_task.id, user=self.user).select_related('task'))
+
+    def test_stats_aggregate(self):
+        queryset = UserTask.objects.filter(user=self.user).values('user_id').annotate(**stats._aggregates())
+        self.assertUsesIndex(queryset)
+        self.assertEqual(stats.compute_user_stats(self.user)['total_tasks'], self.TASKS_PER_USER)
@@ -0,0 +1,239 @@
+# tasks/throttling.py
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when a follower gives up waiting for the leader's result"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one
+
+    The first caller for a key runs the function (the leader); callers that
+    arrive while it runs wait for and share its result. Threads of this
+    process wait on the leader's thread directly. Other processes sharing
+    the cache see the leader's lock and poll for its result, which is kept
+    for `result_ttl` seconds so a retry that arrives just after the leader
+    finished gets the same result instead of running again.
+
+    Results must be picklable. Errors are not shared across processes: if
+    the leader fails, the next waiting caller takes over.
+    """
+
+    def __init__(self, namespace, alias=None, lock_timeout=None, wait_timeout=None, result_ttl=None, poll_interval=0.1):
+        self.namespace = namespace
+        self.alias = alias or getattr(settings, 'TASK_CACHE_ALIAS', 'task_sets')
+        self.lock_timeout = lock_timeout or getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 90)
+        self.wait_timeout = wait_timeout or getattr(settings, 'SINGLE_FLIGHT_WAIT_TIMEOUT', 60)
+        self.result_ttl = result_ttl or getattr(settings, 'SINGLE_FLIGHT_RESULT_TTL', 10)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def do(self, key, fn):
+        """Return fn(), or the result of an identical call already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                raise SingleFlightTimeout(key)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.done.set()
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _do_shared(self, key, fn):
+        lock_key = f"{self.namespace}:lock:{key}"
+        result_key = f"{self.namespace}:result:{key}"
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            try:
+                result = self.cache.get(result_key)
+                if result is not None:
+                    return result
+                leader = self.cache.add(lock_key, uuid.uuid4().hex, timeout=self.lock_timeout)
+            except Exception as e:
+                # Without the shared cache, coalesce within this process only
+                logger.error(f"Error reading single-flight state: {str(e)}")
+                return fn()
+
+            if leader:
+                try:
+                    result = fn()
+                    self._share(result_key, result)
+                    return result
+                finally:
+                    self._release(lock_key)
+
+            if time.monotonic() >= deadline:
+                raise SingleFlightTimeout(key)
+            time.sleep(self.poll_interval)
+
+    def _share(self, result_key, result):
+        # The result is already computed; failing to share it must not fail the leader
+        try:
+            self.cache.set(result_key, result, timeout=self.result_ttl)
+        except Exception as e:
+            logger.error(f"Error sharing single-flight result: {str(e)}")
+
+    def _release(self, lock_key):
+        # An unreleased lock expires after lock_timeout; waiters then take over
+        try:
+            self.cache.delete(lock_key)
+        except Exception as e:
+            logger.error(f"Error releasing single-flight lock: {str(e)}")
+
+
+class RateLimited(Exception):
+    """Raised when a token bucket has no token left"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Rate limit exceeded ({scope})")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+# Refill the bucket for the time elapsed since it was last used, then try to take the tokens
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket of `capacity` tokens refilled at `per_minute` tokens a minute
+
+    Buckets live in Redis when the cache alias is a RedisCache, so the
+    limit holds across processes (the refill-and-take runs as one Lua
+    script). With any other cache backend, or while Redis is unreachable,
+    a per-process bucket is used instead.
+    """
+
+    def __init__(self, scope, capacity, per_minute, alias=None):
+        self.scope = scope
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.alias = alias or getattr(settings, 'TASK_CACHE_ALIAS', 'task_sets')
+        self._lock = threading.Lock()
+        self._local = {}
+
+    def consume(self, key='', tokens=1):
+        """
+        Take tokens from the key's bucket
+
+        Raises:
+            RateLimited: If the bucket has fewer tokens than requested
+        """
+        cache = caches[self.alias]
+        bucket_key = f"ratelimit:{self.scope}:{key}"
+        now = time.time()
+
+        allowed = remaining = None
+        if isinstance(cache, RedisCache):
+            try:
+                client = cache._cache.get_client(bucket_key, write=True)
+                allowed, remaining = client.eval(
+                    TOKEN_BUCKET_SCRIPT, 1, cache.make_and_validate_key(bucket_key),
+                    self.capacity, self.rate, now, tokens
+                )
+            except Exception as e:
+                logger.error(f"Error using Redis rate limiter, falling back to local buckets: {str(e)}")
+                allowed = None
+
+        if allowed is None:
+            allowed, remaining = self._consume_local(bucket_key, now, tokens)
+
+        if not int(allowed):
+            raise RateLimited(self.scope, (tokens - float(remaining)) / self.rate)
+
+    def _consume_local(self, bucket_key, now, tokens):
+        with self._lock:
+            # Forget buckets that have refilled completely; they are equivalent to new ones
+            if len(self._local) > 10000:
+                full_after = self.capacity / self.rate
+                self._local = {key: state for key, state in self._local.items() if now - state[1] < full_after}
+
+            available, last = self._local.get(bucket_key, (self.capacity, now))
+            available = min(self.capacity, available + max(0.0, now - last) * self.rate)
+            allowed = available >= tokens
+            if allowed:
+                available -= tokens
+            self._local[bucket_key] = (available, now)
+        return allowed, available
+
+
+# Concurrent identical generation requests share one result
+generation_flights = SingleFlight('generation')
+
+user_generation_bucket = TokenBucket(
+    'generation:user',
+    getattr(settings, 'GENERATION_USER_BURST', 3),
+    getattr(settings, 'GENERATION_USER_PER_MINUTE', 2),
+)
+global_generation_bucket = TokenBucket(
+    'generation:global',
+    getattr(settings, 'GENERATION_GLOBAL_BURST', 50),
+    getattr(settings, 'GENERATION_GLOBAL_PER_MINUTE', 120),
+)
+
+
+def check_generation_limits(user):
+    """
+    Take a generation token for the user and one from the global budget
+
+    Raises:
+        RateLimited: If either bucket is empty
+    """
+    user_generation_bucket.consume(user.id)
+    global_generation_bucket.consume()
@@ -9,6 +9,10 @@ urlpatterns = [
     
     # Task endpoints
     path('recommendations/', views.get_recommended_tasks, name='get_recommended_tasks'),
+    path('recommendations/jobs/<uuid:job_id>/', views.get_generation_job, name='get_generation_job'),
+    path('recommendations/cache-stats/', views.get_task_cache_stats, name='get_task_cache_stats'),
+    path('recommendations/llm-status/', views.get_llm_status, name='get_llm_status'),
+    path('recommendations/routes/', views.get_generation_routes, name='get_generation_routes'),
     path('list/', views.get_user_tasks, name='get_user_tasks'),
     path('<int:task_id>/', views.get_user_task_detail, name='get_user_task_detail'),
     path('<int:task_id>/complete/', views.complete_task, name='complete_task'),
@@ -1,22 +1,35 @@
 # tasks/views.py
-import json
 import logging
+import math
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Sum
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
-from .models import AddictionProfile, Task, UserTask
+from .models import AddictionProfile, UserTask, UserStats, UserTaskChange, TaskGenerationJob
 from .serializers import (
     AddictionProfileSerializer, 
     TaskSerializer, 
     UserTaskSerializer,
-    TaskRatingSerializer
+    TaskRatingSerializer,
+    TaskGenerationJobSerializer
 )
-from .services import TaskGenerationService
+from . import stats
+from .cache import TaskSetCache, profile_fingerprint
+from .events import publish_stats_delta
+from .llm import get_llm_client
+from .model_router import get_task_router
+from .sync import record_task_changes
+from .pagination import get_page_size, paginate_user_tasks
+from .pregeneration import take_pregenerated_tasks
+from .retrieval import get_task_index
+from .services import TaskGenerationService, assign_tasks_to_user
+from .throttling import RateLimited, SingleFlightTimeout, check_generation_limits, generation_flights
+from .workers import enqueue_generation_job, fail_stale_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -59,34 +72,37 @@ def get_recommended_tasks(request):
             )
         
         # Get number of tasks requested (default to 9 - 3 of each difficulty)
-        count = int(request.query_params.get('count', 9))
-        
-        # Generate tasks using OpenAI
-        service = TaskGenerationService()
-        task_data_list = service.generate_tasks(profile, count=count)
-        
-        # Save generated tasks and assign to user
-        user_tasks = []
-        for task_data in task_data_list:
-            # Create the task
-            task = Task.objects.create(
-                title=task_data['title'],
-                description=task_data['description'],
-                difficulty=task_data['difficulty'],
-                marks=task_data['marks']
-            )
-            
-            # Assign to user
-            user_task = UserTask.objects.create(
-                user=request.user,
-                task=task
+        max_count = getattr(settings, 'TASK_GENERATION_MAX_COUNT', 30)
+        try:
+            count = int(request.query_params.get('count', 9))
+        except ValueError:
+            count = 0
+        if not 1 <= count <= max_count:
+            return Response(
+                {"detail": f"count must be a number between 1 and {max_count}."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            user_tasks.append(user_task)
+        mode = 'async' if request.query_params.get('mode') == 'async' else 'sync'
         
-        # Serialize and return
-        serializer = UserTaskSerializer(user_tasks, many=True)
-        return Response(serializer.data)
+        # Identical requests already in flight (double taps, client retries) share one generation;
+        # only the request that actually generates is charged against the rate limits
+        key = f"{request.user.id}:{profile_fingerprint(profile, count)}:{mode}"
+        response_status, data = generation_flights.do(
+            key, lambda: _generate_recommended_tasks(request.user, profile, count, mode)
+        )
+        return Response(data, status=response_status)
         
+    except RateLimited as e:
+        return Response(
+            {"detail": "Too many task generation requests. Please try again later."},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except SingleFlightTimeout:
+        return Response(
+            {"detail": "Task generation is taking longer than expected. Please try again later."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except Exception as e:
         logger.error(f"Error generating recommended tasks: {str(e)}")
         return Response(
@@ -94,16 +110,99 @@ def get_recommended_tasks(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def _generate_recommended_tasks(user, profile, count, mode):
+    """Generate (or enqueue) tasks for the user; returns the response status and data"""
+    # Hand out the set made overnight or after the last profile change, without calling the LLM
+    task_data_list = take_pregenerated_tasks(user, profile, count) if mode == 'sync' else None
+    
+    if task_data_list is None:
+        check_generation_limits(user)
+        
+        # In job mode, hand generation to the background worker and return immediately
+        if mode == 'async':
+            job = enqueue_generation_job(user, count=count)
+            serializer = TaskGenerationJobSerializer(job)
+            return status.HTTP_202_ACCEPTED, serializer.data
+        
+        # Generate tasks using the configured provider
+        service = TaskGenerationService()
+        task_data_list = service.generate_tasks(profile, count=count)
+    
+    # Save generated tasks and assign to user
+    user_tasks = assign_tasks_to_user(user, task_data_list)
+    
+    # Serialize once; concurrent identical requests share this result
+    serializer = UserTaskSerializer(user_tasks, many=True)
+    return status.HTTP_200_OK, serializer.data
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_generation_job(request, job_id):
+    """Get the status of a background task generation job"""
+    jobs = TaskGenerationJob.objects.filter(id=job_id, user=request.user)
+    # A job lost in the queue or with its worker would otherwise stay PENDING/RUNNING forever
+    fail_stale_jobs(jobs)
+    job = get_object_or_404(jobs)
+    serializer = TaskGenerationJobSerializer(job)
+    return Response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_task_cache_stats(request):
+    """Get hit/miss counters for the generated task set cache"""
+    return Response(TaskSetCache().stats())
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_llm_status(request):
+    """Get the task generation LLM client's per-model circuit breaker states and call counters"""
+    try:
+        return Response(get_llm_client().stats())
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_generation_routes(request):
+    """Get per-route latency percentiles and hedging counters of task generation"""
+    try:
+        return Response(get_task_router().stats())
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_tasks(request):
-    """Get all tasks assigned to the current user"""
+    """
+    Get the tasks assigned to the current user, newest first
+    
+    Passing cursor or page_size opts into keyset pagination: the response is
+    then {"results": [...], "next_cursor": ...}, one page at a time. Without
+    them it is the bare list of every task, as before pagination existed.
+    
+    Query params:
+        completed, difficulty: Optional filters
+        cursor: next_cursor from the previous page
+        page_size: Rows per page (capped at TASK_LIST_MAX_PAGE_SIZE)
+        fields: Optional comma-separated sparse fieldset, e.g. "id,completed,task.title"
+    """
     # Filter options
     completed = request.query_params.get('completed')
     difficulty = request.query_params.get('difficulty')
+    fields = request.query_params.get('fields')
+    fields = [name.strip() for name in fields.split(',') if name.strip()] if fields else None
+    paginated = 'cursor' in request.query_params or 'page_size' in request.query_params
+    
+    if fields is not None:
+        unknown = [name for name in fields if name not in _sparse_field_names()]
+        if unknown:
+            return Response(
+                {"detail": f"Unknown fields: {', '.join(unknown)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
     
-    # Start with all user's tasks
-    tasks = UserTask.objects.filter(user=request.user)
+    # Start with all user's tasks, joining the task in the same query
+    tasks = UserTask.objects.filter(user=request.user).select_related('task')
     
     # Apply filters if provided
     if completed is not None:
@@ -112,18 +211,62 @@ def get_user_tasks(request):
         
     if difficulty:
         tasks = tasks.filter(task__difficulty=difficulty.upper())
-        
-    # Order by newest first
-    tasks = tasks.order_by('-assigned_at')
     
-    serializer = UserTaskSerializer(tasks, many=True)
-    return Response(serializer.data)
+    # Only load the columns the sparse fieldset needs (skips e.g. task.description)
+    if fields is not None:
+        columns = _user_task_columns(fields)
+        if not any(column.startswith('task__') for column in columns):
+            tasks = tasks.select_related(None)
+        tasks = tasks.only(*columns)
+    
+    if not paginated:
+        serializer = UserTaskSerializer(tasks.order_by('-assigned_at', '-id'), many=True, fields=fields)
+        return Response(serializer.data)
+    
+    try:
+        page, next_cursor = paginate_user_tasks(
+            tasks,
+            cursor=request.query_params.get('cursor'),
+            page_size=get_page_size(request.query_params.get('page_size'))
+        )
+    except ValueError:
+        return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = UserTaskSerializer(page, many=True, fields=fields)
+    return Response({
+        "results": serializer.data,
+        "next_cursor": next_cursor
+    })
+
+def _sparse_field_names():
+    """Names the fields query param accepts: UserTask fields, including task, and task.<field>"""
+    task_fields = [f"task.{field}" for field in TaskSerializer.Meta.fields]
+    return set(UserTaskSerializer.Meta.fields) | set(task_fields)
+
+def _user_task_columns(fields):
+    """Map a sparse fieldset to the UserTask/Task columns needed to serialize it"""
+    user_task_fields = set(UserTaskSerializer.Meta.fields) - {'task'}
+    task_fields = set(TaskSerializer.Meta.fields)
+    
+    # Keyset pagination always needs the ordering columns
+    columns = {'id', 'assigned_at'}
+    for name in fields:
+        if name in user_task_fields:
+            columns.add(name)
+        elif name == 'task':
+            columns.update(f"task__{field}" for field in task_fields)
+        elif name.startswith('task.') and name[5:] in task_fields:
+            columns.add(f"task__{name[5:]}")
+    
+    if any(column.startswith('task__') for column in columns):
+        columns.add('task__id')
+    return columns
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_task_detail(request, task_id):
     """Get details of a specific user task"""
-    user_task = get_object_or_404(UserTask, id=task_id, user=request.user)
+    user_task = get_object_or_404(UserTask.objects.select_related('task'), id=task_id, user=request.user)
     serializer = UserTaskSerializer(user_task)
     return Response(serializer.data)
 
@@ -137,17 +280,31 @@ def complete_task(request, task_id):
         if user_task.completed:
             return Response({"detail": "Task is already marked as completed"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Mark as completed
-        user_task.completed = True
-        user_task.completed_at = timezone.now()
-        user_task.marks_earned = user_task.task.marks
-        user_task.save()
+        # Mark as completed and update the user's counters together; the
+        # conditional update guards against a concurrent completion
+        with transaction.atomic():
+            user_task.completed = True
+            user_task.completed_at = timezone.now()
+            user_task.marks_earned = user_task.task.marks
+            updated = UserTask.objects.filter(id=user_task.id, completed=False).update(
+                completed=True,
+                completed_at=user_task.completed_at,
+                marks_earned=user_task.marks_earned
+            )
+            if not updated:
+                return Response({"detail": "Task is already marked as completed"}, status=status.HTTP_400_BAD_REQUEST)
+            
+            delta = {
+                'completed_tasks': 1,
+                'total_marks': user_task.marks_earned,
+                f"{user_task.task.difficulty.lower()}_completed": 1
+            }
+            UserStats.increment(request.user, **delta)
+            publish_stats_delta(request.user.id, **delta)
+            record_task_changes(request.user, UserTaskChange.OP_COMPLETE, [user_task])
         
         # Get user's total score
-        total_marks = UserTask.objects.filter(
-            user=request.user, 
-            completed=True
-        ).aggregate(total=Sum('marks_earned'))['total'] or 0
+        total_marks = UserStats.objects.get(user=request.user).total_marks
         
         return Response({
             "message": "Task completed successfully",
@@ -179,7 +336,12 @@ def rate_task(request, task_id):
         if serializer.is_valid():
             user_task.user_rating = serializer.validated_data['rating']
             user_task.user_feedback = serializer.validated_data.get('feedback', '')
-            user_task.save()
+            with transaction.atomic():
+                # Ratings are not part of the stats payload, so no stats delta is published
+                user_task.save(update_fields=['user_rating', 'user_feedback'])
+                record_task_changes(request.user, UserTaskChange.OP_UPDATE, [user_task])
+                # Highly rated tasks become reusable for similar profiles
+                transaction.on_commit(lambda: get_task_index().record_rating(user_task))
             
             return Response({"message": "Task rated successfully"})
         else:
@@ -197,46 +359,7 @@ def rate_task(request, task_id):
 def get_user_stats(request):
     """Get user's task completion statistics"""
     try:
-        # Get total tasks
-        total_tasks = UserTask.objects.filter(user=request.user).count()
-        completed_tasks = UserTask.objects.filter(user=request.user, completed=True).count()
-        
-        # Get tasks by difficulty
-        easy_completed = UserTask.objects.filter(
-            user=request.user, 
-            completed=True,
-            task__difficulty='EASY'
-        ).count()
-        
-        medium_completed = UserTask.objects.filter(
-            user=request.user, 
-            completed=True,
-            task__difficulty='MEDIUM'
-        ).count()
-        
-        hard_completed = UserTask.objects.filter(
-            user=request.user, 
-            completed=True,
-            task__difficulty='HARD'
-        ).count()
-        
-        # Get total marks
-        total_marks = UserTask.objects.filter(
-            user=request.user, 
-            completed=True
-        ).aggregate(total=Sum('marks_earned'))['total'] or 0
-        
-        return Response({
-            "total_tasks": total_tasks,
-            "completed_tasks": completed_tasks,
-            "completion_rate": round(completed_tasks / total_tasks * 100, 2) if total_tasks > 0 else 0,
-            "difficulty_breakdown": {
-                "easy": easy_completed,
-                "medium": medium_completed,
-                "hard": hard_completed
-            },
-            "total_marks": total_marks
-        })
+        return Response(stats.get_user_stats(request.user))
         
     except Exception as e:
         logger.error(f"Error retrieving user stats: {str(e)}")
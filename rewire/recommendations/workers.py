@@ -0,0 +1,210 @@
+# tasks/workers.py
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.consumer import SyncConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+
+from .events import user_tasks_group
+from .models import AddictionProfile, TaskGenerationJob
+from .pregeneration import regenerate_for_profile
+from .serializers import UserTaskSerializer
+from .services import TaskGenerationService, assign_tasks_to_user
+from .throttling import RateLimited, global_generation_bucket, user_generation_bucket
+
+logger = logging.getLogger(__name__)
+
+# Channel the background worker listens on (python manage.py runworker task-generation)
+TASK_GENERATION_CHANNEL = 'task-generation'
+
+STALE_JOB_ERROR = "Task generation timed out. Please try again."
+
+
+def enqueue_generation_job(user, count=9):
+    """
+    Create a generation job and hand it to the background worker
+
+    Args:
+        user: The User requesting tasks
+        count: Total number of tasks to generate
+
+    Returns:
+        The created TaskGenerationJob instance
+    """
+    job = TaskGenerationJob.objects.create(user=user, count=count)
+    try:
+        async_to_sync(get_channel_layer().send)(TASK_GENERATION_CHANNEL, {
+            'type': 'generate.tasks',
+            'job_id': str(job.id),
+        })
+    except Exception as e:
+        # Left PENDING, the job is failed by fail_stale_jobs once it times out
+        logger.error(f"Error queueing task generation job {job.id}: {str(e)}")
+    return job
+
+
+def fail_stale_jobs(jobs=None):
+    """
+    Fail jobs that can no longer finish
+
+    A job still PENDING after TASK_GENERATION_JOB_QUEUE_TIMEOUT was never
+    picked up: its message expired in the channel layer or was never sent.
+    A job still RUNNING after TASK_GENERATION_JOB_TIMEOUT lost its worker.
+    The users' TaskConsumer connections are told the jobs failed.
+
+    Args:
+        jobs: TaskGenerationJob queryset to check (default: all jobs)
+
+    Returns:
+        Number of jobs failed
+    """
+    now = timezone.now()
+    queue_timeout = getattr(settings, 'TASK_GENERATION_JOB_QUEUE_TIMEOUT', 60)
+    run_timeout = getattr(settings, 'TASK_GENERATION_JOB_TIMEOUT', 5 * 60)
+    stale = (jobs if jobs is not None else TaskGenerationJob.objects.all()).filter(
+        Q(status=TaskGenerationJob.STATUS_PENDING, created_at__lt=now - timedelta(seconds=queue_timeout)) |
+        Q(status=TaskGenerationJob.STATUS_RUNNING, started_at__lt=now - timedelta(seconds=run_timeout))
+    )
+
+    failed = 0
+    for job in stale.only('id', 'user_id', 'status'):
+        # Conditional, so a job the worker claims or finishes meanwhile is left alone
+        updated = TaskGenerationJob.objects.filter(id=job.id, status=job.status).update(
+            status=TaskGenerationJob.STATUS_FAILED, error=STALE_JOB_ERROR, finished_at=now
+        )
+        if not updated:
+            continue
+        failed += 1
+        logger.error(f"Task generation job {job.id} timed out while {job.status.lower()}")
+        try:
+            _push_job_update(get_channel_layer(), job.user_id, job.id, TaskGenerationJob.STATUS_FAILED, {
+                'tasks': [], 'error': STALE_JOB_ERROR
+            })
+        except Exception as e:
+            logger.error(f"Error notifying user {job.user_id} of failed job {job.id}: {str(e)}")
+    return failed
+
+
+def _push_job_update(channel_layer, user_id, job_id, job_status, data):
+    """Send a job update to the user's TaskConsumer group via task_update"""
+    async_to_sync(channel_layer.group_send)(user_tasks_group(user_id), {
+        'type': 'task_update',
+        'data': {'job_id': str(job_id), 'status': job_status, **data}
+    })
+
+
+def _pregeneration_queued_key(user_id):
+    return f"pregeneration:queued:{user_id}"
+
+
+def _clear_pregeneration_queued(user_id):
+    try:
+        caches[getattr(settings, 'TASK_CACHE_ALIAS', 'task_sets')].delete(_pregeneration_queued_key(user_id))
+    except Exception as e:
+        logger.error(f"Error clearing queued pregeneration state: {str(e)}")
+
+
+def enqueue_pregeneration(user_id):
+    """
+    Ask the background worker to regenerate the user's pre-generated task sets
+
+    Requests made while one is still queued join it, since the worker reads
+    the profile when it starts. Each new request is charged to the user's
+    and the global generation buckets; when those are empty the sets are
+    regenerated by the next nightly run instead.
+    """
+    try:
+        # Expires in case the message is lost before the worker clears it
+        cache = caches[getattr(settings, 'TASK_CACHE_ALIAS', 'task_sets')]
+        if not cache.add(_pregeneration_queued_key(user_id), 1, timeout=getattr(settings, 'PREGENERATION_QUEUED_TTL', 10 * 60)):
+            return
+    except Exception as e:
+        logger.error(f"Error reading queued pregeneration state: {str(e)}")
+
+    try:
+        user_generation_bucket.consume(user_id)
+        global_generation_bucket.consume()
+    except RateLimited as e:
+        logger.info(f"Skipping task pregeneration for user {user_id}: {str(e)}")
+        _clear_pregeneration_queued(user_id)
+        return
+
+    try:
+        async_to_sync(get_channel_layer().send)(TASK_GENERATION_CHANNEL, {
+            'type': 'pregenerate.tasks',
+            'user_id': user_id,
+        })
+    except Exception as e:
+        # The set is regenerated by the next nightly run instead
+        logger.error(f"Error queueing task pregeneration for user {user_id}: {str(e)}")
+        _clear_pregeneration_queued(user_id)
+
+
+class TaskGenerationWorker(SyncConsumer):
+    """Runs queued task generation jobs outside the request cycle"""
+
+    def generate_tasks(self, event):
+        # Jobs that expired in the queue or were orphaned by a crashed worker won't reach this handler
+        fail_stale_jobs()
+
+        try:
+            job = TaskGenerationJob.objects.select_related('user').get(id=event['job_id'])
+        except TaskGenerationJob.DoesNotExist:
+            logger.error(f"Task generation job {event['job_id']} not found")
+            return
+
+        # Claim the job, unless it was already run or failed as stale
+        job.status = TaskGenerationJob.STATUS_RUNNING
+        job.started_at = timezone.now()
+        claimed = TaskGenerationJob.objects.filter(id=job.id, status=TaskGenerationJob.STATUS_PENDING).update(
+            status=job.status, started_at=job.started_at
+        )
+        if not claimed:
+            return
+
+        user_tasks = []
+        try:
+            profile = AddictionProfile.objects.get(user=job.user)
+
+            # Persist and push each task as soon as the model finishes it
+            service = TaskGenerationService()
+            for task_data in service.stream_tasks(profile, count=job.count):
+                for user_task in assign_tasks_to_user(job.user, [task_data]):
+                    user_tasks.append(user_task)
+                    self._push(job, {'task': UserTaskSerializer(user_task).data})
+
+            job.result = UserTaskSerializer(user_tasks, many=True).data
+            job.status = TaskGenerationJob.STATUS_COMPLETED
+        except Exception as e:
+            logger.error(f"Error running task generation job {job.id}: {str(e)}")
+            job.result = UserTaskSerializer(user_tasks, many=True).data
+            job.error = "Error generating task recommendations. Please try again later."
+            job.status = TaskGenerationJob.STATUS_FAILED
+
+        job.finished_at = timezone.now()
+        job.save(update_fields=['result', 'status', 'error', 'finished_at'])
+
+        # Deliver the outcome to the user's open TaskConsumer connections
+        self._push(job, {'tasks': job.result or [], 'error': job.error})
+
+    def pregenerate_tasks(self, event):
+        # Profile changes from now on need a new run
+        _clear_pregeneration_queued(event['user_id'])
+
+        try:
+            profile = AddictionProfile.objects.select_related('user').get(user_id=event['user_id'])
+        except AddictionProfile.DoesNotExist:
+            return
+
+        try:
+            regenerate_for_profile(profile)
+        except Exception as e:
+            logger.error(f"Error pregenerating tasks for user {event['user_id']}: {str(e)}")
+
+    def _push(self, job, data):
+        _push_job_update(self.channel_layer, job.user_id, job.id, job.status, data)